@@ -0,0 +1,99 @@
+"""Benchmarks de la simulación, el historial y los mapas (pytest-benchmark).
+
+Se ejecutan sin red sobre los shapefiles de ``metro_cdmx/stcmetro_shp`` y
+sobre copias escaladas de la red (ver ``network.py``)::
+
+    pytest benchmarks                                 # escalas 1, 10 y 100
+    pytest benchmarks --scales=1,10,100,1000
+    pytest benchmarks --benchmark-save=baseline       # guardar una línea base
+    pytest benchmarks --benchmark-compare             # comparar con la última
+
+Las líneas base se guardan en ``benchmarks/.benchmarks``. Al comparar, un
+benchmark cuya media empeore más de ``--regression-threshold`` (15% por
+defecto) hace fallar la corrida. Los benchmarks marcados ``heavy`` (mapas)
+sólo corren hasta ``--heavy-max-scale``.
+"""
+import os
+import sys
+
+import pytest
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+# Los módulos de metro_cdmx se importan sin prefijo de paquete
+sys.path.insert(0, os.path.join(BENCH_DIR, os.pardir, 'metro_cdmx'))
+sys.path.insert(0, BENCH_DIR)
+
+from network import write_scaled_network  # noqa: E402
+
+DEFAULT_STORAGE = 'file://./.benchmarks'
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('metro')
+    group.addoption('--scales', default='1,10,100',
+                    help='Factores de escala de la red separados por comas (1 = red original)')
+    group.addoption('--heavy-max-scale', type=int, default=10,
+                    help='Escala máxima para los benchmarks marcados heavy')
+    group.addoption('--regression-threshold', default='15%',
+                    help='Empeoramiento máximo de la media al usar --benchmark-compare')
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # Antes de que pytest-benchmark abra el almacén y lea las opciones
+    config.addinivalue_line('markers', 'heavy: benchmark costoso, limitado por --heavy-max-scale')
+    if getattr(config.option, 'benchmark_storage', None) == DEFAULT_STORAGE:
+        config.option.benchmark_storage = 'file://' + os.path.join(BENCH_DIR, '.benchmarks')
+    if getattr(config.option, 'benchmark_compare', None) and not config.option.benchmark_compare_fail:
+        from pytest_benchmark.utils import parse_compare_fail
+        config.option.benchmark_compare_fail = [
+            parse_compare_fail('mean:' + config.getoption('regression_threshold'))
+        ]
+
+
+def pytest_generate_tests(metafunc):
+    if 'scale' not in metafunc.fixturenames:
+        return
+    scales = [int(s) for s in metafunc.config.getoption('scales').split(',') if s.strip()]
+    if metafunc.definition.get_closest_marker('heavy'):
+        limite = metafunc.config.getoption('heavy_max_scale')
+        scales = [s for s in scales if s <= limite]
+    metafunc.parametrize('scale', scales, ids=[f'x{s}' for s in scales], scope='session')
+
+
+@pytest.fixture(scope='session')
+def network_files(tmp_path_factory):
+    """Fábrica de redes escaladas: ``network_files(scale) -> (shp_path, afluencia_path)``"""
+    generadas = {}
+
+    def build(scale: int):
+        if scale not in generadas:
+            destino = tmp_path_factory.mktemp(f'red_x{scale}')
+            generadas[scale] = write_scaled_network(str(destino), scale)
+        return generadas[scale]
+
+    return build
+
+
+@pytest.fixture(scope='session')
+def network(network_files, scale):
+    return network_files(scale)
+
+
+@pytest.fixture(scope='session')
+def automata(network):
+    from metro_simulation import MetroAutomata
+
+    return MetroAutomata(*network, seed=0)
+
+
+@pytest.fixture
+def branch(automata):
+    """Rama desechable de ``automata`` para los benchmarks que cambian su
+    configuración (demanda, flujos, ventanas por tramo): el autómata de la
+    sesión, que comparten los demás benchmarks, no se altera"""
+    rama = automata.fork()
+    yield rama
+    rama.set_demand(None)
+    rama.set_flow(None)
+    rama.segment_tracker = None
@@ -0,0 +1,70 @@
+"""Redes escaladas para los benchmarks.
+
+Repite la red incluida en ``stcmetro_shp/`` ``scale`` veces en una
+cuadrícula, con líneas y nombres de estación distintos en cada copia, y
+escribe un CSV de afluencia con las columnas que lee ``MetroAutomata``.
+Con ``scale=1`` se usa la red original tal cual.
+"""
+import math
+import os
+
+import numpy as np
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'metro_cdmx')
+SHP_DIR = os.path.join(BASE_DIR, 'stcmetro_shp', 'stcmetro_shp')
+LINES_FILENAME = 'STC_Metro_lineas_utm14n.shp'
+STATIONS_FILENAME = 'STC_Metro_estaciones_utm14n.shp'
+
+
+def _copy_suffix(copia: int) -> str:
+    return '' if copia == 0 else f'-{copia}'
+
+
+def _tile(gdf, scale: int):
+    """Repetir ``gdf`` en una cuadrícula desplazando cada copia en su propio CRS"""
+    import geopandas as gpd
+    import pandas as pd
+
+    minx, miny, maxx, maxy = gdf.total_bounds
+    ancho, alto = (maxx - minx) * 1.1, (maxy - miny) * 1.1
+    columnas = math.ceil(math.sqrt(scale))
+    copias = []
+    for copia in range(scale):
+        fila, columna = divmod(copia, columnas)
+        parte = gdf.copy()
+        parte.geometry = parte.geometry.translate(columna * ancho, fila * alto)
+        sufijo = _copy_suffix(copia)
+        parte['LINEA'] = parte['LINEA'].astype(str) + sufijo
+        if 'NOMBRE' in parte:
+            parte['NOMBRE'] = parte['NOMBRE'].astype(str) + sufijo
+        copias.append(parte)
+    return gpd.GeoDataFrame(pd.concat(copias, ignore_index=True), crs=gdf.crs)
+
+
+def write_scaled_network(out_dir: str, scale: int = 1, seed: int = 0):
+    """Escribir la red ``scale`` veces mayor en ``out_dir``.
+
+    Devuelve ``(ruta_shapefile_lineas, ruta_csv_afluencia)``, listas para
+    ``MetroAutomata(shp_path, afluencia_path)``.
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    os.makedirs(out_dir, exist_ok=True)
+    lineas = gpd.read_file(os.path.join(SHP_DIR, LINES_FILENAME))
+    estaciones = gpd.read_file(os.path.join(SHP_DIR, STATIONS_FILENAME))
+    if scale > 1:
+        lineas = _tile(lineas, scale)
+        estaciones = _tile(estaciones, scale)
+    shp_path = os.path.join(out_dir, LINES_FILENAME)
+    lineas.to_file(shp_path)
+    estaciones.to_file(os.path.join(out_dir, STATIONS_FILENAME))
+
+    rng = np.random.default_rng(seed)
+    afluencia_path = os.path.join(out_dir, 'afluencia.csv')
+    pd.DataFrame({
+        'linea': estaciones['LINEA'],
+        'estacion': estaciones['NOMBRE'],
+        'afluencia': rng.integers(500, 4000, len(estaciones)),
+    }).to_csv(afluencia_path, index=False)
+    return shp_path, afluencia_path
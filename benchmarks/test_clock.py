@@ -0,0 +1,147 @@
+import pytest
+
+import sim_clock
+from config import SIMULATION_MAX_BATCH
+from sim_clock import SimulationClock
+
+
+class FakeTime:
+    """Reloj de pared controlado por la prueba (parámetro ``now=``)"""
+
+    def __init__(self):
+        self.t = 1000.0
+
+    def __call__(self):
+        return self.t
+
+    def advance(self, seconds: float):
+        self.t += seconds
+
+
+@pytest.fixture
+def now():
+    return FakeTime()
+
+
+def run_due(clock):
+    pasos = clock.due()
+    clock.done(pasos)
+    return pasos
+
+
+def test_default_batch_comes_from_config(now):
+    assert SimulationClock(60, 60, now=now).max_batch == SIMULATION_MAX_BATCH
+
+
+def test_due_follows_a_fixed_schedule(now):
+    clock = SimulationClock(60, 60, now=now)
+    assert clock.step_wall == 1.0
+    assert run_due(clock) == 0
+    now.advance(0.5)
+    assert run_due(clock) == 0
+    assert clock.wait_time() == pytest.approx(0.5)
+    now.advance(0.5)
+    assert run_due(clock) == 1
+    # Un paso lento no desplaza los vencimientos siguientes
+    now.advance(2.9)
+    assert clock.lag() == 2
+    assert run_due(clock) == 2
+    assert clock.wait_time() == pytest.approx(0.1)
+    assert clock.steps == 3
+
+
+def test_due_without_done_keeps_the_debt(now):
+    clock = SimulationClock(60, 60, now=now)
+    now.advance(3)
+    assert clock.due() == 3
+    assert clock.due() == 3
+    clock.done(1)
+    assert clock.due() == 2
+
+
+def test_pause_and_resume(now):
+    clock = SimulationClock(60, 60, now=now)
+    now.advance(2)
+    assert run_due(clock) == 2
+    clock.pause()
+    now.advance(100)
+    assert clock.due() == 0
+    assert clock.lag() == 0
+    assert clock.wait_time() == pytest.approx(clock.min_tick * 10)
+    # Al reanudar no se cobra el tiempo en pausa
+    clock.resume()
+    assert clock.due() == 0
+    now.advance(1)
+    assert run_due(clock) == 1
+    assert clock.dropped == 0
+
+
+def test_speed_changes_the_wall_interval(now):
+    clock = SimulationClock(60, 60, now=now)
+    now.advance(0.9)
+    clock.set_speed(120)
+    assert clock.step_wall == 0.5
+    # La fracción de paso anterior al cambio se pierde: se cuenta desde ahora
+    now.advance(0.4)
+    assert run_due(clock) == 0
+    now.advance(0.1)
+    assert run_due(clock) == 1
+    with pytest.raises(ValueError):
+        clock.set_speed(0)
+
+
+def test_fast_speeds_tick_at_most_every_min_tick(now):
+    clock = SimulationClock(60, 6000, now=now)
+    now.advance(0.1)
+    assert run_due(clock) == 10
+    assert clock.wait_time() == pytest.approx(clock.min_tick)
+
+
+def test_reset_forgets_the_backlog(now):
+    clock = SimulationClock(60, 60, now=now)
+    now.advance(5)
+    assert clock.lag() == 5
+    # Tras saltar a otra hora (seek) se cuenta desde el salto
+    clock.reset()
+    assert clock.lag() == 0
+    assert clock.due() == 0
+    now.advance(1)
+    assert run_due(clock) == 1
+    assert clock.dropped == 0
+
+
+def test_catchup_is_capped_and_drops_are_counted(now):
+    clock = SimulationClock(60, 60, max_batch=10, now=now)
+    now.advance(25)
+    assert run_due(clock) == 10
+    assert clock.dropped == 15
+    # El atraso descartado no vuelve
+    assert clock.lag() == 0
+    now.advance(1)
+    assert run_due(clock) == 1
+    now.advance(12)
+    assert run_due(clock) == 10
+    assert clock.dropped == 17
+
+
+def test_invalid_rates_are_rejected(now):
+    with pytest.raises(ValueError):
+        SimulationClock(0, 60, now=now)
+    with pytest.raises(ValueError):
+        SimulationClock(60, -1, now=now)
+
+
+@pytest.mark.parametrize('valor, esperado', [('07:30', 27000.0), ('1:00:30', 3630.0), ('90', 90.0)])
+def test_parse_time_of_day(valor, esperado):
+    assert sim_clock.parse_time_of_day(valor) == esperado
+    assert sim_clock.format_time_of_day(esperado + sim_clock.SECONDS_PER_DAY) == \
+        sim_clock.format_time_of_day(esperado)
+
+
+def test_parse_command():
+    assert sim_clock.parse_command('pause') == ('pause', None)
+    assert sim_clock.parse_command('seek', '08:00') == ('seek', 28800.0)
+    assert sim_clock.parse_command('speed', '2') == ('speed', 2.0)
+    for accion, valor in (('jump', None), ('seek', ''), ('speed', '0')):
+        with pytest.raises(ValueError):
+            sim_clock.parse_command(accion, valor)
@@ -0,0 +1,36 @@
+import numpy as np
+
+import demand
+
+
+def test_build_profile(benchmark, automata):
+    """Precalcular la tabla de demanda por franja (una vez al arrancar)"""
+    benchmark(demand.build_profile, automata)
+
+
+def test_advance_profile(benchmark, branch):
+    """Paso con modelo de demanda: consulta a la tabla más ruido"""
+    branch.set_demand(demand.build_profile(branch), start_seconds=8 * 3600)
+    benchmark(branch.advance)
+
+
+def test_run_day(benchmark, branch):
+    """Día de servicio completo a un paso por minuto"""
+    branch.set_demand(demand.build_profile(branch))
+    benchmark.pedantic(demand.run_day, args=(branch, 60.0), rounds=3)
+
+
+def test_random_history_does_not_feed_the_profile(branch, tmp_path):
+    """El historial del modelo aleatorio no se toma como demanda observada"""
+    from history import ColumnarHistoryStore
+    from producer import SimulationProducer
+
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    branch.step_seconds = 900
+    SimulationProducer(branch, store).advance(3 * 96)
+    base = demand.build_profile(branch)
+    assert np.array_equal(demand.build_profile(branch, history=store).table, base.table)
+    # Sólo pidiéndolo explícitamente
+    assert not np.array_equal(demand.build_profile(branch, history=store, use_history=True).table,
+                              base.table)
+    store.close()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+import ensemble
+from metro_simulation import MetroAutomata
+
+RUNS = 40
+STEPS = 12
+
+
+@pytest.fixture(scope='module')
+def cache_path(network_files, tmp_path_factory):
+    automata = MetroAutomata(*network_files(1), cache_dir=str(tmp_path_factory.mktemp('cache')))
+    return automata.cache_path
+
+
+def brute_force(cache_path, seed):
+    """Todas las corridas en memoria, como antes de reducirlas por proceso"""
+    ensemble._init_worker(cache_path, None, 'random', 'transfers')
+    automata = ensemble._template
+    valores = np.empty((RUNS, STEPS, len(automata.station_ids)), dtype=np.uint32)
+    for r, semilla in enumerate(np.random.SeedSequence(seed).spawn(RUNS)):
+        automata.restore(ensemble._initial_state)
+        automata.reseed(semilla)
+        for t in range(STEPS):
+            valores[r, t] = automata.advance()
+    return automata, valores
+
+
+def test_small_ensemble_is_exact(cache_path):
+    resumen = ensemble.run_ensemble(RUNS, STEPS, workers=1, cache_path=cache_path, seed=7,
+                                    demand_model='random', flow_model='transfers')
+    automata, valores = brute_force(cache_path, 7)
+    por_linea = np.rint(valores @ ensemble._line_matrix(automata))
+
+    for resultado, exacto in ((resumen['stations_summary'], valores),
+                              (resumen['lines_summary'], por_linea)):
+        assert (resultado['max'] == exacto.max(axis=0)).all()
+        for nombre, q in ensemble.PERCENTILES.items():
+            esperado = np.percentile(exacto, q, axis=0).astype(np.float32)
+            np.testing.assert_array_equal(resultado[nombre], esperado)
+
+
+def test_histogram_within_one_bin(cache_path):
+    automata, valores = brute_force(cache_path, 7)
+    estaciones, lineas = ensemble._limits(automata)
+    por_linea = np.rint(valores @ ensemble._line_matrix(automata))
+    semillas = np.random.SeedSequence(7).spawn(RUNS)
+    partes = [ensemble._run_batch(semillas[i:i + 15], STEPS) for i in range(0, RUNS, 15)]
+
+    for k, exacto, limite, dtype in ((0, valores, estaciones, np.uint32),
+                                     (1, por_linea, lineas, np.int64)):
+        histograma = ensemble._Partial(STEPS, limite, ensemble.HISTOGRAM_BINS)
+        for parte in partes:
+            histograma.merge(parte[k])
+        resultado = ensemble._summarize(histograma, RUNS, dtype)
+        assert (resultado['max'] == exacto.max(axis=0)).all()
+        ancho = (limite + 1) / ensemble.HISTOGRAM_BINS
+        for nombre, q in ensemble.PERCENTILES.items():
+            error = np.abs(resultado[nombre] - np.percentile(exacto, q, axis=0))
+            assert (error <= ancho).all()
+
+
+def test_workers_do_not_change_the_summary(cache_path):
+    uno = ensemble.run_ensemble(RUNS, STEPS, workers=1, cache_path=cache_path, seed=3,
+                                demand_model='random', flow_model='transfers')
+    varios = ensemble.run_ensemble(RUNS, STEPS, workers=2, cache_path=cache_path, seed=3,
+                                   demand_model='random', flow_model='transfers')
+    for grupo in ('stations_summary', 'lines_summary'):
+        for nombre in uno[grupo]:
+            np.testing.assert_array_equal(uno[grupo][nombre], varios[grupo][nombre])
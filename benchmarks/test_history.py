@@ -0,0 +1,85 @@
+import pytest
+
+from history import HistoryLogger, ColumnarHistoryStore
+
+HISTORY_ROWS = 200
+
+
+@pytest.fixture
+def state(automata):
+    return automata.get_current_state()
+
+
+@pytest.fixture
+def filled_logger(tmp_path, state):
+    logger = HistoryLogger(path=str(tmp_path / 'historial.csv'))
+    for _ in range(HISTORY_ROWS):
+        logger.log(state)
+    return logger
+
+
+@pytest.fixture
+def filled_store(tmp_path, state):
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    for i in range(HISTORY_ROWS):
+        store.log(state, timestamp=1_700_000_000 + i)
+    yield store
+    store.close()
+
+
+def test_logger_log(benchmark, tmp_path, state):
+    logger = HistoryLogger(path=str(tmp_path / 'historial.csv'))
+    benchmark(logger.log, state)
+
+
+def test_logger_log_buffered(benchmark, tmp_path, state):
+    logger = HistoryLogger(path=str(tmp_path / 'historial.csv'), buffered=True,
+                           flush_interval=3600, max_buffer_rows=10 ** 9)
+    benchmark(logger.log, state)
+    logger.close()
+
+
+def test_logger_read_all(benchmark, filled_logger):
+    benchmark(filled_logger.read_all)
+
+
+def test_store_log(benchmark, tmp_path, state):
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    benchmark(store.log, state)
+    store.close()
+
+
+def test_store_read_all(benchmark, filled_store):
+    benchmark(filled_store.read_all)
+
+
+def test_store_line_series_tail(benchmark, filled_store):
+    benchmark(filled_store.line_series, tail=20)
+
+
+def test_store_reopen_drops_partial_record(tmp_path):
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    store.log({'L1_a': 1, 'L2_b': 2}, timestamp=1_700_000_000)
+    store.close()
+    with open(store.data_path, 'ab') as f:
+        f.write(b'\0' * 5)
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    store.log({'L1_a': 3, 'L2_b': 4}, timestamp=1_700_000_001)
+    timestamps, values = store.read_range()
+    store.close()
+    assert timestamps.tolist() == [1_700_000_000, 1_700_000_001]
+    assert values.tolist() == [[1, 2], [3, 4]]
+
+
+def test_store_log_batch_matches_log(tmp_path, branch):
+    filas = [branch.advance().copy() for _ in range(4)]
+    uno = ColumnarHistoryStore(str(tmp_path / 'uno'))
+    for fila in filas:
+        uno.log(dict(zip(branch.station_ids, fila.tolist())), timestamp=1_700_000_000)
+    lote = ColumnarHistoryStore(str(tmp_path / 'lote'))
+    lote.log_batch(branch.station_ids, filas, 1_700_000_000)
+    assert uno.columns == lote.columns
+    assert (uno.read_range()[1] == lote.read_range()[1]).all()
+    assert (uno.line_series()[1][uno.lines[0]] == lote.line_series()[1][lote.lines[0]]).all()
+    uno.close()
+    lote.close()
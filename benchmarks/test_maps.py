@@ -0,0 +1,42 @@
+import pytest
+
+pytestmark = pytest.mark.heavy
+
+ANIMATION_STEPS = 200
+
+
+@pytest.fixture
+def main_module(network, tmp_path, monkeypatch):
+    """``main`` apuntando a la red escalada y con el mapa en un directorio temporal"""
+    import main
+
+    shp_path, afluencia_path = network
+    monkeypatch.setattr(main, 'SHAPEFILE_PATH', shp_path)
+    monkeypatch.setattr(main, 'AFLUENCIA_PATH', afluencia_path)
+    monkeypatch.setattr(main, 'MAP_OUTPUT_PATH', str(tmp_path / 'metro_simulation.html'))
+    monkeypatch.setattr(main, 'BASEMAP_PATH', str(tmp_path / 'metro_basemap.geojson'))
+    monkeypatch.setattr(main, 'NETWORK_CACHE_DIR', str(tmp_path / 'cache'))
+    return main
+
+
+def test_create_map(benchmark, main_module):
+    """Regenerar el mapa base completo"""
+    assert benchmark.pedantic(main_module.create_map, kwargs={'force': True}, rounds=3) is not None
+
+
+def test_create_map_current(benchmark, main_module):
+    """Arranque con el mapa base vigente: sólo se comprueba la clave"""
+    main_module.create_map()
+    assert benchmark(main_module.create_map) is not None
+
+
+def test_create_animation(benchmark, network, automata, tmp_path, monkeypatch):
+    import visualization
+    from visualization import MetroVisualizer
+
+    monkeypatch.setattr(visualization.webbrowser, 'open', lambda *args, **kwargs: None)
+    visualizer = MetroVisualizer(network[0])
+    states = automata.run_simulation(ANIMATION_STEPS)
+    benchmark.pedantic(
+        visualizer.create_animation, args=(states, str(tmp_path / 'animacion.html')), rounds=3
+    )
@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import od_flow
+
+# Escala máxima de los benchmarks por paso: en redes mayores cada origen
+# nuevo cuesta un Dijkstra y el primer paso domina la medición
+MAX_STEP_SCALE = 10
+
+
+@pytest.fixture
+def router(automata):
+    return od_flow.ODRouter(automata)
+
+
+def test_build_routes(benchmark, automata, router):
+    """Grafo de tramos y transbordos; las rutas se calculan al usarse"""
+    benchmark.pedantic(od_flow.ODRouter, args=(automata,), rounds=3)
+
+
+def test_advance_od(benchmark, branch, router, scale):
+    """Paso con ``PAIRS_PER_STEP`` viajes propagados por sus rutas"""
+    if scale > MAX_STEP_SCALE:
+        pytest.skip(f"Benchmark por paso sólo hasta la escala {MAX_STEP_SCALE}")
+    branch.set_flow(router)
+    # Primer paso fuera de la medición: llena la caché de árboles
+    branch.advance()
+    benchmark(branch.advance)
+
+
+def test_sample_trips_keeps_total(automata, router):
+    """Los pares sin ruta no se llevan parte de los viajes"""
+    people = automata.current_people.astype(float)
+    viajes = router.sample_trips(np.random.default_rng(0), people, automata.capacity.astype(float))
+    assert viajes.weight.sum() == pytest.approx(people.sum() * router.trip_rate)
+
+
+def test_route_cache_eviction_keeps_loads(network_files):
+    """Con una caché mínima (expulsando árboles en cada paso) la carga no cambia"""
+    from metro_simulation import MetroAutomata
+
+    automata = MetroAutomata(*network_files(1), seed=0)
+    completo = od_flow.ODRouter(automata, pairs_per_step=50)
+    minimo = od_flow.ODRouter(automata, pairs_per_step=50, cache_bytes=0)
+    people = automata.current_people.astype(float)
+    for semilla in range(5):
+        viajes = completo.sample_trips(np.random.default_rng(semilla), people, people)
+        assert np.array_equal(
+            viajes.origin, minimo.sample_trips(np.random.default_rng(semilla), people, people).origin
+        )
+        for a, b in zip(completo.loads(viajes), minimo.loads(viajes)):
+            np.testing.assert_allclose(a, b)
+
+
+def test_single_trip_follows_a_path(automata, router):
+    """Un viaje carga cada estación de su ruta una vez y un tramo menos que estaciones"""
+    origen = 0
+    slot = router._ensure_trees(np.array([origen]))[0]
+    # La estación alcanzable de mayor índice (en otra línea casi siempre)
+    destino = int(np.flatnonzero(router._predecessors[slot] >= 0)[-1])
+    viajes = od_flow.Trips(np.array([origen]), np.array([destino]), np.array([1.0]))
+    estaciones, tramos = router.loads(viajes)
+    assert set(np.unique(estaciones)) <= {0.0, 1.0}
+    assert estaciones[origen] == estaciones[destino] == 1.0
+    assert tramos.sum() == estaciones.sum() - 1
@@ -0,0 +1,61 @@
+from history import ColumnarHistoryStore, HistoryLogger
+from producer import SimulationProducer
+
+
+def test_catchup_batch_gets_simulated_timestamps(branch, tmp_path):
+    """Un lote de N pasos deja N registros con la hora simulada de cada uno"""
+    store = ColumnarHistoryStore(str(tmp_path / 'historial'))
+    producer = SimulationProducer(branch, store)
+    inicio = producer.sim_timestamp()
+    producer.advance(7)
+    timestamps, _ = store.read_range()
+    paso = int(branch.step_seconds)
+    assert timestamps.tolist() == [inicio + paso * k for k in range(1, 8)]
+
+    # Un cliente que pide since=<último visto> recorre todos los registros
+    vistos, since = [], inicio
+    while True:
+        filas = store.query(since=since)[:2]
+        if not filas:
+            break
+        vistos.extend(filas)
+        since = filas[-1]['timestamp']
+    assert [f['timestamp'] for f in vistos] == [f['timestamp'] for f in store.read_all()]
+    store.close()
+
+
+def test_timestamps_never_go_back(branch, tmp_path):
+    """Tras un seek a una hora anterior el historial sigue avanzando"""
+    logger = HistoryLogger(path=str(tmp_path / 'historial.csv'))
+    producer = SimulationProducer(branch, logger)
+    producer.advance(2)
+    producer.control('seek', '00:00')
+    producer._apply_commands()
+    producer.advance(2)
+    siguiente = SimulationProducer(branch, logger)
+    siguiente.advance(1)
+    timestamps = [f['timestamp'] for f in logger.read_all()]
+    assert len(timestamps) == 5
+    assert timestamps == sorted(set(timestamps))
+
+
+def test_profile_through_control_fifo(branch, tmp_path):
+    """Bajo gunicorn /debug/profile pide el perfil al productor por su FIFO"""
+    import os
+    import threading
+
+    from producer import request_profile
+
+    control_path = str(tmp_path / 'control.ctl')
+    os.mkfifo(control_path)
+    producer = SimulationProducer(branch, None, speed=branch.step_seconds * 50)
+    producer.listen(control_path)
+    hilo = threading.Thread(target=producer.run, daemon=True)
+    hilo.start()
+    try:
+        perfil = request_profile(control_path, 0.3)
+    finally:
+        producer.stop()
+        hilo.join(timeout=5)
+    assert perfil and 'run (producer.py:' in perfil
+    assert not [f for f in os.listdir(tmp_path) if '.profile.' in f]
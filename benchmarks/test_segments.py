@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+import segments
+
+
+def test_advance_tracked(benchmark, branch):
+    """Paso con la carga por tramo acumulada en las ventanas móviles"""
+    branch.track_segments()
+    benchmark(branch.advance)
+
+
+def test_hot_segments(benchmark, branch):
+    """Tramos más cargados de la ventana más larga (ordenación parcial)"""
+    branch.track_segments()
+    for _ in range(segments.DEFAULT_WINDOWS[-1]):
+        branch.advance()
+
+    def consultar():
+        carga = branch.segment_tracker.means()[-1]
+        return segments.describe(branch, segments.top_k(carga, 10), carga)
+
+    assert len(benchmark(consultar)) == min(10, len(branch._edge_src))
+
+
+@pytest.mark.parametrize('pasos', [3, 7, 12, 25])
+def test_tracker_matches_brute_force_mean(pasos):
+    ventanas = (4, 10)
+    tracker = segments.SegmentLoadTracker(5, ventanas)
+    rng = np.random.default_rng(pasos)
+    flujos = rng.integers(0, 1000, size=(pasos, 5)).astype(np.float64)
+    for flujo in flujos:
+        tracker.push(flujo)
+    esperado = np.array([flujos[-w:].mean(axis=0) for w in ventanas])
+    np.testing.assert_allclose(tracker.means(), esperado)
+
+
+def test_tracker_on_simulated_flow(branch):
+    branch.track_segments((3, 8))
+    flujos = []
+    for _ in range(20):
+        branch.advance()
+        flujos.append(np.array(branch.edge_flow, dtype=np.float64))
+    flujos = np.array(flujos)
+    np.testing.assert_allclose(branch.segment_tracker.means(),
+                               [flujos[-3:].mean(axis=0), flujos[-8:].mean(axis=0)])
+
+
+def test_top_k_order():
+    carga = np.array([5.0, 9.0, 1.0, 9.0, 7.0, 3.0])
+    assert segments.top_k(carga, 3).tolist() == [1, 3, 4]
+    assert segments.top_k(carga, 10).tolist() == [1, 3, 4, 0, 5, 2]
+    assert segments.top_k(carga, 0).tolist() == []
+
+
+def test_segments_hot_endpoint(branch, monkeypatch):
+    import main
+
+    branch.track_segments((2, 5))
+    for _ in range(6):
+        branch.advance()
+    monkeypatch.setattr(main, 'automata', branch)
+    monkeypatch.setattr(main, 'shared_sync', None)
+    client = main.app.test_client()
+
+    cuerpo = client.get('/segments/hot?k=3&window=2').get_json()
+    carga = branch.segment_tracker.means()[0]
+    assert cuerpo['window'] == 2
+    assert [s['segment'] for s in cuerpo['segments']] == segments.top_k(carga, 3).tolist()
+    for tramo in cuerpo['segments']:
+        i = tramo['segment']
+        assert tramo['from'] == branch.station_ids[branch._edge_src[i]]
+        assert tramo['to'] == branch.station_ids[branch._edge_dst[i]]
+        assert tramo['load'] == round(float(carga[i]), 1)
+    assert [s['load'] for s in cuerpo['segments']] == sorted(
+        (s['load'] for s in cuerpo['segments']), reverse=True)
+
+    assert client.get('/segments/hot').get_json()['window'] == 5
+    assert client.get('/segments/hot?window=3').status_code == 400
+    assert client.get('/segments/hot?k=0').status_code == 400
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from metro_simulation import MetroAutomata
+
+
+def test_init_cold(benchmark, network):
+    """Arranque en frío: leer shapefiles y CSV sin caché"""
+    benchmark(MetroAutomata, *network, seed=0)
+
+
+def test_init_cached(benchmark, network, tmp_path):
+    """Arranque con la caché ``.npz`` de la red ya guardada"""
+    MetroAutomata(*network, cache_dir=str(tmp_path), seed=0)
+    benchmark(MetroAutomata, *network, cache_dir=str(tmp_path), seed=0)
+
+
+def test_initialize_stations(benchmark, network):
+    automata = MetroAutomata(*network, seed=0)
+    benchmark(automata.initialize_stations)
+
+
+def test_step(benchmark, automata):
+    benchmark(automata.step)
+
+
+def test_advance(benchmark, automata):
+    benchmark(automata.advance)
+
+
+def test_run_simulation(benchmark, automata):
+    benchmark(automata.run_simulation, 10)
+
+
+def test_get_connected_stations(benchmark, automata):
+    """Consultar las vecinas de todas las estaciones de la red"""
+    station_ids = automata.station_ids
+
+    def consultar():
+        for station_id in station_ids:
+            automata.get_connected_stations(station_id)
+
+    benchmark(consultar)
+
+
+def test_snapshot(benchmark, automata, tmp_path):
+    """Punto de control del estado en disco"""
+    benchmark(automata.snapshot, str(tmp_path / 'checkpoint.npz'))
+
+
+def test_restore(benchmark, automata, tmp_path):
+    """Arranque en caliente desde un punto de control"""
+    path = str(tmp_path / 'checkpoint.npz')
+    automata.snapshot(path)
+    benchmark(automata.restore, path)
+
+
+def test_fork(benchmark, automata):
+    """Rama hipotética desde una instantánea, sin reinicializar la red"""
+    snapshot = automata.snapshot()
+    benchmark(automata.fork, snapshot, seed=1)
+
+
+def test_interchanges_ignore_spacing_and_case(branch):
+    nombre, ids = next(iter(branch.interchanges.items()))
+    i = branch.station_index[ids[-1]]
+    branch.station_names = list(branch.station_names)
+    branch.station_names[i] = '  ' + '  '.join(nombre.upper().split()) + ' '
+    branch._build_adjacency((branch.neighbor_indptr, branch.neighbor_indices))
+    assert branch.interchanges[nombre] == ids
+
+
+def test_restore_continues_the_same_trajectory(branch, tmp_path):
+    path = str(tmp_path / 'checkpoint.npz')
+    branch.snapshot(path)
+    esperado = [branch.advance().copy() for _ in range(5)]
+    branch.restore(path)
+    assert all((branch.advance() == fila).all() for fila in esperado)
+    rama = branch.fork(branch.snapshot())
+    assert (rama.advance() == branch.advance()).all()
+
+
+def test_restore_rejects_other_network(branch):
+    snapshot = branch.snapshot()
+    snapshot['schema'] = snapshot['schema'] + np.uint64(1)
+    with pytest.raises(ValueError):
+        branch.restore(snapshot)
+
+
+def test_warm_start_keeps_configured_step_seconds(branch, tmp_path, monkeypatch):
+    import producer
+
+    path = str(tmp_path / 'checkpoint.npz')
+    branch.step_seconds = 60
+    branch.snapshot(path)
+    for nombre, valor in (('CHECKPOINT_PATH', path), ('WARM_START', True),
+                          ('SIMULATION_STEP_SECONDS', 30.0), ('FLOW_MODEL', 'transfers'),
+                          ('DEMAND_MODEL', 'random')):
+        monkeypatch.setattr(producer, nombre, valor)
+    producer.configure_simulation(branch)
+    assert branch.step_seconds == 30.0
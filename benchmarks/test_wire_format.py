@@ -0,0 +1,106 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import wire_format
+from state_store import SnapshotCache
+
+SCHEMA = 0x0123456789abcdef
+
+
+def header(data: bytes):
+    return wire_format.HEADER.unpack_from(data, 0)
+
+
+def test_full_round_trip():
+    valores = np.array([0, 5, 1200, 65535], dtype=np.int64)
+    data = wire_format.encode_binary(valores, 7, SCHEMA)
+    _, _, flags, codigo, esquema, seq, base, n = header(data)
+    assert (flags, esquema, seq, base, n) == (0, SCHEMA, 7, 0, 4)
+    assert wire_format.DTYPES[codigo] == np.dtype('<u2')
+    assert len(data) == wire_format.HEADER.size + 2 * len(valores)
+    seq, decodificado = wire_format.decode_binary(data)
+    assert seq == 7
+    np.testing.assert_array_equal(decodificado, valores)
+
+
+def test_full_switches_to_uint32():
+    valores = np.array([0, 65536, 4_000_000_000], dtype=np.int64)
+    data = wire_format.encode_binary(valores, 1, SCHEMA)
+    assert wire_format.DTYPES[header(data)[3]] == np.dtype('<u4')
+    np.testing.assert_array_equal(wire_format.decode_binary(data)[1], valores)
+
+
+@pytest.mark.parametrize('salto, tipo', [(100, '<i2'), (100_000, '<i4')])
+def test_delta_round_trip(salto, tipo):
+    base = np.array([3000, 2800, 10, 0], dtype=np.int64)
+    valores = base + np.array([salto, -salto, 0, 1])
+    valores[2] = 0
+    data = wire_format.encode_binary(valores, 9, SCHEMA, base=(8, base))
+    _, _, flags, codigo, _, seq, seq_base, _ = header(data)
+    assert flags & wire_format.FLAG_DELTA
+    assert (seq, seq_base) == (9, 8)
+    assert wire_format.DTYPES[codigo] == np.dtype(tipo)
+    np.testing.assert_array_equal(wire_format.decode_binary(data, base)[1], valores)
+    with pytest.raises(ValueError):
+        wire_format.decode_binary(data)
+
+
+def test_decode_rejects_other_formats():
+    data = bytearray(wire_format.encode_binary(np.arange(3), 1, SCHEMA))
+    data[:4] = b'XXXX'
+    with pytest.raises(ValueError):
+        wire_format.decode_binary(bytes(data))
+
+
+def test_snapshot_encodings_round_trip():
+    cache = SnapshotCache()
+    anterior = {'a': 10, 'b': 70000, 'c': 5}
+    actual = {'a': 12, 'b': 69990, 'c': 5}
+    cache.update(anterior, seq=4)
+    snapshot = cache.update(actual, seq=5)
+    esperado = np.array(list(actual.values()))
+
+    data, delta = snapshot.encode('bin', SCHEMA)
+    assert not delta
+    np.testing.assert_array_equal(wire_format.decode_binary(data)[1], esperado)
+
+    data, delta = snapshot.encode('bin', SCHEMA, since=4, compress=True)
+    assert delta
+    seq, valores = wire_format.decode_binary(gzip.decompress(data), np.array(list(anterior.values())))
+    assert seq == 5
+    np.testing.assert_array_equal(valores, esperado)
+
+    # Un ``since`` que no es el paso anterior recibe el estado completo
+    data, delta = snapshot.encode('bin', SCHEMA, since=3, compress=True)
+    assert not delta
+    np.testing.assert_array_equal(wire_format.decode_binary(gzip.decompress(data))[1], esperado)
+
+    cuerpo = json.loads(snapshot.encode('json', SCHEMA, since=4)[0])
+    assert cuerpo == {'seq': 5, 'schema': format(SCHEMA, '016x'), 'base': 4, 'delta': [2, -10, 0]}
+
+
+def test_state_etag_changes_with_seq(automata, monkeypatch):
+    import main
+
+    monkeypatch.setattr(main, 'automata', automata)
+    monkeypatch.setattr(main, 'shared_sync', None)
+    monkeypatch.setattr(main, '_schema', None)
+    monkeypatch.setattr(main, '_schema_body', None)
+    monkeypatch.setattr(main, 'snapshot_cache', SnapshotCache())
+    client = main.app.test_client()
+    estado = automata.get_current_state()
+
+    main.snapshot_cache.update(estado, seq=1)
+    primero = client.get('/state')
+    assert primero.status_code == 200
+    assert client.get('/state', headers={'If-None-Match': primero.headers['ETag']}).status_code == 304
+
+    # Mismo contenido en el paso siguiente: la respuesta anterior ya no vale
+    main.snapshot_cache.update(estado, seq=2)
+    segundo = client.get('/state', headers={'If-None-Match': primero.headers['ETag']})
+    assert segundo.status_code == 200
+    assert segundo.headers['ETag'] != primero.headers['ETag']
+    assert wire_format.decode_binary(segundo.data)[0] == 2
@@ -0,0 +1,67 @@
+import os
+import subprocess
+import sys
+import time
+
+# Los módulos de metro_cdmx se importan sin prefijo de paquete
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metro_cdmx'))
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', 3))
+
+_producer = None
+_control_path = None
+
+
+def on_starting(server):
+    """Lanzar un único proceso productor antes de crear los workers.
+
+    El productor simula y publica cada paso en memoria compartida; los
+    workers heredan el nombre del segmento por variable de entorno y
+    sólo leen de ahí, así todos sirven el mismo estado.
+    """
+    global _producer, _control_path
+    import tempfile
+    from producer import SHARED_STATE_ENV, PRODUCER_METRICS_ENV, PRODUCER_CONTROL_ENV
+    from shared_state import SharedStateReader
+
+    name = f"metro_state_{os.getpid()}"
+    producer_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metro_cdmx', 'producer.py')
+    metrics_path = os.path.join(tempfile.gettempdir(), f"{name}.prom")
+    # FIFO para las órdenes del reloj (/clock/...) de los workers al productor
+    _control_path = os.path.join(tempfile.gettempdir(), f"{name}.ctl")
+    if os.path.exists(_control_path):
+        os.unlink(_control_path)
+    os.mkfifo(_control_path)
+    _producer = subprocess.Popen(
+        [sys.executable, producer_path, '--shm-name', name, '--metrics-path', metrics_path,
+         '--control-path', _control_path]
+    )
+    inicio = time.monotonic()
+    while time.monotonic() - inicio < 300:
+        if _producer.poll() is not None:
+            server.log.error("El productor de simulación terminó al arrancar")
+            return
+        try:
+            SharedStateReader(name).close()
+            break
+        except FileNotFoundError:
+            time.sleep(0.2)
+    else:
+        server.log.error("El productor de simulación no arrancó a tiempo")
+        return
+    os.environ[SHARED_STATE_ENV] = name
+    os.environ[PRODUCER_METRICS_ENV] = metrics_path
+    os.environ[PRODUCER_CONTROL_ENV] = _control_path
+    server.log.info("Productor de simulación listo (pid %s, segmento %s)", _producer.pid, name)
+
+
+def on_exit(server):
+    if _producer is not None and _producer.poll() is None:
+        _producer.terminate()
+        try:
+            _producer.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            _producer.kill()
+    if _control_path and os.path.exists(_control_path):
+        os.unlink(_control_path)
@@ -1,16 +1,131 @@
+import logging
 import os
 
+
+def _env(name, default, tipo):
+    """Valor de la variable de entorno ``name`` convertido con ``tipo``.
+
+    Si falta o está vacía se usa ``default``; si no es válida, también,
+    con un aviso (un valor mal escrito no debe impedir arrancar).
+    """
+    valor = os.environ.get(name, '')
+    if not valor.strip():
+        return default
+    try:
+        return tipo(valor)
+    except ValueError:
+        logging.getLogger(__name__).warning("%s=%r no es válido; se usa %r", name, valor, default)
+        return default
+
+
+def _env_int(name, default):
+    return _env(name, default, int)
+
+
+def _env_float(name, default):
+    return _env(name, default, float)
+
+
+def _env_ints(name, default):
+    """Lista de enteros separados por comas"""
+    return _env(name, default, lambda v: tuple(int(x) for x in v.split(',') if x.strip()))
+
+
 # Rutas de archivos
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SHAPEFILE_PATH = os.path.join(BASE_DIR, "stcmetro_shp", "stcmetro_shp", "STC_Metro_lineas_utm14n.shp")
-AFLUENCIA_PATH = os.path.join(BASE_DIR, "data-2025-06-19.csv")
+# SHAPEFILE_PATH y AFLUENCIA_PATH pueden apuntar a otra red (p. ej. una
+# generada con synthetic_network.py); el archivo de estaciones se busca
+# junto al de líneas
+SHAPEFILE_PATH = os.environ.get(
+    'SHAPEFILE_PATH', os.path.join(BASE_DIR, "stcmetro_shp", "stcmetro_shp", "STC_Metro_lineas_utm14n.shp")
+)
+AFLUENCIA_PATH = os.environ.get('AFLUENCIA_PATH', os.path.join(BASE_DIR, "data-2025-06-19.csv"))
 MAP_OUTPUT_PATH = os.path.join(BASE_DIR, "metro_simulation.html")
+# Capa estática del mapa (trazos y estaciones) servida en /basemap.geojson
+BASEMAP_PATH = os.path.join(BASE_DIR, "metro_basemap.geojson")
 
 # Parámetros de simulación
 def get_simulation_interval():
-    try:
-        return int(os.environ.get('SIMULATION_INTERVAL', 2))
-    except Exception:
-        return 2
+    return _env_int('SIMULATION_INTERVAL', 2)
 
 SIMULATION_INTERVAL = get_simulation_interval()
+
+# Semilla del generador aleatorio de la simulación (vacía = no reproducible)
+SIMULATION_SEED = _env_int('SIMULATION_SEED', None)
+
+# Modelo de demanda: 'random' (variación aleatoria) o 'profile' (afluencia
+# esperada por franja del día, ver demand.py)
+DEMAND_MODEL = os.environ.get('DEMAND_MODEL', 'random')
+DEMAND_BIN_MINUTES = _env_int('DEMAND_BIN_MINUTES', 15)
+# Con 1, las franjas con historial suficiente toman su promedio en lugar de la
+# curva del CSV. Sólo tiene sentido si el historial viene del modelo 'profile'
+# (con 'random' el simulador se tomaría a sí mismo como demanda observada)
+DEMAND_FROM_HISTORY = os.environ.get('DEMAND_FROM_HISTORY', '0') == '1'
+# Segundos simulados por paso y hora de inicio ("HH:MM"; vacía = hora actual)
+SIMULATION_STEP_SECONDS = _env_float('SIMULATION_STEP_SECONDS', 60)
+SIMULATION_START = os.environ.get('SIMULATION_START', '')
+# Movimiento entre estaciones: 'transfers' (a las vecinas) u 'od' (viajes
+# origen–destino por la ruta más corta, ver od_flow.py)
+FLOW_MODEL = os.environ.get('FLOW_MODEL', 'transfers')
+OD_PAIRS_PER_STEP = _env_int('OD_PAIRS_PER_STEP', 2000)
+OD_TRIP_RATE = _env_float('OD_TRIP_RATE', 0.05)
+OD_TRANSFER_COST = _env_float('OD_TRANSFER_COST', 2.0)
+# Ventanas móviles (en pasos) de la carga por tramo de /segments/hot
+SEGMENT_WINDOWS = _env_ints('SEGMENT_WINDOWS', (10, 60))
+# Velocidad: segundos simulados por segundo real (60 = un minuto por
+# segundo); vacía = un paso cada SIMULATION_INTERVAL segundos
+SIMULATION_SPEED = _env_float('SIMULATION_SPEED', None)
+# Pasos máximos por tic al recuperar atraso (el resto se descarta)
+SIMULATION_MAX_BATCH = _env_int('SIMULATION_MAX_BATCH', 500)
+
+# Caché binaria de la red (estaciones, coordenadas, trazos y adyacencia)
+NETWORK_CACHE_DIR = os.environ.get('NETWORK_CACHE_DIR', os.path.join(BASE_DIR, "cache"))
+
+# Punto de control del estado de la simulación (ver MetroAutomata.snapshot):
+# se guarda cada CHECKPOINT_EVERY pasos (0 = nunca) y al detener el
+# productor; con WARM_START=1 el arranque continúa desde él
+CHECKPOINT_PATH = os.environ.get('CHECKPOINT_PATH', os.path.join(NETWORK_CACHE_DIR, "checkpoint.npz"))
+CHECKPOINT_EVERY = _env_int('CHECKPOINT_EVERY', 100)
+WARM_START = os.environ.get('WARM_START', '1') != '0'
+
+# Historial de afluencia: 'columnar' (binario, con consultas por rango) o 'csv'.
+# Si sólo existe el CSV, la primera apertura columnar lo migra
+HISTORY_BACKEND = os.environ.get('HISTORY_BACKEND', 'columnar')
+# Escritura del CSV con búfer y vaciado en segundo plano
+HISTORY_BUFFERED = os.environ.get('HISTORY_BUFFERED', '1') != '0'
+HISTORY_FLUSH_INTERVAL = _env_float('HISTORY_FLUSH_INTERVAL', 5)
+HISTORY_MAX_BUFFER_ROWS = _env_int('HISTORY_MAX_BUFFER_ROWS', 50)
+HISTORY_FSYNC = os.environ.get('HISTORY_FSYNC', '0') == '1'
+
+# Servidor WebSocket que envía cada paso a los mapas conectados
+WEBSOCKET_PORT = _env_int('WEBSOCKET_PORT', 8765)
+WEBSOCKET_QUEUE_SIZE = _env_int('WEBSOCKET_QUEUE_SIZE', 8)
+
+# Registro (logging): nivel general, niveles por módulo y resumen periódico
+# LOG_LEVELS admite "modulo=NIVEL" separados por comas, p. ej.
+# "metro_simulation=DEBUG,history=WARNING" (DEBUG en metro_simulation
+# muestra el detalle de cada estación en cada paso).
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', '%(asctime)s %(levelname)s [%(name)s] %(message)s')
+# Cada cuántos pasos registrar una línea de resumen de la red (0 = nunca)
+STEP_SUMMARY_EVERY = _env_int('STEP_SUMMARY_EVERY', 10)
+
+# Métricas (/metrics) y perfilado por muestreo (/debug/profile)
+# Cada cuántos pasos el productor vuelca sus métricas para los workers
+METRICS_DUMP_EVERY = _env_int('METRICS_DUMP_EVERY', 5)
+# /debug/profile expone las pilas del proceso: desactivado salvo PROFILE_ENABLED=1.
+# Bajo gunicorn muestrea el bucle del productor (el pedido va por su FIFO de
+# control); el worker espera la respuesta, así que PROFILE_MAX_SECONDS debe
+# quedar por debajo del timeout de gunicorn (30 s por omisión)
+PROFILE_ENABLED = os.environ.get('PROFILE_ENABLED', '0') == '1'
+PROFILE_MAX_SECONDS = _env_float('PROFILE_MAX_SECONDS', 20)
+
+
+def configure_logging():
+    """Configurar el registro según LOG_LEVEL, LOG_LEVELS y LOG_FORMAT"""
+    logging.basicConfig(level=LOG_LEVEL, format=LOG_FORMAT)
+    for item in LOG_LEVELS.split(','):
+        if '=' in item:
+            modulo, nivel = item.split('=', 1)
+            logging.getLogger(modulo.strip()).setLevel(nivel.strip().upper())
@@ -0,0 +1,150 @@
+"""Modelo de demanda por hora del día.
+
+Se precalcula una sola vez una tabla ``[estaciones, franjas]`` con la
+afluencia objetivo de cada estación en cada franja del día (15 minutos por
+omisión). El nivel de cada estación sale del CSV de afluencia (promedio de
+sus registros) y la forma del día de una curva típica de días hábiles;
+con ``DEMAND_FROM_HISTORY`` y historial columnar suficiente, sus promedios
+por franja de hora simulada sustituyen a la curva. En cada paso ``MetroAutomata.advance()`` sólo consulta la
+columna de la franja actual y añade ruido.
+"""
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from config import DEMAND_FROM_HISTORY
+from metro_simulation import _normalize_line, _normalize_name
+
+SECONDS_PER_DAY = 24 * 3600
+
+# Peso relativo de cada hora (0-23) en un día hábil: servicio de 5:00 a
+# 24:00 con picos de entrada (7-9 h) y de salida (18-20 h)
+WEEKDAY_CURVE = np.array([
+    0.05, 0.02, 0.02, 0.02, 0.05, 0.35, 0.90, 1.80, 2.00, 1.40, 1.00, 0.95,
+    1.00, 1.05, 1.10, 1.10, 1.25, 1.55, 1.95, 1.85, 1.30, 0.85, 0.55, 0.30,
+])
+# Franjas con al menos estas muestras en el historial usan su promedio
+MIN_HISTORY_SAMPLES = 3
+
+logger = logging.getLogger(__name__)
+
+
+class DemandProfile:
+    """Tabla de afluencia objetivo ``[estaciones, franjas]`` y su consulta por hora"""
+
+    def __init__(self, table: np.ndarray, noise: float = 0.05, relaxation_seconds: float = 900.0):
+        self.table = np.ascontiguousarray(table, dtype=np.float64)
+        self.bins = self.table.shape[1]
+        self.bin_seconds = SECONDS_PER_DAY / self.bins
+        # Ruido relativo al objetivo y tiempo característico para alcanzarlo
+        self.noise = noise
+        self.relaxation_seconds = relaxation_seconds
+
+    def bin_of(self, seconds: float) -> int:
+        return int(seconds % SECONDS_PER_DAY // self.bin_seconds)
+
+    def target(self, seconds: float) -> np.ndarray:
+        """Afluencia objetivo de todas las estaciones a los ``seconds`` del día"""
+        return self.table[:, self.bin_of(seconds)]
+
+    def relaxation(self, step_seconds: float) -> float:
+        """Fracción de la distancia al objetivo que se recorre en un paso"""
+        return float(-np.expm1(-step_seconds / self.relaxation_seconds))
+
+
+def day_curve(bins: int) -> np.ndarray:
+    """``WEEKDAY_CURVE`` interpolada a ``bins`` franjas, con promedio 1"""
+    horas = (np.arange(bins) + 0.5) * 24 / bins
+    curva = np.interp(horas, np.arange(24) + 0.5, WEEKDAY_CURVE, period=24)
+    return curva / curva.mean()
+
+
+def station_levels(automata, afluencia_data=None) -> np.ndarray:
+    """Nivel medio de cada estación: promedio del CSV o, si falta, su afluencia base"""
+    niveles = np.array(
+        [s.get('base_afluencia', 0) for s in automata.stations.values()], dtype=np.float64
+    )
+    niveles = np.where(niveles > 0, niveles, automata.current_people)
+    if afluencia_data is None:
+        return niveles
+    import pandas as pd
+
+    claves = pd.DataFrame({
+        'linea': afluencia_data['linea'].map(_normalize_line),
+        'estacion': afluencia_data['estacion'].map(_normalize_name),
+        'afluencia': pd.to_numeric(afluencia_data['afluencia'], errors='coerce'),
+    }).dropna(subset=['afluencia'])
+    promedios = claves.groupby(['linea', 'estacion'])['afluencia'].mean()
+    # Escala del estado: el primer registro de cada estación es su afluencia inicial
+    primeros = claves.groupby(['linea', 'estacion'])['afluencia'].first()
+    escala = primeros.mean() / promedios.mean() if len(promedios) else 1.0
+    for i, station in enumerate(automata.stations.values()):
+        clave = (station['linea'], _normalize_name(station['nombre']))
+        if clave in promedios.index:
+            niveles[i] = promedios[clave] * escala
+    return niveles
+
+
+def history_table(automata, store, bins: int):
+    """Promedio por estación y franja del historial columnar: (tabla, muestras)"""
+    timestamps, values = store.read_range()
+    columnas = [automata.station_index.get(c) for c in store.columns]
+    if len(timestamps) == 0 or all(c is None for c in columnas):
+        return None, None
+    presentes = [j for j, c in enumerate(columnas) if c is not None]
+    destino = np.array([columnas[j] for j in presentes], dtype=np.int64)
+    # Los timestamps son la hora simulada en hora local (ver
+    # SimulationProducer.sim_timestamp): su hora del día es la de la simulación
+    desfase = datetime.fromtimestamp(int(timestamps[0])).astimezone().utcoffset().total_seconds()
+    franja = ((timestamps + desfase) % SECONDS_PER_DAY // (SECONDS_PER_DAY / bins)).astype(np.int64)
+    muestras = np.bincount(franja, minlength=bins)
+    n = len(automata.station_ids)
+    sumas = np.zeros((n, bins))
+    for b in np.flatnonzero(muestras):
+        sumas[destino, b] = values[franja == b][:, presentes].sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tabla = sumas / muestras
+    cubiertas = np.zeros((n, bins), dtype=bool)
+    cubiertas[destino] = True
+    return np.where(cubiertas, tabla, np.nan), muestras
+
+
+def build_profile(automata, afluencia_data=None, history=None, bin_minutes: int = 15,
+                  use_history: bool = DEMAND_FROM_HISTORY, **kwargs) -> DemandProfile:
+    """Precalcular la tabla de demanda de ``automata``.
+
+    ``afluencia_data`` es el DataFrame del CSV (por omisión el que cargó
+    el autómata, si lo hizo); ``history`` un ``ColumnarHistoryStore``
+    cuyos promedios por franja, con ``use_history``, tienen prioridad
+    sobre la curva.
+    """
+    if afluencia_data is None:
+        afluencia_data = automata.afluencia_data
+    bins = SECONDS_PER_DAY // (bin_minutes * 60)
+    tabla = station_levels(automata, afluencia_data)[:, None] * day_curve(bins)[None, :]
+    if use_history and history is not None and hasattr(history, 'read_range'):
+        historial, muestras = history_table(automata, history, bins)
+        if historial is not None:
+            usar = (muestras >= MIN_HISTORY_SAMPLES)[None, :] & ~np.isnan(historial)
+            tabla = np.where(usar, historial, tabla)
+            logger.info("Demanda: %d de %d franjas tomadas del historial",
+                        int((muestras >= MIN_HISTORY_SAMPLES).sum()), bins)
+    tabla = np.clip(tabla, 100, automata.capacity[:, None])
+    return DemandProfile(tabla, **kwargs)
+
+
+def run_day(automata, step_seconds: float = 300.0, start_seconds: float = 0.0,
+            days: float = 1.0) -> np.ndarray:
+    """Simular ``days`` días desde ``start_seconds`` con ``advance()``.
+
+    Devuelve la afluencia ``[pasos, estaciones]``; sin diccionarios ni
+    registro por paso, para planear horas pico rápidamente.
+    """
+    pasos = int(round(days * SECONDS_PER_DAY / step_seconds))
+    automata.step_seconds = step_seconds
+    automata.sim_seconds = start_seconds
+    salida = np.empty((pasos, len(automata.station_ids)), dtype=np.uint32)
+    for t in range(pasos):
+        salida[t] = automata.advance()
+    return salida
@@ -0,0 +1,322 @@
+"""Corridas Monte Carlo por lotes de ``MetroAutomata`` sin Flask ni folium.
+
+Uso: python ensemble.py --runs 1000 --steps 100 --workers 4 --seed 1 --out resumen.npz
+
+Con menos de ``HISTOGRAM_BINS`` corridas se guardan los valores crudos
+(ocupan menos que el histograma) y los percentiles son los exactos de
+``np.percentile``. Con más, cada proceso reduce sus corridas a un
+histograma por paso y estación (y por paso y línea) más el máximo exacto;
+el proceso principal sólo suma histogramas, así que la memoria no crece
+con el número de corridas. Los percentiles se interpolan dentro de la
+clase del histograma (una fracción ``1 / HISTOGRAM_BINS`` de la capacidad
+de cada estación o línea).
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import (
+    DEMAND_MODEL, DEMAND_BIN_MINUTES, FLOW_MODEL, OD_PAIRS_PER_STEP, OD_TRIP_RATE,
+    OD_TRANSFER_COST, SIMULATION_STEP_SECONDS, SIMULATION_START, configure_logging
+)
+from metro_simulation import MetroAutomata
+import sim_clock
+
+PERCENTILES = {'p50': 50, 'p95': 95}
+# Clases del histograma de cada estación o línea (de 0 a su capacidad);
+# con menos corridas que clases se guardan los valores crudos
+HISTOGRAM_BINS = 256
+# Corridas que un proceso simula juntas antes de volcarlas al histograma
+RUN_CHUNK = 16
+
+# Autómata plantilla de cada proceso del pool (se carga una vez por proceso)
+# y estado del que parte cada corrida
+_template: Optional[MetroAutomata] = None
+_initial_state: Optional[Dict[str, np.ndarray]] = None
+
+
+def configure_models(automata: MetroAutomata, demand_model: str = DEMAND_MODEL,
+                     flow_model: str = FLOW_MODEL):
+    """Aplicar los modelos de demanda y de movimiento de ``config.py``.
+
+    A diferencia del productor, el reloj empieza en ``SIMULATION_START`` o
+    a medianoche (no a la hora actual) para que el lote sea reproducible.
+    """
+    automata.step_seconds = SIMULATION_STEP_SECONDS
+    automata.sim_seconds = sim_clock.parse_time_of_day(SIMULATION_START) if SIMULATION_START else 0.0
+    if flow_model == 'od':
+        import od_flow
+
+        automata.set_flow(od_flow.ODRouter(
+            automata, transfer_cost=OD_TRANSFER_COST, trip_rate=OD_TRIP_RATE,
+            pairs_per_step=OD_PAIRS_PER_STEP
+        ))
+    if demand_model == 'profile':
+        import demand
+
+        profile = demand.build_profile(automata, bin_minutes=DEMAND_BIN_MINUTES)
+        automata.set_demand(profile, SIMULATION_STEP_SECONDS, automata.sim_seconds)
+
+
+def _init_worker(cache_path: str, snapshot_path: Optional[str] = None,
+                 demand_model: str = DEMAND_MODEL, flow_model: str = FLOW_MODEL):
+    """Cargar la red desde la caché en disco: sólo viaja la ruta, no la tabla.
+
+    Con ``snapshot_path`` las corridas parten de ese punto de control
+    (ramas hipotéticas de un mismo estado) en lugar del estado inicial.
+    """
+    global _template, _initial_state
+    _template = MetroAutomata.from_cache(cache_path)
+    configure_models(_template, demand_model, flow_model)
+    if snapshot_path:
+        _template.restore(snapshot_path)
+    _initial_state = _template.snapshot()
+
+
+def _line_matrix(automata: MetroAutomata) -> np.ndarray:
+    """Matriz [estaciones, líneas] que suma la afluencia de cada línea"""
+    por_linea = np.zeros((len(automata.station_ids), len(automata.lines)))
+    por_linea[np.arange(len(automata.station_ids)), automata.line_index] = 1
+    return por_linea
+
+
+def _limits(automata: MetroAutomata):
+    """Valor máximo posible por estación y por línea (rango de cada histograma)"""
+    return automata.capacity, automata.capacity @ _line_matrix(automata).astype(np.int64)
+
+
+def _bin_of(values: np.ndarray, upper: np.ndarray, bins: int) -> np.ndarray:
+    """Clase de cada valor [..., columnas] en [0, upper] dividido en ``bins``"""
+    clase = values.astype(np.int64) * bins // (upper + 1)
+    return np.clip(clase, 0, bins - 1)
+
+
+class _Partial:
+    """Histograma [pasos, columnas, clases] y máximo de las corridas vistas"""
+
+    def __init__(self, steps: int, upper: np.ndarray, bins: int):
+        self.upper = upper
+        self.bins = bins
+        self.shape = (steps, len(upper), bins)
+        self.counts = np.zeros(int(np.prod(self.shape)), dtype=np.uint32)
+        self.max = np.zeros(self.shape[:2], dtype=np.int64)
+
+    def add(self, values: np.ndarray):
+        """Agregar corridas [corridas, pasos, columnas]"""
+        celdas = np.arange(self.shape[0] * self.shape[1]).reshape(self.shape[:2]) * self.bins
+        indice = celdas + _bin_of(values, self.upper, self.bins)
+        # Sólo las clases tocadas; el 1 con el tipo de ``counts`` evita una conversión lenta
+        np.add.at(self.counts, indice.ravel(), np.uint32(1))
+        np.maximum(self.max, values.max(axis=0), out=self.max)
+
+    def export(self):
+        """(índices, cuentas) de las celdas no vacías: viaja menos que el histograma"""
+        indices = np.flatnonzero(self.counts)
+        return indices, self.counts[indices], self.max
+
+    def merge(self, parte):
+        indices, cuentas, maximo = parte
+        self.counts[indices] += cuentas
+        np.maximum(self.max, maximo, out=self.max)
+
+    def _order_statistic(self, counts, acumulado, k: int) -> np.ndarray:
+        """Valor aproximado de la muestra ``k`` (desde 0) de cada celda"""
+        clase = np.argmax(acumulado > k, axis=-1)
+        en_clase = np.take_along_axis(counts, clase[..., None], -1)[..., 0]
+        antes = np.take_along_axis(acumulado, clase[..., None], -1)[..., 0] - en_clase
+        ancho = (self.upper + 1) / self.bins
+        # Las muestras de una clase se suponen repartidas uniformemente en ella
+        return (clase + (k - antes + 0.5) / np.maximum(en_clase, 1)) * ancho
+
+    def percentile(self, q: float, n_runs: int) -> np.ndarray:
+        """Percentil ``q`` por celda, interpolando como ``np.percentile``"""
+        counts = self.counts.reshape(self.shape).astype(np.int64)
+        acumulado = np.cumsum(counts, axis=-1)
+        rango = q / 100 * (n_runs - 1)
+        abajo = int(np.floor(rango))
+        valor = self._order_statistic(counts, acumulado, abajo)
+        if rango > abajo:
+            arriba = self._order_statistic(counts, acumulado, abajo + 1)
+            valor += (rango - abajo) * (arriba - valor)
+        return np.minimum(valor, self.max).astype(np.float32)
+
+
+class _Samples:
+    """Valores crudos [corridas, pasos, columnas] para percentiles exactos"""
+
+    def __init__(self, steps: int, upper: np.ndarray):
+        self.parts: List[np.ndarray] = []
+        self.max = np.zeros((steps, len(upper)), dtype=np.int64)
+
+    def add(self, values: np.ndarray):
+        """Agregar corridas [corridas, pasos, columnas] (se copian)"""
+        self.parts.append(values.copy())
+        np.maximum(self.max, values.max(axis=0), out=self.max)
+
+    def export(self):
+        return np.concatenate(self.parts), self.max
+
+    def merge(self, parte):
+        valores, maximo = parte
+        self.parts.append(valores)
+        np.maximum(self.max, maximo, out=self.max)
+
+    def percentile(self, q: float, n_runs: int) -> np.ndarray:
+        return np.percentile(np.concatenate(self.parts), q, axis=0).astype(np.float32)
+
+
+def _accumulator(steps: int, upper: np.ndarray, exact: bool, bins: int = HISTOGRAM_BINS):
+    return _Samples(steps, upper) if exact else _Partial(steps, upper, bins)
+
+
+def _run_batch(seeds: Sequence, steps: int, exact: bool = False, bins: int = HISTOGRAM_BINS):
+    """Simular varias trayectorias y devolver sus valores o histogramas dispersos.
+
+    Sólo se simulan ``RUN_CHUNK`` corridas a la vez. Con ``exact`` se
+    devuelven los valores crudos; si no, histogramas de tamaño acotado por
+    el número de celdas, no por el de corridas.
+    """
+    automata = _template
+    estaciones, lineas = _limits(automata)
+    por_estacion = _accumulator(steps, estaciones, exact, bins)
+    por_linea = _accumulator(steps, lineas, exact, bins)
+    matriz = _line_matrix(automata)
+    salida = np.empty((min(RUN_CHUNK, len(seeds)), steps, len(automata.station_ids)), dtype=np.uint32)
+    for inicio in range(0, len(seeds), RUN_CHUNK):
+        grupo = seeds[inicio:inicio + RUN_CHUNK]
+        for r, seed in enumerate(grupo):
+            automata.restore(_initial_state)
+            automata.reseed(seed)
+            for t in range(steps):
+                salida[r, t] = automata.advance()
+        valores = salida[:len(grupo)]
+        por_estacion.add(valores)
+        por_linea.add(np.rint(valores @ matriz).astype(np.int64))
+    return por_estacion.export(), por_linea.export()
+
+
+def _summarize(partial, n_runs: int, dtype) -> Dict[str, np.ndarray]:
+    """p50/p95/max sobre el eje de corridas"""
+    resumen = {nombre: partial.percentile(q, n_runs) for nombre, q in PERCENTILES.items()}
+    resumen['max'] = partial.max.astype(dtype)
+    return resumen
+
+
+def run_ensemble(n_runs: int, steps: int, seeds: Optional[Sequence] = None,
+                 workers: Optional[int] = None, cache_path: Optional[str] = None,
+                 seed=None, snapshot_path: Optional[str] = None,
+                 demand_model: str = DEMAND_MODEL, flow_model: str = FLOW_MODEL) -> Dict:
+    """Ejecutar ``n_runs`` trayectorias de ``steps`` pasos en un pool de procesos.
+
+    Devuelve percentiles por paso en lugar de los estados crudos:
+    ``stations[p50|p95|max]`` con forma [pasos, estaciones] y
+    ``lines[p50|p95|max]`` con el total por línea, forma [pasos, líneas].
+    ``cache_path`` es la caché ``.npz`` de la red; por omisión se genera
+    con la configuración de ``config.py``. Las semillas de cada corrida son
+    ``seeds`` (enteros o ``SeedSequence``) o, si no se dan, hijas de
+    ``SeedSequence(seed).spawn``, así el lote completo es reproducible.
+    Con ``snapshot_path`` (ver ``MetroAutomata.snapshot``) todas las
+    corridas parten de ese estado. ``demand_model`` y ``flow_model`` son
+    los de ``DEMAND_MODEL`` y ``FLOW_MODEL`` (ver ``configure_models``).
+    """
+    if cache_path is None:
+        from producer import build_automata
+        cache_path = build_automata().cache_path
+    if seeds is None:
+        seeds = np.random.SeedSequence(seed).spawn(n_runs)
+    seeds = list(seeds)
+    if len(seeds) != n_runs:
+        raise ValueError(f"Se esperaban {n_runs} semillas y hay {len(seeds)}")
+    workers = workers or os.cpu_count() or 1
+
+    # Pocos lotes por proceso: cada uno devuelve un histograma, no sus corridas
+    # (salvo con pocas corridas, donde los valores crudos son más chicos)
+    exact = n_runs < HISTOGRAM_BINS
+    batch = max(1, -(-n_runs // (workers * 2)))
+    batches = [seeds[i:i + batch] for i in range(0, n_runs, batch)]
+    initargs = (cache_path, snapshot_path, demand_model, flow_model)
+    if workers == 1:
+        _init_worker(*initargs)
+        partes = (_run_batch(b, steps, exact) for b in batches)
+        template = _template
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs)
+        partes = pool.map(_run_batch, batches, [steps] * len(batches), [exact] * len(batches))
+        template = MetroAutomata.from_cache(cache_path)
+
+    estaciones, lineas = _limits(template)
+    por_estacion = _accumulator(steps, estaciones, exact)
+    por_linea = _accumulator(steps, lineas, exact)
+    try:
+        for parte_estaciones, parte_lineas in partes:
+            por_estacion.merge(parte_estaciones)
+            por_linea.merge(parte_lineas)
+    finally:
+        if workers != 1:
+            pool.shutdown()
+
+    return {
+        'station_ids': template.station_ids,
+        'lines': template.lines,
+        'n_runs': n_runs,
+        'steps': steps,
+        'stations_summary': _summarize(por_estacion, n_runs, np.uint32),
+        'lines_summary': _summarize(por_linea, n_runs, np.int64),
+    }
+
+
+def save_summary(summary: Dict, path: str):
+    arrays = {
+        'station_ids': np.array(summary['station_ids'], dtype=str),
+        'lines': np.array(summary['lines'], dtype=str),
+    }
+    for grupo in ('stations_summary', 'lines_summary'):
+        for nombre, valores in summary[grupo].items():
+            arrays[f"{grupo.split('_')[0]}_{nombre}"] = valores
+    np.savez_compressed(path, **arrays)
+
+
+def main(argv: Optional[List[str]] = None):
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description='Corridas Monte Carlo de la simulación del metro',
+        epilog='Los modelos de demanda y de movimiento salen de DEMAND_MODEL y FLOW_MODEL '
+               '(y sus parámetros) como en el servidor; el reloj empieza en SIMULATION_START '
+               'o a medianoche.'
+    )
+    parser.add_argument('--runs', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=None, help='Semilla base para reproducir el lote')
+    parser.add_argument('--cache', default=None, help='Caché .npz de la red')
+    parser.add_argument('--snapshot', default=None, help='Punto de control del que parten las corridas')
+    parser.add_argument('--demand', default=DEMAND_MODEL, choices=('random', 'profile'),
+                        help='Modelo de demanda (por omisión DEMAND_MODEL)')
+    parser.add_argument('--flow', default=FLOW_MODEL, choices=('transfers', 'od'),
+                        help='Movimiento entre estaciones (por omisión FLOW_MODEL)')
+    parser.add_argument('--out', default=None, help='Guardar el resumen en un .npz')
+    args = parser.parse_args(argv)
+    configure_logging()
+
+    inicio = time.perf_counter()
+    summary = run_ensemble(args.runs, args.steps, workers=args.workers,
+                           cache_path=args.cache, seed=args.seed, snapshot_path=args.snapshot,
+                           demand_model=args.demand, flow_model=args.flow)
+    duracion = time.perf_counter() - inicio
+    print(f"{args.runs} corridas x {args.steps} pasos en {duracion:.2f}s")
+    lineas = summary['lines_summary']
+    print("Línea  p50(final)  p95(final)  max(final)")
+    for j, linea in enumerate(summary['lines']):
+        print(f"{linea:>5}  {lineas['p50'][-1, j]:>10.0f}  {lineas['p95'][-1, j]:>10.0f}  "
+              f"{lineas['max'][-1, j]:>10}")
+    if args.out:
+        save_summary(summary, args.out)
+        print(f"Resumen guardado en: {args.out}")
+
+
+if __name__ == '__main__':
+    main()
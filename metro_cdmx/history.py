@@ -1,28 +1,480 @@
+import atexit
 import csv
+import json
+import logging
 import os
+import threading
 from datetime import datetime
+from typing import Optional
+
+import numpy as np
 
 HISTORIAL_PATH = os.path.join(os.path.dirname(__file__), 'afluencia_historial.csv')
+HISTORIAL_COLUMNAR_PATH = os.path.join(os.path.dirname(__file__), 'afluencia_historial')
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+logger = logging.getLogger(__name__)
+
+
+def _to_epoch(valor) -> Optional[int]:
+    """Convertir datetime, texto 'YYYY-MM-DD HH:MM:SS' o número a segundos epoch"""
+    if valor is None:
+        return None
+    if isinstance(valor, datetime):
+        return int(valor.timestamp())
+    if isinstance(valor, (int, float, np.integer, np.floating)):
+        return int(valor)
+    return int(datetime.strptime(str(valor), TIMESTAMP_FORMAT).timestamp())
+
+
+def _row_timestamps(timestamps, n: int) -> list:
+    """Un timestamp por fila: ``None`` (hora actual), uno común o uno por fila"""
+    if timestamps is None or np.ndim(timestamps) == 0:
+        return [timestamps] * n
+    if len(timestamps) != n:
+        raise ValueError(f"Se esperaban {n} timestamps y hay {len(timestamps)}")
+    return list(timestamps)
+
+
+def _line_of(station_id: str) -> str:
+    return station_id.split('_')[0][1:]
+
 
 class HistoryLogger:
-    def __init__(self, path=HISTORIAL_PATH):
+    """Historial de afluencia en CSV.
+
+    Por defecto cada ``log()`` abre, escribe y cierra el archivo. Con
+    ``buffered=True`` el archivo queda abierto, las filas se acumulan en
+    memoria y un hilo en segundo plano las escribe cuando hay
+    ``max_buffer_rows`` pendientes o pasan ``flush_interval`` segundos.
+    Con ``fsync=True`` cada vaciado se fuerza a disco. Al salir del
+    proceso se vacía lo pendiente.
+    """
+
+    def __init__(self, path=HISTORIAL_PATH, buffered=False, flush_interval=1.0,
+                 max_buffer_rows=100, fsync=False):
         self.path = path
         self.header_written = os.path.exists(self.path)
+        self.buffered = buffered
+        self.flush_interval = flush_interval
+        self.max_buffer_rows = max_buffer_rows
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._file = None
+        self._writer = None
+        self._flusher = None
+        self._wakeup = threading.Event()
+        self._closed = False
+        if self.buffered:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
 
-    def log(self, state: dict):
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        row = {'timestamp': now}
+    def log(self, state: dict, timestamp=None):
+        """Agregar una fila; ``timestamp`` (epoch o datetime) por omisión es la hora actual"""
+        momento = datetime.now() if timestamp is None else datetime.fromtimestamp(_to_epoch(timestamp))
+        row = {'timestamp': momento.strftime(TIMESTAMP_FORMAT)}
         row.update(state)
-        write_header = not os.path.exists(self.path)
-        with open(self.path, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=row.keys())
-            if write_header:
-                writer.writeheader()
-            writer.writerow(row)
+        if self.buffered:
+            with self._lock:
+                self._buffer.append(row)
+                pendientes = len(self._buffer)
+            if pendientes >= self.max_buffer_rows:
+                self._wakeup.set()
+            return
+        with self._lock:
+            write_header = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=row.keys())
+                if write_header:
+                    writer.writeheader()
+                writer.writerow(row)
+
+    def log_batch(self, station_ids, values, timestamps=None):
+        """Agregar varios registros ``values[filas, estaciones]`` en el orden de ``station_ids``"""
+        filas = np.asarray(values).tolist()
+        for fila, ts in zip(filas, _row_timestamps(timestamps, len(filas))):
+            self.log(dict(zip(station_ids, fila)), ts)
+
+    def last_timestamp(self) -> Optional[int]:
+        """Epoch del último registro (``None`` si el historial está vacío)"""
+        filas = self.read_all()
+        return _to_epoch(filas[-1]['timestamp']) if filas else None
+
+    def flush(self):
+        """Escribir en disco las filas pendientes del búfer"""
+        with self._lock:
+            filas, self._buffer = self._buffer, []
+            if not filas:
+                return
+            if self._file is None:
+                write_header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self._file = open(self.path, 'a', newline='')
+                self._writer = csv.DictWriter(self._file, fieldnames=filas[0].keys())
+                if write_header:
+                    self._writer.writeheader()
+                self.header_written = True
+            self._writer.writerows(filas)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+
+    def close(self):
+        """Vaciar el búfer, detener el hilo de escritura y cerrar el archivo"""
+        if self._closed:
+            return
+        self._closed = True
+        self._wakeup.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join(timeout=5)
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._writer = None
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Error al escribir historial: %s", e)
 
     def read_all(self):
+        if self.buffered:
+            self.flush()
         if not os.path.exists(self.path):
             return []
         with open(self.path, 'r') as f:
             reader = csv.DictReader(f)
             return list(reader)
+
+    def query(self, since=None, tail=None, line=None):
+        """Igual que ``ColumnarHistoryStore.query`` pero releyendo el CSV completo"""
+        filas = self.read_all()
+        if since is not None:
+            limite = _to_epoch(since)
+            filas = [f for f in filas if _to_epoch(f['timestamp']) > limite]
+        if tail is not None:
+            filas = filas[max(0, len(filas) - tail):] if tail > 0 else []
+        if line is not None:
+            filas = [
+                {k: v for k, v in f.items() if k == 'timestamp' or _line_of(k) == line}
+                for f in filas
+            ]
+        return filas
+
+    def line_series(self, since=None, tail=None, line=None):
+        """Igual que ``ColumnarHistoryStore.line_series`` pero sumando en Python"""
+        filas = self.query(since, tail, line)
+        timestamps = np.array([_to_epoch(f['timestamp']) for f in filas], dtype=np.int64)
+        series = {}
+        for i, fila in enumerate(filas):
+            for k, v in fila.items():
+                if k == 'timestamp' or v in (None, ''):
+                    continue
+                totales = series.setdefault(_line_of(k), np.zeros(len(filas), dtype=np.int64))
+                totales[i] += int(float(v))
+        return timestamps, dict(sorted(series.items()))
+
+
+class ColumnarHistoryStore:
+    """Historial de afluencia en formato binario de ancho fijo.
+
+    Cada paso es un registro ``(timestamp int64, valores uint32[N])`` en
+    ``<base>.bin``; el orden de columnas (estaciones) vive en
+    ``<base>.json``. Las lecturas usan un memmap del archivo, así que
+    ``read_range``, ``tail`` y los agregados por línea sólo tocan las
+    filas pedidas sin analizar el historial completo.
+
+    En ``<base>.lines.bin`` se mantiene, al escribir cada registro, el
+    total por línea ``(timestamp int64, totales int64[L])`` para servir
+    series por línea sin volver a sumar estaciones.
+
+    Con ``readonly=True`` (procesos que sólo consultan mientras otro
+    escribe) nunca se modifica ningún archivo.
+    """
+
+    def __init__(self, path=HISTORIAL_COLUMNAR_PATH, readonly=False):
+        self.path = path
+        self.readonly = readonly
+        self.data_path = path + '.bin'
+        self.schema_path = path + '.json'
+        self.rollup_path = path + '.lines.bin'
+        self._lock = threading.Lock()
+        self._file = None
+        self._rollup_file = None
+        self._columns = None
+        self._dtype = None
+        self._index = None
+        self._line_index = None
+        self._rollup_dtype = None
+        self.lines = []
+        if os.path.exists(self.schema_path):
+            with open(self.schema_path) as f:
+                self._set_columns(json.load(f)['columns'])
+            if not readonly:
+                self._truncate_partial(self.data_path, self._dtype.itemsize)
+                self._truncate_partial(self.rollup_path, self._rollup_dtype.itemsize)
+                self._rebuild_rollup()
+
+    def _set_columns(self, columns):
+        self._columns = list(columns)
+        self._index = {c: i for i, c in enumerate(self._columns)}
+        self._dtype = np.dtype([
+            ('timestamp', '<i8'),
+            ('values', '<u4', (len(self._columns),)),
+        ])
+        lineas = [_line_of(c) for c in self._columns]
+        self.lines = sorted(set(lineas))
+        posicion = {linea: i for i, linea in enumerate(self.lines)}
+        self._line_index = np.array([posicion[l] for l in lineas], dtype=np.int64)
+        self._rollup_dtype = np.dtype([
+            ('timestamp', '<i8'),
+            ('totals', '<i8', (len(self.lines),)),
+        ])
+
+    @staticmethod
+    def _truncate_partial(path, itemsize):
+        """Descartar un registro a medio escribir al final (p. ej. tras una caída)
+
+        Sin esto, los registros que se agreguen después quedarían desalineados.
+        """
+        if not os.path.exists(path):
+            return
+        size = os.path.getsize(path)
+        if size % itemsize:
+            logger.warning("Descartando %d bytes incompletos al final de %s", size % itemsize, path)
+            with open(path, 'r+b') as f:
+                f.truncate(size - size % itemsize)
+
+    def _rebuild_rollup(self):
+        """Regenerar el acumulado por línea si falta o quedó atrás del historial"""
+        registros = self._records()
+        hechos = len(self._rollup_records())
+        if hechos == len(registros):
+            return
+        if hechos > len(registros):
+            hechos = 0
+        with open(self.rollup_path, 'r+b' if hechos else 'wb') as f:
+            f.truncate(hechos * self._rollup_dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            bloque = 10000
+            for inicio in range(hechos, len(registros), bloque):
+                parte = registros[inicio:inicio + bloque]
+                rollup = np.zeros(len(parte), dtype=self._rollup_dtype)
+                rollup['timestamp'] = parte['timestamp']
+                rollup['totals'] = self.line_totals(np.asarray(parte['values']))
+                f.write(rollup.tobytes())
+
+    def _load_schema(self):
+        """En modo lectura, otro proceso pudo crear el esquema después de abrir"""
+        if self._columns is None and self.readonly and os.path.exists(self.schema_path):
+            with open(self.schema_path) as f:
+                self._set_columns(json.load(f)['columns'])
+
+    @property
+    def columns(self):
+        self._load_schema()
+        return list(self._columns or [])
+
+    def _write_schema(self):
+        tmp_path = self.schema_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': 1, 'columns': self._columns}, f)
+        os.replace(tmp_path, self.schema_path)
+
+    def log(self, state: dict, timestamp=None):
+        """Agregar un registro; el primer estado fija el orden de las columnas"""
+        self.log_batch(list(state.keys()), [list(state.values())], timestamp)
+
+    def log_batch(self, station_ids, values, timestamps=None):
+        """Agregar varios registros ``values[filas, estaciones]``.
+
+        Las columnas de ``values`` siguen el orden de ``station_ids``; las
+        estaciones que no están en el esquema se ignoran. ``timestamps`` es
+        uno por fila o uno común (por omisión, la hora actual).
+        """
+        if self.readonly:
+            raise RuntimeError("Historial abierto en modo sólo lectura")
+        values = np.asarray(values)
+        ahora = int(datetime.now().timestamp())
+        ts = [ahora if t is None else _to_epoch(t) for t in _row_timestamps(timestamps, len(values))]
+        with self._lock:
+            if self._columns is None:
+                self._set_columns(station_ids)
+                self._write_schema()
+                if os.path.exists(self.rollup_path):
+                    os.remove(self.rollup_path)
+            registros = np.zeros(len(values), dtype=self._dtype)
+            registros['timestamp'] = ts
+            origen = [j for j, sid in enumerate(station_ids) if sid in self._index]
+            destino = [self._index[station_ids[j]] for j in origen]
+            registros['values'][:, destino] = values[:, origen]
+            rollup = np.zeros(len(values), dtype=self._rollup_dtype)
+            rollup['timestamp'] = ts
+            rollup['totals'] = self.line_totals(registros['values'])
+            if self._file is None:
+                self._file = open(self.data_path, 'ab')
+                self._rollup_file = open(self.rollup_path, 'ab')
+            self._file.write(registros.tobytes())
+            self._file.flush()
+            self._rollup_file.write(rollup.tobytes())
+            self._rollup_file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._rollup_file.close()
+                self._file = None
+                self._rollup_file = None
+
+    def _records(self) -> np.ndarray:
+        """Vista memmap de todos los registros completos escritos hasta ahora"""
+        self._load_schema()
+        if self._columns is None or not os.path.exists(self.data_path):
+            return np.zeros(0, dtype=self._dtype or np.dtype([('timestamp', '<i8')]))
+        count = os.path.getsize(self.data_path) // self._dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=self._dtype)
+        return np.memmap(self.data_path, dtype=self._dtype, mode='r', shape=(count,))
+
+    def _rollup_records(self) -> np.ndarray:
+        self._load_schema()
+        if self._columns is None or not os.path.exists(self.rollup_path):
+            return np.zeros(0, dtype=self._rollup_dtype or np.dtype([('timestamp', '<i8')]))
+        count = os.path.getsize(self.rollup_path) // self._rollup_dtype.itemsize
+        if count == 0:
+            return np.zeros(0, dtype=self._rollup_dtype)
+        return np.memmap(self.rollup_path, dtype=self._rollup_dtype, mode='r', shape=(count,))
+
+    def __len__(self):
+        return len(self._records())
+
+    def read_range(self, start=None, end=None):
+        """Registros con ``start <= timestamp <= end``: (timestamps, valores[filas, estaciones])"""
+        registros = self._records()
+        if len(registros) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.columns)), dtype=np.uint32)
+        timestamps = registros['timestamp']
+        inicio = 0 if start is None else int(np.searchsorted(timestamps, _to_epoch(start), 'left'))
+        fin = len(registros) if end is None else int(np.searchsorted(timestamps, _to_epoch(end), 'right'))
+        seleccion = registros[inicio:fin]
+        return np.array(seleccion['timestamp']), np.array(seleccion['values'])
+
+    def last_timestamp(self) -> Optional[int]:
+        """Epoch del último registro (``None`` si el historial está vacío)"""
+        registros = self._records()
+        return int(registros['timestamp'][-1]) if len(registros) else None
+
+    def tail(self, n: int):
+        """Últimos ``n`` registros: (timestamps, valores[filas, estaciones])"""
+        registros = self._records()
+        seleccion = registros[max(0, len(registros) - n):] if n > 0 else registros[:0]
+        if len(seleccion) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(self.columns)), dtype=np.uint32)
+        return np.array(seleccion['timestamp']), np.array(seleccion['values'])
+
+    def line_totals(self, values: np.ndarray) -> np.ndarray:
+        """Sumar por línea un bloque de valores [filas, estaciones] -> [filas, líneas]"""
+        totales = np.zeros((values.shape[0], len(self.lines)), dtype=np.int64)
+        for j in range(len(self.lines)):
+            totales[:, j] = values[:, self._line_index == j].sum(axis=1, dtype=np.int64)
+        return totales
+
+    def line_series(self, since=None, tail=None, line=None):
+        """Serie de totales por línea desde el acumulado mantenido.
+
+        Devuelve (timestamps, {linea: totales}) con los registros posteriores
+        a ``since`` y, si se indica, sólo los últimos ``tail``.
+        """
+        registros = self._rollup_records()
+        if since is not None and len(registros):
+            inicio = int(np.searchsorted(registros['timestamp'], _to_epoch(since), 'right'))
+            registros = registros[inicio:]
+        if tail is not None:
+            registros = registros[max(0, len(registros) - tail):] if tail > 0 else registros[:0]
+        lineas = [line] if line is not None else self.lines
+        series = {}
+        for linea in lineas:
+            if linea in self.lines:
+                series[linea] = np.asarray(registros['totals'][:, self.lines.index(linea)])
+        return np.array(registros['timestamp']), series
+
+    def line_aggregates(self, start=None, end=None) -> dict:
+        """Total por línea en el intervalo: promedio, mínimo, máximo y último valor"""
+        _, values = self.read_range(start, end)
+        if values.shape[0] == 0:
+            return {}
+        totales = self.line_totals(values)
+        return {
+            linea: {
+                'mean': float(totales[:, j].mean()),
+                'min': int(totales[:, j].min()),
+                'max': int(totales[:, j].max()),
+                'last': int(totales[-1, j]),
+            }
+            for j, linea in enumerate(self.lines)
+        }
+
+    def query(self, since=None, tail=None, line=None):
+        """Filas posteriores a ``since`` (las últimas ``tail``), opcionalmente de una línea"""
+        registros = self._records()
+        if since is not None and len(registros):
+            inicio = int(np.searchsorted(registros['timestamp'], _to_epoch(since), 'right'))
+            registros = registros[inicio:]
+        if tail is not None:
+            registros = registros[max(0, len(registros) - tail):] if tail > 0 else registros[:0]
+        if len(registros) == 0:
+            return []
+        return self.to_records(
+            np.array(registros['timestamp']), np.array(registros['values']), line=line
+        )
+
+    def to_records(self, timestamps, values, line=None):
+        """Convertir un bloque al formato de filas de ``HistoryLogger.read_all``"""
+        columnas = self.columns
+        if line is not None:
+            seleccion = [i for i, c in enumerate(columnas) if _line_of(c) == line]
+            columnas = [columnas[i] for i in seleccion]
+            values = values[:, seleccion]
+        return [
+            {'timestamp': datetime.fromtimestamp(int(ts)).strftime(TIMESTAMP_FORMAT),
+             **dict(zip(columnas, fila))}
+            for ts, fila in zip(timestamps.tolist(), values.tolist())
+        ]
+
+    def read_all(self):
+        return self.to_records(*self.read_range())
+
+
+def migrate_csv(csv_path=HISTORIAL_PATH, store_path=HISTORIAL_COLUMNAR_PATH) -> int:
+    """Copiar un historial CSV existente al almacén columnar; devuelve filas migradas"""
+    store = ColumnarHistoryStore(store_path)
+    filas = 0
+    with open(csv_path, 'r', newline='') as f:
+        for row in csv.DictReader(f):
+            timestamp = row.pop('timestamp')
+            store.log({k: int(float(v)) for k, v in row.items() if v not in (None, '')}, timestamp)
+            filas += 1
+    store.close()
+    return filas
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Herramientas del historial de afluencia')
+    sub = parser.add_subparsers(dest='command', required=True)
+    migrate = sub.add_parser('migrate', help='Migrar el historial CSV al almacén columnar')
+    migrate.add_argument('--csv', default=HISTORIAL_PATH)
+    migrate.add_argument('--out', default=HISTORIAL_COLUMNAR_PATH)
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        total = migrate_csv(args.csv, args.out)
+        print(f"{total} registros migrados a {args.out}.bin")
@@ -1,15 +1,35 @@
 import os
-from metro_simulation import MetroAutomata
+from metro_simulation import MetroAutomata, STATION_FILENAME
+import network_cache
 import folium
-from shapely.geometry import MultiLineString
-from flask import Flask, send_file, jsonify
+from flask import Flask, Response, send_file, jsonify, request, g
 import json
 import numpy as np
+import tempfile
 import threading
-from config import SHAPEFILE_PATH, AFLUENCIA_PATH, MAP_OUTPUT_PATH, SIMULATION_INTERVAL
-from history import HistoryLogger
-import socket
 import time
+from config import (
+    SHAPEFILE_PATH, AFLUENCIA_PATH, MAP_OUTPUT_PATH, BASEMAP_PATH, NETWORK_CACHE_DIR, SIMULATION_SEED,
+    WEBSOCKET_PORT, WEBSOCKET_QUEUE_SIZE, PROFILE_ENABLED, PROFILE_MAX_SECONDS, CHECKPOINT_PATH, configure_logging
+)
+import metrics
+from history import TIMESTAMP_FORMAT
+from websocket_server import StateBroadcaster
+from state_store import SnapshotCache, ENCODERS
+import wire_format
+import sim_clock
+import segments
+from shared_state import SharedStateReader
+from producer import (
+    SHARED_STATE_ENV, PRODUCER_METRICS_ENV, PRODUCER_CONTROL_ENV, SimulationProducer, SharedStateSync,
+    build_automata, build_history_logger, configure_simulation, configure_worker, request_profile, send_clock_command
+)
+import socket
+import logging
+from datetime import datetime
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -22,33 +42,123 @@ class CustomJSONEncoder(json.JSONEncoder):
 app = Flask(__name__)
 app.json_encoder = CustomJSONEncoder
 automata = None
-history_logger = HistoryLogger()
+# Bajo gunicorn un proceso productor simula y publica en memoria compartida;
+# los workers sólo leen (ver gunicorn.conf.py)
+shared_state_name = os.environ.get(SHARED_STATE_ENV)
+shared_sync = None
+_shared_lock = threading.Lock()
+history_logger = build_history_logger(readonly=bool(shared_state_name))
+snapshot_cache = SnapshotCache()
+broadcaster = StateBroadcaster(port=WEBSOCKET_PORT, queue_size=WEBSOCKET_QUEUE_SIZE)
+# Hilo de simulación de este proceso (sólo en modo de proceso único), para /debug/profile
+sim_thread = None
+# Productor de este proceso (modo de proceso único), para las órdenes de /clock
+producer = None
+# Esquema de /schema: la red no cambia tras initialize_stations()
+_schema = None
+_schema_body = None
+
+LINEA_COLORES = {
+    '1': '#FF1493', '2': '#0000FF', '3': '#808000',
+    '4': '#00FFFF', '5': '#FFD700', '6': '#FF0000',
+    '7': '#FFA500', '8': '#008000', '9': '#8B4513',
+    '12': '#FFD700',
+    'A': '#800080', 'B': '#696969'
+}
+# Subir este número cuando cambie la plantilla del mapa o el GeoJSON base
+MAP_VERSION = 2
+_map_lock = threading.Lock()
+_map_ready = False
+
+def _map_key() -> str:
+    """Clave del mapa base: archivos de entrada, versión de la plantilla y puerto WebSocket"""
+    station_path = os.path.join(os.path.dirname(SHAPEFILE_PATH), STATION_FILENAME)
+    key = network_cache.cache_key([SHAPEFILE_PATH, station_path, AFLUENCIA_PATH])
+    return f"{key}:{MAP_VERSION}:{WEBSOCKET_PORT}"
+
+def _map_is_current(key: str) -> bool:
+    if not (os.path.exists(MAP_OUTPUT_PATH) and os.path.exists(BASEMAP_PATH)):
+        return False
+    try:
+        with open(MAP_OUTPUT_PATH + '.key') as f:
+            return f.read() == key
+    except OSError:
+        return False
+
+def _write_atomic(path: str, data: str):
+    """Escribir con archivo temporal + rename (varios workers pueden generar a la vez)"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(data)
+        # mkstemp usa 0600 y el mapa debe poder leerlo cualquier proceso
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def build_basemap(automata) -> dict:
+    """Capa estática del mapa: trazos de línea y estaciones como un solo GeoJSON"""
+    features = [
+        {
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': np.round(trazo, 6).tolist()},
+            'properties': {'linea': linea, 'color': LINEA_COLORES.get(linea, 'gray')}
+        }
+        for linea, trazo in automata.line_paths('wgs84')
+    ]
+    coords = np.round(automata.station_coords_wgs84, 6).tolist()
+    for station_id, (lon, lat) in zip(automata.station_ids, coords):
+        station = automata.stations[station_id]
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [lon, lat]},
+            'properties': {
+                'id': station_id,
+                'nombre': station.get('nombre', station_id),
+                'linea': station['linea'],
+                'color': LINEA_COLORES.get(station['linea'], 'gray'),
+                'capacity': int(automata.capacity[automata.station_index[station_id]])
+            }
+        })
+    return {'type': 'FeatureCollection', 'features': features}
+
+def ensure_map(automata=None):
+    """Generar el mapa si hace falta; sólo se comprueba una vez por proceso"""
+    global _map_ready
+    if _map_ready:
+        return
+    with _map_lock:
+        if not _map_ready:
+            create_map(automata)
+            _map_ready = True
+
+def create_map(automata=None, force: bool = False):
+    """Escribir el mapa base (HTML + GeoJSON) sólo si cambiaron los archivos de entrada.
 
-def create_map():
+    El HTML contiene el mapa de teselas, el panel y el código del cliente;
+    la red se sirve aparte en ``/basemap.geojson`` y el cliente crea los
+    marcadores de estación y los actualiza con cada estado (/events o
+    WebSocket). Si no se pasa ``automata`` se construye uno sin pasos de
+    calentamiento: el mapa no depende del estado.
+    """
     output_path = MAP_OUTPUT_PATH
     shp_path = SHAPEFILE_PATH
-    afluencia_path = AFLUENCIA_PATH
-    if os.path.exists(output_path):
-        try:
-            os.remove(output_path)
-            print(f"Archivo anterior eliminado: {output_path}")
-        except Exception as e:
-            print(f"No se pudo eliminar el archivo anterior: {e}")
-    print(f"Buscando archivo shapefile en: {shp_path}")
-    print(f"Buscando archivo de afluencia en: {afluencia_path}")
     if not os.path.exists(shp_path):
-        print(f"Error: No se encuentra el archivo shapefile en {shp_path}")
-        print("Archivos disponibles en stcmetro_shp:")
+        logger.error("No se encuentra el archivo shapefile en %s", shp_path)
         shp_dir = os.path.dirname(shp_path)
         if os.path.exists(shp_dir):
-            print(os.listdir(shp_dir))
+            logger.error("Archivos disponibles en stcmetro_shp: %s", os.listdir(shp_dir))
         return
-    if not os.path.exists(afluencia_path):
-        print(f"Error: No se encuentra el archivo de afluencia en {afluencia_path}")
-        return
-    automata = MetroAutomata(shp_path, afluencia_path)
-    results = automata.run_simulation(steps=10)
-    automata.metro_network = automata.metro_network.to_crs(epsg=4326)
+    key = _map_key()
+    if not force and _map_is_current(key):
+        logger.info("Mapa base vigente: %s", output_path)
+        return output_path
+    if automata is None:
+        automata = MetroAutomata(shp_path, AFLUENCIA_PATH, cache_dir=NETWORK_CACHE_DIR)
+    _write_atomic(BASEMAP_PATH, json.dumps(build_basemap(automata), separators=(',', ':')))
     m = folium.Map(
         location=[19.432608, -99.133208],
         zoom_start=11,
@@ -60,96 +170,6 @@ def create_map():
     tile_claro.add_to(m)
     tile_oscuro.add_to(m)
     folium.LayerControl(position='bottomright', collapsed=False).add_to(m)
-    linea_colores = {
-        '1': '#FF1493', '2': '#0000FF', '3': '#808000',
-        '4': '#00FFFF', '5': '#FFD700', '6': '#FF0000',
-        '7': '#FFA500', '8': '#008000', '9': '#8B4513',
-        '12': '#FFD700',
-        'A': '#800080', 'B': '#696969'
-    }
-    def color_por_afluencia(afluencia, base_color):
-        if afluencia < 1500:
-            return "#2ecc40"
-        elif afluencia < 3500:
-            return "#ffd700"
-        else:
-            return "#ff4136"
-    for _, row in automata.metro_network.iterrows():
-        geom = row.geometry
-        linea = str(row['LINEA'])
-        color = linea_colores.get(linea, 'gray')
-        if isinstance(geom, MultiLineString):
-            for line in geom.geoms:
-                x, y = line.xy
-                coords = list(zip(y, x))
-                folium.PolyLine(
-                    coords,
-                    weight=6,
-                    color=color,
-                    opacity=0.9,
-                    popup=f"<b>Línea {linea}</b>"
-                ).add_to(m)
-                folium.PolyLine(
-                    coords,
-                    weight=4,
-                    color='white',
-                    opacity=0.7,
-                    className=f'flow-line-{linea}'
-                ).add_to(m)
-    for station_id, station in automata.stations.items():
-        coords = station['coords']
-        current = station['current_people']
-        nombre = station.get('nombre', station_id)
-        linea = station['linea']
-        color_borde = linea_colores.get(linea, 'gray')
-        if current < 1500:
-            estatus = "Baja"
-        elif current < 3500:
-            estatus = "Media"
-        else:
-            estatus = "Saturada"
-        folium.CircleMarker(
-            location=[coords[1], coords[0]],
-            radius=12,
-            color=color_borde,
-            weight=3,
-            fill=True,
-            fill_color=color_borde,
-            fill_opacity=0.85,
-            popup=folium.Popup(f'''
-                <div class="station-label" id="label-{station_id}" style="
-                    background: rgba(255,255,255,0.97); border-radius: 10px; padding: 7px 14px; min-width: 120px;
-                    box-shadow: 0 1px 6px rgba(0,0,0,0.10); font-size: 15px; font-family: Arial;">
-                    <div style="font-weight:bold; color:{color_borde};">{nombre}</div>
-                    <div><b>Línea:</b> {linea}</div>
-                    <div><b>Afluencia:</b> <span class="afluencia-label" id="afluencia-{station_id}">{current:,}</span></div>
-                    <div><b>Capacidad:</b> {station['capacity']:,}</div>
-                    <div><b>Estatus:</b> <span class="estatus-label" id="estatus-{station_id}">{estatus}</span></div>
-                </div>
-            ''', max_width=300),
-            tooltip=f"{nombre}",
-            parse_html=True,
-            attributes={
-                'data-line': linea,
-                'data-station-id': station_id
-            }
-        ).add_to(m)
-    for station_id, station in automata.stations.items():
-        linea = station['linea']
-        color = linea_colores.get(linea, 'gray')
-        for neighbor_id in automata.get_connected_stations(station_id):
-            if neighbor_id in automata.stations:
-                station_coords = station['coords']
-                neighbor_coords = automata.stations[neighbor_id]['coords']
-                folium.PolyLine(
-                    locations=[[station_coords[1], station_coords[0]], 
-                               [neighbor_coords[1], neighbor_coords[0]]],
-                    weight=3,
-                    color=color,
-                    opacity=0.7,
-                    dash_array='10, 15',
-                    className=f'connection-line-animated line-{linea}'
-                ).add_to(m)
     time_control = r"""
     <style>
         .control-panel {
@@ -347,38 +367,104 @@ def create_map():
             return "#ff4136";
         }
 
-        let stationIdList = [];
-        fetch('/station_ids')
-            .then(response => response.json())
-            .then(ids => { stationIdList = ids; });
+        // Capa dinámica: un circleMarker por estación creado a partir del mapa base
+        // (GeoJSON en caché); cada estado sólo cambia su color y su popup.
+        const afluenciaActual = {};
+        const marcadores = {};
+        const capasPorLinea = {};
+        function estatusPorAfluencia(afluencia) {
+            if (afluencia < 1500) return 'Baja';
+            if (afluencia < 3500) return 'Media';
+            return 'Saturada';
+        }
+        function capaDeLinea(linea) {
+            if (!capasPorLinea[linea]) capasPorLinea[linea] = L.layerGroup();
+            return capasPorLinea[linea];
+        }
+        function popupEstacion(stationId) {
+            const p = marcadores[stationId].feature.properties;
+            const actual = afluenciaActual[stationId];
+            const valor = actual === undefined ? '—' : actual.toLocaleString();
+            const estatus = actual === undefined ? '—' : estatusPorAfluencia(actual);
+            return '<div class="station-label"><div style="font-weight:bold;color:' + p.color + ';">' + p.nombre +
+                '</div><div><b>Línea:</b> ' + p.linea + '</div><div><b>Afluencia:</b> ' + valor +
+                '</div><div><b>Capacidad:</b> ' + p.capacity.toLocaleString() +
+                '</div><div><b>Estatus:</b> ' + estatus + '</div></div>';
+        }
+        function loadBasemap() {
+            const map = getLeafletMap();
+            if (!map) return;
+            fetch('/basemap.geojson')
+                .then(response => response.json())
+                .then(geojson => {
+                    L.geoJSON(geojson, {
+                        filter: f => f.geometry.type !== 'Point',
+                        style: f => ({color: f.properties.color, weight: 6, opacity: 0.9}),
+                        onEachFeature: (f, layer) => {
+                            layer.bindPopup('<b>Línea ' + f.properties.linea + '</b>');
+                            capaDeLinea(f.properties.linea).addLayer(layer);
+                        }
+                    });
+                    L.geoJSON(geojson, {
+                        filter: f => f.geometry.type === 'Point',
+                        pointToLayer: (f, latlng) => L.circleMarker(latlng, {
+                            radius: 12, color: f.properties.color, weight: 3,
+                            fillColor: f.properties.color, fillOpacity: 0.85
+                        }),
+                        onEachFeature: (f, layer) => {
+                            const stationId = f.properties.id;
+                            marcadores[stationId] = layer;
+                            layer.bindTooltip(f.properties.nombre);
+                            layer.bindPopup(() => popupEstacion(stationId), {maxWidth: 300});
+                            capaDeLinea(f.properties.linea).addLayer(layer);
+                        }
+                    });
+                    Object.values(capasPorLinea).forEach(capa => capa.addTo(map));
+                    updateStations();
+                });
+        }
 
+        function applyState(data) {
+            Object.entries(data).forEach(([stationId, people]) => {
+                afluenciaActual[stationId] = people;
+                const marcador = marcadores[stationId];
+                if (!marcador) return;
+                marcador.setStyle({fillColor: colorPorAfluencia(people)});
+                if (marcador.isPopupOpen()) marcador.setPopupContent(popupEstacion(stationId));
+            });
+        }
         function updateStations() {
             fetch('/events')
                 .then(response => response.json())
-                .then(data => {
-                    Object.entries(data).forEach(([stationId, people]) => {
-                        document.querySelectorAll('span[id="afluencia-' + stationId + '"]').forEach(span => {
-                            span.textContent = people.toLocaleString();
-                        });
-                        document.querySelectorAll('span[id="estatus-' + stationId + '"]').forEach(span => {
-                            if (people < 1500) {
-                                span.textContent = 'Baja';
-                            } else if (people < 3500) {
-                                span.textContent = 'Media';
-                            } else {
-                                span.textContent = 'Saturada';
-                            }
-                        });
-                    });
-                })
+                .then(applyState)
                 .catch(console.error);
         }
+        // Suscripción en vivo: el servidor envía una instantánea y luego sólo los cambios.
+        // Mientras el WebSocket esté abierto no se hace polling a /events.
+        let liveSocket = null;
+        function connectLive() {
+            const proto = location.protocol === 'https:' ? 'wss://' : 'ws://';
+            const socket = new WebSocket(proto + location.hostname + ':__WEBSOCKET_PORT__/');
+            socket.onopen = () => { liveSocket = socket; };
+            socket.onmessage = event => {
+                const msg = JSON.parse(event.data);
+                applyState(msg.type === 'snapshot' ? msg.state : msg.changes);
+            };
+            socket.onclose = () => {
+                liveSocket = null;
+                setTimeout(connectLive, 5000);
+            };
+        }
+        connectLive();
+        function isLive() {
+            return liveSocket && liveSocket.readyState === WebSocket.OPEN;
+        }
         function updateCountdown() {
-            document.getElementById('countdown').textContent = countdown;
+            document.getElementById('countdown').textContent = isLive() ? 'en vivo ' : countdown;
             countdown--;
             if (countdown < 0) {
                 countdown = 30;
-                updateStations(); // Siempre actualizar, sin importar isPlaying
+                if (!isLive()) updateStations(); // Respaldo si no hay WebSocket
             }
         }
         function toggleAnimation() {
@@ -401,31 +487,12 @@ def create_map():
         }
         function filterByLine() {
             const selected = document.getElementById('lineFilter').value;
-            // Ocultar todos los círculos primero
-            document.querySelectorAll('svg.leaflet-zoom-animated circle').forEach(marker => {
-                marker.style.display = 'none';
-            });
-            // Mostrar solo los círculos de la línea seleccionada, o todos si es 'all'
-            document.querySelectorAll('svg.leaflet-zoom-animated circle').forEach(marker => {
-                const markerLine = marker.getAttribute('data-line');
-                if (selected === 'all' || markerLine === selected) {
-                    marker.style.display = '';
-                }
-            });
-            // Ocultar todas las líneas primero
-            document.querySelectorAll('.leaflet-interactive').forEach(line => {
-                line.style.display = 'none';
-            });
-            // Mostrar solo las líneas de la línea seleccionada, o todas si es 'all'
-            document.querySelectorAll('.leaflet-interactive').forEach(line => {
-                let classes = line.getAttribute('class') || '';
-                if (selected === 'all') {
-                    line.style.display = '';
-                } else if (classes.includes('line-' + selected)) {
-                    line.style.display = '';
-                } else if (!classes.match(/line-\w+/)) {
-                    // Siempre mostrar las líneas blancas
-                    line.style.display = '';
+            const map = getLeafletMap();
+            Object.entries(capasPorLinea).forEach(([linea, capa]) => {
+                if (selected === 'all' || linea === selected) {
+                    capa.addTo(map);
+                } else {
+                    map.removeLayer(capa);
                 }
             });
             updateChart();
@@ -436,51 +503,19 @@ def create_map():
         }
         function updateChart() {
             const selected = document.getElementById('lineFilter').value;
-            fetch('/history')
+            let url = '/history?agg=line&tail=20';
+            if (selected !== 'all') url += '&line=' + encodeURIComponent(selected);
+            fetch(url)
                 .then(response => response.json())
                 .then(historial => {
-                    if (!Array.isArray(historial) || historial.length === 0) return;
-                    const ultimos = historial.slice(-20);
-                    const labels = ultimos.map(row => row.timestamp ? row.timestamp.split(' ')[1] : '');
-                    if (selected === 'all') {
-                        const lineas = Object.keys(lineaColores);
-                        let datosPorLinea = {};
-                        lineas.forEach(l => datosPorLinea[l] = []);
-                        ultimos.forEach(row => {
-                            lineas.forEach(l => {
-                                let suma = 0;
-                                Object.entries(row).forEach(([k, v]) => {
-                                    if (k.startsWith('L'+l+'_')) suma += parseInt(v);
-                                });
-                                datosPorLinea[l].push(suma);
-                            });
-                        });
-                        chartData.labels = labels;
-                        chartData.datasets.forEach(ds => {
-                            const linea = ds.label.replace('Línea ', '');
-                            ds.data = datosPorLinea[linea];
-                        });
-                        chartData.datasets.forEach(ds => ds.hidden = false);
-                    } else {
-                        let datosLinea = [];
-                        ultimos.forEach(row => {
-                            let suma = 0;
-                            Object.entries(row).forEach(([k, v]) => {
-                                if (k.startsWith('L'+selected+'_')) suma += parseInt(v);
-                            });
-                            datosLinea.push(suma);
-                        });
-                        chartData.labels = labels;
-                        chartData.datasets.forEach(ds => {
-                            if (ds.label === 'Línea ' + selected) {
-                                ds.data = datosLinea;
-                                ds.hidden = false;
-                            } else {
-                                ds.data = [];
-                                ds.hidden = true;
-                            }
-                        });
-                    }
+                    if (!historial.timestamps || historial.timestamps.length === 0) return;
+                    chartData.labels = historial.timestamps.map(ts => ts.split(' ')[1]);
+                    chartData.datasets.forEach(ds => {
+                        const linea = ds.label.replace('Línea ', '');
+                        const serie = historial.lines[linea];
+                        ds.data = serie || [];
+                        ds.hidden = !serie;
+                    });
                     if (chart) {
                         chart.update();
                     } else {
@@ -509,94 +544,222 @@ def create_map():
                 this.textContent = '+';
             }
         });
-        // Eliminar cualquier listener de popupopen para que NO actualice al abrir el popup
-        // Solo actualizar afluencia y estatus con updateStations (cada ciclo de simulación)
         // Iniciar el temporizador de actualización al cargar la página
         setInterval(updateCountdown, 1000);
-        // Asegurar que todos los círculos tengan el atributo data-line correcto al cargar el mapa
+        // El mapa base se pide aparte (caché del navegador) cuando Leaflet ya existe
         window.addEventListener('load', function() {
-            setTimeout(() => {
-                fetch('/station_coords')
-                  .then(r => r.json())
-                  .then(stationCoords => {
-                    // Obtener el mapa Leaflet
-                    const map = getLeafletMap();
-                    // Obtener el bounding box del mapa para transformar coordenadas a pixeles
-                    const bounds = map.getBounds();
-                    const topLeft = map.latLngToLayerPoint(bounds.getNorthWest());
-                    const bottomRight = map.latLngToLayerPoint(bounds.getSouthEast());
-                    // Emparejar círculos SVG con estaciones por posición
-                    document.querySelectorAll('svg.leaflet-zoom-animated circle').forEach(marker => {
-                        // Obtener posición del círculo en pixeles
-                        const cx = parseFloat(marker.getAttribute('cx'));
-                        const cy = parseFloat(marker.getAttribute('cy'));
-                        let minDist = 999999;
-                        let bestId = null;
-                        Object.entries(stationCoords).forEach(([sid, info]) => {
-                            // Convertir lat/lon a punto en pixeles
-                            const latlng = L.latLng(info.coords[1], info.coords[0]);
-                            const point = map.latLngToLayerPoint(latlng);
-                            const dx = point.x - cx;
-                            const dy = point.y - cy;
-                            const dist = Math.sqrt(dx*dx + dy*dy);
-                            if (dist < minDist) {
-                                minDist = dist;
-                                bestId = sid;
-                            }
-                        });
-                        // Si la distancia es razonable (menos de 10 pixeles), asignar data-line
-                        if (bestId && minDist < 10) {
-                            marker.setAttribute('data-line', stationCoords[bestId].linea);
-                            marker.setAttribute('data-station-id', bestId);
-                        }
-                    });
-                  });
-            }, 1200); // Espera a que el mapa y los círculos estén renderizados
+            setTimeout(loadBasemap, 300);
         });
     </script>
     """
+    time_control = time_control.replace('__WEBSOCKET_PORT__', str(WEBSOCKET_PORT))
     m.get_root().html.add_child(folium.Element(time_control))
-    m.save(output_path)
-    print(f"Nuevo mapa interactivo guardado en: {output_path}")
+    _write_atomic(output_path, m.get_root().render())
+    _write_atomic(output_path + '.key', key)
+    logger.info("Nuevo mapa interactivo guardado en: %s", output_path)
     return output_path
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Latencia y tamaño de respuesta por ruta (la plantilla, no la URL concreta)"""
+    inicio = g.pop('request_start', None)
+    if inicio is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - inicio, route, str(response.status_code))
+        if response.content_length is not None:
+            metrics.RESPONSE_BYTES.observe(response.content_length, route)
+    return response
+
+@app.before_request
+def sync_shared_state():
+    """En workers de gunicorn, reflejar el último paso publicado por el productor"""
+    global automata, shared_sync
+    if not shared_state_name:
+        return
+    if shared_sync is None:
+        with _shared_lock:
+            if shared_sync is None:
+                automata = build_automata()
+                configure_worker(automata)
+                shared_sync = SharedStateSync(
+                    automata, SharedStateReader(shared_state_name), snapshot_cache
+                )
+    shared_sync.refresh()
+
 @app.route('/')
 def home():
-    return send_file('metro_simulation.html')
+    ensure_map(automata)
+    return send_file(MAP_OUTPUT_PATH)
+
+@app.route('/basemap.geojson')
+def basemap():
+    """Capa estática de la red; el navegador la revalida con ETag"""
+    ensure_map(automata)
+    return send_file(BASEMAP_PATH, mimetype='application/geo+json', max_age=3600)
 
 @app.route('/events')
 def events():
-    """Endpoint para obtener actualizaciones y almacenar en el historial"""
-    if not automata:
+    """Endpoint de sólo lectura con el último estado (soporta If-None-Match)"""
+    snapshot = snapshot_cache.current()
+    if snapshot is None:
+        return jsonify({'error': 'Simulación no iniciada'})
+    if request.if_none_match.contains(snapshot.etag):
+        response = Response(status=304)
+    else:
+        response = Response(snapshot.body, mimetype='application/json')
+    response.set_etag(snapshot.etag)
+    return response
+
+def current_schema():
+    """Esquema de la red serializado una sola vez por proceso"""
+    global _schema, _schema_body
+    if _schema is None and automata is not None:
+        _schema_body = json.dumps(wire_format.build_schema(automata), separators=(',', ':')).encode()
+        _schema = json.loads(_schema_body)
+    return _schema
+
+@app.route('/schema')
+def schema():
+    """Orden de estaciones, líneas y coordenadas para interpretar /state (versionado)"""
+    if current_schema() is None:
+        return jsonify({'error': 'Simulación no iniciada'})
+    if request.if_none_match.contains(_schema['id']):
+        response = Response(status=304)
+    else:
+        response = Response(_schema_body, mimetype='application/json')
+    response.set_etag(_schema['id'])
+    return response
+
+@app.route('/state')
+def compact_state():
+    """Valores del último paso en el orden de /schema.
+
+    Parámetros opcionales:
+    - ``format=bin`` (por defecto, ver ``wire_format``) o ``format=json``.
+    - ``since=<seq>``: si es el paso anterior, se envían sólo las diferencias.
+    - ``gzip=1`` o ``Accept-Encoding: gzip``: cuerpo comprimido.
+    """
+    snapshot = snapshot_cache.current()
+    if snapshot is None or current_schema() is None:
         return jsonify({'error': 'Simulación no iniciada'})
-    current_state = {
-        station_id: int(people)
-        for station_id, people in automata.get_current_state().items()
-    }
-    history_logger.log(current_state)
-    return jsonify(current_state)
+    fmt = request.args.get('format', 'bin')
+    if fmt not in ENCODERS:
+        return jsonify({'error': f'Formato no soportado: {fmt}'}), 400
+    since = request.args.get('since', type=int)
+    compress = request.args.get('gzip') == '1' or request.accept_encodings['gzip'] > 0
+    schema_id = int(_schema['id'], 16)
+    body, delta = snapshot.encode(fmt, schema_id, since, compress)
+    # El cuerpo lleva ``seq``: un mismo contenido en otro paso es otra etiqueta
+    etag = (f"{snapshot.etag}-{snapshot.seq}-{fmt}-{snapshot.previous[0] if delta else 'full'}"
+            f"{'-gz' if compress else ''}")
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        mimetype = 'application/octet-stream' if fmt == 'bin' else 'application/json'
+        response = Response(body, mimetype=mimetype)
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-Metro-Seq'] = str(snapshot.seq)
+    response.headers['X-Metro-Schema'] = _schema['id']
+    return response
 
 @app.route('/history')
 def history():
-    """Endpoint para consultar el historial de afluencia"""
-    return jsonify(history_logger.read_all())
+    """Endpoint para consultar el historial de afluencia.
+
+    Parámetros opcionales:
+    - ``tail=N``: sólo los últimos N registros.
+    - ``since=<timestamp>``: registros posteriores (epoch o 'YYYY-MM-DD HH:MM:SS').
+    - ``line=X``: sólo las estaciones de la línea X.
+    - ``agg=line``: totales por línea calculados en el servidor,
+      ``{"timestamps": [...], "lines": {"1": [...], ...}}``.
+    """
+    tail = request.args.get('tail', type=int)
+    line = request.args.get('line')
+    agg = request.args.get('agg')
+    since = request.args.get('since')
+    if agg not in (None, 'line'):
+        return jsonify({'error': f'Agregación no soportada: {agg}'}), 400
+    if since is not None:
+        if since.isdigit():
+            since = int(since)
+        else:
+            try:
+                datetime.strptime(since, TIMESTAMP_FORMAT)
+            except ValueError:
+                return jsonify({'error': f'Fecha inválida en since: {since}'}), 400
+    if agg is None:
+        if tail is None and since is None and line is None:
+            with metrics.HISTORY_READ_SECONDS.time('all'):
+                filas = history_logger.read_all()
+        else:
+            with metrics.HISTORY_READ_SECONDS.time('query'):
+                filas = history_logger.query(since=since, tail=tail, line=line)
+        return jsonify(filas)
+    with metrics.HISTORY_READ_SECONDS.time('line_series'):
+        timestamps, series = history_logger.line_series(since=since, tail=tail, line=line)
+    return jsonify({
+        'timestamps': [
+            datetime.fromtimestamp(ts).strftime(TIMESTAMP_FORMAT) for ts in timestamps.tolist()
+        ],
+        'lines': {linea: totales.tolist() for linea, totales in series.items()}
+    })
 
 @app.route('/stats')
 def stats():
-    """Endpoint para consultar estadísticas globales de la simulación actual"""
+    """Estadísticas globales de la simulación actual (agregados precalculados por paso)"""
     if not automata:
         return jsonify({'error': 'Simulación no iniciada'})
-    state = automata.get_current_state()
-    total_afluencia = sum(state.values())
-    saturadas = sum(1 for v in state.values() if v >= 3500)
-    min_afluencia = min(state.values()) if state else 0
-    max_afluencia = max(state.values()) if state else 0
+    agregados = automata.aggregates()
     return jsonify({
-        'total_afluencia': total_afluencia,
-        'estaciones_saturadas': saturadas,
-        'min_afluencia': min_afluencia,
-        'max_afluencia': max_afluencia,
-        'num_estaciones': len(state)
+        'total_afluencia': agregados['total'],
+        'estaciones_saturadas': agregados['levels']['saturada'],
+        'estaciones_por_nivel': agregados['levels'],
+        'min_afluencia': agregados['min'],
+        'max_afluencia': agregados['max'],
+        'num_estaciones': agregados['stations'],
+        'top_estaciones': agregados['top']
+    })
+
+@app.route('/stats/lines')
+def stats_lines():
+    """Totales, máximo y estaciones por nivel de cada línea"""
+    if not automata:
+        return jsonify({})
+    return jsonify(automata.aggregates()['lines'])
+
+def segment_loads():
+    """(ventanas, carga media ``[ventanas, tramos]``) del productor o de este proceso"""
+    if shared_sync is not None:
+        return shared_sync.reader.segment_windows, shared_sync.reader.read_segments()
+    tracker = automata.segment_tracker if automata else None
+    if tracker is None:
+        return None, None
+    return tracker.windows, tracker.means()
+
+@app.route('/segments/hot')
+def segments_hot():
+    """Los ``k`` tramos con más carga media en la ventana ``window`` (en pasos)"""
+    windows, cargas = segment_loads()
+    if windows is None or not len(windows):
+        return jsonify({'error': 'Carga por tramo no disponible'})
+    k = request.args.get('k', default=10, type=int)
+    if k < 1:
+        return jsonify({'error': 'k debe ser positivo'}), 400
+    try:
+        j = segments.window_index(windows, request.args.get('window', type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    carga = cargas[j]
+    return jsonify({
+        'window': windows[j],
+        'segments': segments.describe(automata, segments.top_k(carga, k), carga),
     })
 
 @app.route('/station_ids')
@@ -619,14 +782,92 @@ def station_coords():
     # Devuelve {station_id: {'linea': ..., 'coords': [lon, lat]}}
     return jsonify({sid: {'linea': s['linea'], 'coords': [s['coords'][0], s['coords'][1]]} for sid, s in automata.stations.items()})
 
-def simulation_loop():
-    global automata
-    while True:
-        if automata:
-            automata.step()
-            # Guardar el estado current en el historial
-            history_logger.log(automata.get_current_state())
-        time.sleep(SIMULATION_INTERVAL)
+@app.route('/metrics')
+def metrics_endpoint():
+    """Métricas en formato de texto de Prometheus.
+
+    Bajo gunicorn se sirven las del worker que atiende y, a continuación,
+    las del productor (pasos e historial) según su último volcado. En ese
+    caso cada proceso sólo incluye las métricas que observó, para que
+    ninguna familia aparezca dos veces.
+    """
+    producer_metrics = os.environ.get(PRODUCER_METRICS_ENV)
+    body = metrics.REGISTRY.render(include_empty=not producer_metrics)
+    if producer_metrics:
+        try:
+            with open(producer_metrics) as f:
+                body += f.read()
+        except FileNotFoundError:
+            pass
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profile')
+def debug_profile():
+    """Muestrear el hilo de simulación durante ``seconds`` (pilas colapsadas).
+
+    En modo de proceso único se muestrea el hilo local; bajo gunicorn el
+    pedido va al productor por el FIFO de control y el perfil vuelve en
+    un archivo temporal.
+    """
+    if not PROFILE_ENABLED:
+        return jsonify({'error': 'Perfilado desactivado (PROFILE_ENABLED=1 para activarlo)'}), 404
+    seconds = request.args.get('seconds', default=5.0, type=float)
+    if not 0 < seconds <= PROFILE_MAX_SECONDS:
+        return jsonify({'error': f'seconds debe estar entre 0 y {PROFILE_MAX_SECONDS:g}'}), 400
+    control_path = os.environ.get(PRODUCER_CONTROL_ENV)
+    if sim_thread is not None and sim_thread.is_alive():
+        perfil = metrics.format_profile(metrics.sample_thread(sim_thread.ident, seconds))
+    elif control_path:
+        try:
+            perfil = request_profile(control_path, seconds)
+        except OSError as e:
+            logger.error("No se pudo pedir el perfil al productor: %s", e)
+            perfil = None
+        if perfil is None:
+            return jsonify({'error': 'El productor no devolvió el perfil'}), 503
+    else:
+        return jsonify({'error': 'Simulación no iniciada'})
+    return Response(perfil, mimetype='text/plain')
+
+def clock_status():
+    """Reloj del productor de este proceso o, bajo gunicorn, el publicado en memoria compartida"""
+    if producer is not None:
+        return producer.clock_status()
+    if shared_sync is not None:
+        return sim_clock.status(*shared_sync.reader.clock())
+    return None
+
+@app.route('/clock')
+def clock():
+    """Hora simulada, velocidad y si la simulación está en pausa"""
+    estado = clock_status()
+    if estado is None:
+        return jsonify({'error': 'Simulación no iniciada'})
+    return jsonify(estado)
+
+@app.route('/clock/<action>', methods=['POST'])
+def clock_control(action):
+    """Controlar el reloj: pause, resume, seek (?value=HH:MM[:SS] o segundos) y speed (?value=60)"""
+    value = request.args.get('value')
+    if value is None:
+        value = (request.get_json(silent=True) or {}).get('value')
+    try:
+        action, value = sim_clock.parse_command(action, value)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    control_path = os.environ.get(PRODUCER_CONTROL_ENV)
+    if producer is not None:
+        producer.control(action, value)
+    elif control_path:
+        try:
+            send_clock_command(control_path, action, value)
+        except OSError as e:
+            logger.error("No se pudo enviar la orden del reloj: %s", e)
+            return jsonify({'error': 'El productor no atiende órdenes del reloj'}), 503
+    else:
+        return jsonify({'error': 'Simulación no iniciada'})
+    # La orden se aplica en el siguiente tic: el estado devuelto puede no reflejarla aún
+    return jsonify({'accepted': {'action': action, 'value': value}, 'clock': clock_status()}), 202
 
 def find_free_port(start_port=5000, max_tries=20):
     port = start_port
@@ -638,22 +879,38 @@ def find_free_port(start_port=5000, max_tries=20):
     raise RuntimeError('No free port found')
 
 def main():
-    global automata
+    global automata, sim_thread, producer
     shp_path = SHAPEFILE_PATH
     afluencia_path = AFLUENCIA_PATH
     if not os.path.exists(shp_path):
-        print(f"Error: No se encuentra el archivo shapefile en {shp_path}")
+        logger.error("No se encuentra el archivo shapefile en %s", shp_path)
         return
     if not os.path.exists(afluencia_path):
-        print(f"Error: No se encuentra el archivo de afluencia en {afluencia_path}")
+        logger.error("No se encuentra el archivo de afluencia en %s", afluencia_path)
         return
-    automata = MetroAutomata(shp_path, afluencia_path)
-    create_map()
-    sim_thread = threading.Thread(target=simulation_loop, daemon=True)
+    automata = MetroAutomata(
+        shp_path, afluencia_path, cache_dir=NETWORK_CACHE_DIR, seed=SIMULATION_SEED
+    )
+    configure_simulation(automata, history_logger)
+    producer = SimulationProducer(
+        automata, history_logger, snapshot_cache=snapshot_cache, broadcaster=broadcaster,
+        checkpoint_path=CHECKPOINT_PATH
+    )
+    producer.publish(automata.get_current_state(), log_history=False)
+    ensure_map(automata)
+    broadcaster.start()
+    sim_thread = threading.Thread(target=producer.run, daemon=True)
     sim_thread.start()
     port = find_free_port(5000)
-    print(f"Iniciando servidor en http://localhost:{port}")
-    app.run(host='0.0.0.0', port=port, use_reloader=False)
+    logger.info("Iniciando servidor en http://localhost:%s", port)
+    try:
+        app.run(host='0.0.0.0', port=port, use_reloader=False)
+    finally:
+        # Guardar el estado para el siguiente arranque, sin un paso a medias
+        producer.stop()
+        sim_thread.join(timeout=10)
+        if not sim_thread.is_alive():
+            producer.checkpoint()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
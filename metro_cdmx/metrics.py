@@ -0,0 +1,165 @@
+"""Métricas ligeras en formato de texto de Prometheus y muestreo de hilos.
+
+Sin dependencias externas: histogramas acumulativos con etiquetas y un
+perfilador por muestreo basado en ``sys._current_frames``. Cada proceso
+tiene su propio registro; bajo gunicorn el productor vuelca sus métricas
+a un archivo que los workers anexan a ``/metrics``.
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Tuple
+
+# Límites en segundos: de decenas de microsegundos (fases de un paso)
+# a segundos (consultas de historial grandes)
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pares = [f'{k}="{_escape(v)}"' for k, v in zip(labelnames, values)]
+    if extra:
+        pares.append(extra)
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+def _escape(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(valor: float) -> str:
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+class Histogram:
+    """Histograma acumulativo con etiquetas opcionales"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # etiquetas -> [conteos por cubeta..., +Inf], suma
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str):
+        indice = bisect_left(self.buckets, value)
+        with self._lock:
+            serie = self._series.get(labels)
+            if serie is None:
+                serie = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - inicio, *labels)
+
+    def render(self) -> str:
+        lineas = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(conteos), suma) for labels, (conteos, suma) in self._series.items()]
+        for labels, conteos, suma in sorted(series):
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                le = '+Inf' if limite == float('inf') else _format_value(limite)
+                etiquetas = _format_labels(self.labelnames, labels, f'le="{le}"')
+                lineas.append(f"{self.name}_bucket{etiquetas} {acumulado}")
+            etiquetas = _format_labels(self.labelnames, labels)
+            lineas.append(f"{self.name}_sum{etiquetas} {_format_value(suma)}")
+            lineas.append(f"{self.name}_count{etiquetas} {acumulado}")
+        return '\n'.join(lineas)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, include_empty: bool = True) -> str:
+        """Texto de exposición; sin ``include_empty`` se omiten las métricas sin datos"""
+        bloques = [m.render() for m in self._metrics if include_empty or m._series]
+        return ''.join(b + '\n' for b in bloques)
+
+
+REGISTRY = Registry()
+
+STEP_SECONDS = REGISTRY.histogram(
+    'metro_step_seconds', 'Duración de step() completo, incluida la construcción del estado')
+CATCHUP_STEP_SECONDS = REGISTRY.histogram(
+    'metro_catchup_step_seconds', 'Duración de advance() en los pasos intermedios de un lote (sin publicar)')
+STEP_PHASE_SECONDS = REGISTRY.histogram(
+    'metro_step_phase_seconds', 'Duración de cada fase dentro de step()', ['phase'])
+HISTORY_WRITE_SECONDS = REGISTRY.histogram(
+    'metro_history_write_seconds', 'Latencia de history_logger.log() y log_batch()')
+HISTORY_READ_SECONDS = REGISTRY.histogram(
+    'metro_history_read_seconds', 'Latencia de las lecturas del historial', ['kind'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'metro_http_request_seconds', 'Latencia de las peticiones HTTP por ruta', ['route', 'status'])
+RESPONSE_BYTES = REGISTRY.histogram(
+    'metro_http_response_bytes', 'Tamaño del cuerpo de respuesta por ruta', ['route'],
+    buckets=SIZE_BUCKETS)
+
+
+def observe_phases(phase_times: Dict[str, float]):
+    for fase, duracion in phase_times.items():
+        STEP_PHASE_SECONDS.observe(duracion, fase)
+
+
+def dump(path: str, registry: Registry = REGISTRY):
+    """Escribir las métricas con datos en ``path`` de forma atómica (para otros procesos)"""
+    directorio = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(registry.render(include_empty=False))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def sample_thread(thread_id: int, seconds: float, interval: float = 0.005) -> Counter:
+    """Muestrear la pila de un hilo durante ``seconds``.
+
+    Devuelve un ``Counter`` de pilas colapsadas (``a;b;c`` de la más
+    externa a la más interna), compatible con flamegraph.pl/speedscope.
+    """
+    muestras = Counter()
+    fin = time.monotonic() + seconds
+    while time.monotonic() < fin:
+        frame = sys._current_frames().get(thread_id)
+        if frame is None:
+            break
+        pila = []
+        while frame is not None:
+            code = frame.f_code
+            pila.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        muestras[';'.join(reversed(pila))] += 1
+        time.sleep(interval)
+    return muestras
+
+
+def format_profile(muestras: Counter) -> str:
+    return ''.join(f"{pila} {n}\n" for pila, n in muestras.most_common())
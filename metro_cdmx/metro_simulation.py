@@ -1,75 +1,323 @@
-import geopandas as gpd
-import pandas as pd
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Optional, Union
+import copy
+import json
+import logging
 import os
+import time
+import unicodedata
+import network_cache
+from wire_format import schema_id
+
+AFLUENCIA_POR_DEFECTO = 2000
+STATION_FILENAME = "STC_Metro_estaciones_utm14n.shp"
+UTM_EPSG = 32614  # UTM zona 14N (CDMX)
+WGS84_EPSG = 4326
+# Niveles de afluencia del mapa: baja < 1500 <= media < 3500 <= saturada
+UMBRALES_AFLUENCIA = (1500, 3500)
+NIVELES_AFLUENCIA = ('baja', 'media', 'saturada')
+TOP_K = 10
+# Segundos simulados por paso cuando hay modelo de demanda
+STEP_SECONDS = 60.0
+# Subir este número cuando cambie el contenido de snapshot()
+SNAPSHOT_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_line(valor) -> str:
+    """Normalizar una línea: '01', 'Línea 1' y 1 se convierten en '1'; 'a' en 'A'"""
+    linea = str(valor).strip().upper()
+    for prefijo in ('LÍNEA', 'LINEA'):
+        if linea.startswith(prefijo):
+            linea = linea[len(prefijo):].strip()
+    if linea.isdigit():
+        linea = str(int(linea))
+    return linea
+
+
+def _normalize_name(valor) -> str:
+    """Normalizar un nombre de estación para comparar: sin acentos, mayúsculas ni espacios extra"""
+    texto = unicodedata.normalize('NFKD', str(valor))
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return ' '.join(texto.casefold().split())
+
 
 class MetroAutomata:
-    def __init__(self, shp_path: str, afluencia_path: str):
+    def __init__(self, shp_path: str, afluencia_path: str, cache_dir: Optional[str] = None,
+                 seed=None):
+        self._init_state(seed)
+
+        # Inicializar afluencia
+        self.afluencia_base = {
+            '1': 3000, '2': 2800, '3': 2600, '4': 2000,
+            '5': 2200, '6': 2100, '7': 2300, '8': 2400,
+            '9': 2500, '12': 2700, 'A': 2700, 'B': 2900
+        }
+
+        # Con caché válida no se lee ningún shapefile ni se importa geopandas
+        cache_path = None
+        if cache_dir:
+            station_path = os.path.join(os.path.dirname(shp_path), STATION_FILENAME)
+            key = network_cache.cache_key([shp_path, station_path, afluencia_path])
+            cache_path = network_cache.cache_file(cache_dir, key)
+            self._cached_network = network_cache.load_network(cache_path)
+            if self._cached_network is not None:
+                logger.info("Red cargada desde caché: %s", cache_path)
+        self.cache_path = cache_path
+
+        if self._cached_network is None:
+            self._load_sources(shp_path, afluencia_path)
+
+        self.initialize_stations()
+
+        if cache_path and self._cached_network is None:
+            try:
+                network_cache.save_network(cache_path, self._network_arrays())
+                logger.info("Caché de la red guardada en: %s", cache_path)
+            except OSError as e:
+                logger.warning("No se pudo guardar la caché de la red: %s", e)
+
+    @classmethod
+    def from_cache(cls, cache_path: str, seed=None) -> 'MetroAutomata':
+        """Crear el autómata directamente desde un archivo de caché ``.npz``"""
+        data = network_cache.load_network(cache_path)
+        if data is None:
+            raise FileNotFoundError(f"No existe la caché de la red: {cache_path}")
+        automata = cls.__new__(cls)
+        automata._init_state(seed)
+        automata._cached_network = data
+        automata.cache_path = cache_path
+        automata.initialize_stations()
+        return automata
+
+    @classmethod
+    def from_frames(cls, metro_network, stations_network, afluencia_data=None,
+                    seed=None) -> 'MetroAutomata':
+        """Crear el autómata desde GeoDataFrames ya cargados (p. ej. redes sintéticas)"""
+        automata = cls.__new__(cls)
+        automata._init_state(seed)
+        automata.metro_network = metro_network
+        automata.stations_network = stations_network
+        automata.afluencia_data = afluencia_data
+        automata.initialize_stations()
+        return automata
+
+    def _init_state(self, seed=None):
+        """Atributos comunes a todos los constructores, antes de cargar la red"""
+        # Generador propio: misma semilla, misma trayectoria
+        self.reseed(seed)
+        self.afluencia_base = {}
+        self.metro_network = None
+        self.stations_network = None
+        self.afluencia_data = None
+        self._cached_network = None
+        self.cache_path = None
+        # Duración de cada fase del último paso (la recogen las métricas)
+        self.phase_times: Dict[str, float] = {}
+        self.top_k = TOP_K
+        self.stations = {}
+        self._reset_dynamics()
+
+    def _reset_dynamics(self):
+        # Reloj simulado (segundos desde la medianoche del primer día); sin
+        # modelo de demanda el paso es la variación aleatoria original y sin
+        # flujos origen–destino, las transferencias entre vecinas
+        self.demand = None
+        self.od = None
+        self.station_load = None
+        self.segment_load = None
+        # Flujo del último paso por tramo dirigido (alineado con _edge_src/_edge_dst)
+        # y, con track_segments(), sus ventanas móviles
+        self.edge_flow = None
+        self.segment_tracker = None
+        self.step_seconds = STEP_SECONDS
+        self.sim_seconds = 0.0
+        self.steps = 0
+
+    def set_demand(self, profile, step_seconds: float = STEP_SECONDS, start_seconds: float = 0.0):
+        """Usar un ``demand.DemandProfile`` en ``advance()``.
+
+        Cada paso avanza ``step_seconds`` el reloj simulado, que empieza en
+        ``start_seconds`` (segundos desde la medianoche). ``None`` vuelve a
+        la variación aleatoria.
+        """
+        if profile is not None and profile.table.shape[0] != len(self.station_ids):
+            raise ValueError("El perfil de demanda no corresponde a las estaciones de la red")
+        self.demand = profile
+        self.step_seconds = float(step_seconds)
+        self.sim_seconds = float(start_seconds)
+
+    def set_flow(self, router):
+        """Mover a los pasajeros con flujos origen–destino (``od_flow.ODRouter``).
+
+        En cada paso los viajes salen de su origen, llegan a su destino y
+        dejan en ``station_load`` y ``segment_load`` la carga de cada
+        estación y tramo de sus rutas. ``None`` vuelve a las transferencias
+        entre vecinas.
+        """
+        if router is not None and router.n != len(self.station_ids):
+            raise ValueError("Las rutas origen–destino no corresponden a las estaciones de la red")
+        self.od = router
+        self.station_load = self.segment_load = None
+
+    def track_segments(self, windows=None):
+        """Acumular ``edge_flow`` en ventanas móviles (``segments.SegmentLoadTracker``)"""
+        import segments
+
+        self.segment_tracker = segments.SegmentLoadTracker(
+            len(self._edge_src), windows or segments.DEFAULT_WINDOWS
+        )
+
+    def snapshot(self, path: Optional[str] = None) -> Dict[str, np.ndarray]:
+        """Estado que evoluciona al simular: afluencia, generador aleatorio y reloj.
+
+        La red no se incluye (sale de la caché ``.npz``); sólo se guarda el
+        identificador del orden de estaciones para comprobarlo al restaurar.
+        Con ``path`` se escribe además como ``.npz`` de forma atómica.
+        """
+        semillas = self.seed_sequence
+        generador = {
+            'bit_generator': self.rng.bit_generator.state,
+            'seed_sequence': {
+                'entropy': semillas.entropy,
+                'spawn_key': list(semillas.spawn_key),
+                'pool_size': semillas.pool_size,
+                'n_children_spawned': semillas.n_children_spawned,
+            },
+        }
+        arrays = {
+            'version': np.array(SNAPSHOT_VERSION, dtype=np.int64),
+            'schema': np.array(schema_id(self.station_ids), dtype=np.uint64),
+            'current_people': self.current_people.astype(np.uint32),
+            'clock': np.array([self.sim_seconds, self.step_seconds], dtype=np.float64),
+            'steps': np.array(self.steps, dtype=np.int64),
+            'rng': np.frombuffer(json.dumps(generador).encode(), dtype=np.uint8),
+        }
+        if path:
+            network_cache.save_arrays(path, arrays)
+        return arrays
+
+    def restore(self, source: Union[str, Dict[str, np.ndarray]]) -> 'MetroAutomata':
+        """Volver al estado de ``snapshot()`` (archivo o diccionario de arreglos)"""
+        if isinstance(source, (str, os.PathLike)):
+            with np.load(source, allow_pickle=False) as data:
+                source = {name: data[name] for name in data.files}
+        if int(source['version']) != SNAPSHOT_VERSION:
+            raise ValueError(f"Versión de instantánea no soportada: {int(source['version'])}")
+        if int(source['schema']) != schema_id(self.station_ids):
+            raise ValueError("La instantánea corresponde a otra red")
+        generador = json.loads(source['rng'].tobytes())
+        semillas = generador['seed_sequence']
+        self.seed_sequence = np.random.SeedSequence(
+            semillas['entropy'], spawn_key=tuple(semillas['spawn_key']),
+            pool_size=semillas['pool_size'], n_children_spawned=semillas['n_children_spawned']
+        )
+        self.rng = np.random.default_rng(self.seed_sequence)
+        self.rng.bit_generator.state = generador['bit_generator']
+        self.current_people = source['current_people'].astype(np.int64)
+        self.sim_seconds, self.step_seconds = (float(v) for v in source['clock'])
+        self.steps = int(source['steps'])
+        return self
+
+    def fork(self, snapshot: Optional[Dict[str, np.ndarray]] = None, seed=None) -> 'MetroAutomata':
+        """Rama independiente desde ``snapshot`` (por omisión, el estado actual).
+
+        Comparte con este autómata la red y el modelo de demanda, que no
+        cambian al simular, así que no se vuelve a inicializar nada. Con
+        ``seed`` la rama toma otro generador y diverge de las demás.
+        """
+        rama = copy.copy(self)
+        rama.phase_times = {}
+        rama.segment_tracker = copy.deepcopy(self.segment_tracker)
+        rama.restore(self.snapshot() if snapshot is None else snapshot)
+        if seed is not None:
+            rama.reseed(seed)
+        return rama
+
+    def reseed(self, seed=None):
+        """Reiniciar el generador aleatorio con una semilla (int o ``SeedSequence``)"""
+        if isinstance(seed, np.random.SeedSequence):
+            self.seed_sequence = seed
+        else:
+            self.seed_sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(self.seed_sequence)
+
+    def spawn_seeds(self, n: int) -> List[np.random.SeedSequence]:
+        """Semillas hijas independientes para corridas derivadas de esta"""
+        return self.seed_sequence.spawn(n)
+
+    def _load_sources(self, shp_path: str, afluencia_path: str):
+        """Leer shapefiles y CSV de afluencia (arranque en frío)"""
+        import geopandas as gpd
+        import pandas as pd
+
         self.metro_network = gpd.read_file(shp_path)
         
         # Cargar archivo de estaciones
         shp_dir = os.path.dirname(shp_path)
-        station_path = os.path.join(shp_dir, "STC_Metro_estaciones_utm14n.shp")
+        station_path = os.path.join(shp_dir, STATION_FILENAME)
         
         try:
             self.stations_network = gpd.read_file(station_path)
-            print("Archivo de estaciones cargado correctamente")
+            logger.info("Archivo de estaciones cargado correctamente")
         except Exception as e:
-            print(f"Error al cargar estaciones: {e}")
+            logger.error("Error al cargar estaciones: %s", e)
             self.stations_network = None
-
-        # Inicializar afluencia
-        self.afluencia_base = {
-            '1': 3000, '2': 2800, '3': 2600, '4': 2000,
-            '5': 2200, '6': 2100, '7': 2300, '8': 2400,
-            '9': 2500, '12': 2700, 'A': 2700, 'B': 2900
-        }
         
         try:
             # Cargar datos de afluencia una sola vez para inicialización
             self.afluencia_data = pd.read_csv(afluencia_path)
-            print("Datos de afluencia cargados correctamente")
+            logger.info("Datos de afluencia cargados correctamente")
         except Exception as e:
-            print(f"Error al cargar datos de afluencia: {e}")
+            logger.error("Error al cargar datos de afluencia: %s", e)
             self.afluencia_data = None
 
-        self.stations = {}
-        self.initialize_stations()
-
     def initialize_stations(self):
         """Inicializar todas las estaciones con sus propiedades"""
         self.stations = {}
+        if self._cached_network is not None:
+            self._load_cached_stations(self._cached_network)
+            return
+        self.has_station_file = self.stations_network is not None
         if self.stations_network is not None:
-            for _, station in self.stations_network.iterrows():
+            afluencias = self._ridership_index()
+            sin_datos = []
+            columnas = zip(
+                self.stations_network['LINEA'],
+                self.stations_network['CVE_EST'],
+                self.stations_network['NOMBRE'],
+                self.stations_network.geometry.x.tolist(),
+                self.stations_network.geometry.y.tolist(),
+            )
+            for linea, cve_est, nombre, x, y in columnas:
                 try:
-                    linea = str(station['LINEA']).strip().upper()
                     # Normalizar línea: si es 'A' o 'B' dejar igual, si es número quitar ceros a la izquierda
-                    if linea.isdigit():
-                        linea = str(int(linea))
+                    linea = _normalize_line(linea)
+                    nombre = str(nombre).strip()
                     # --- CORRECCIÓN: quitar ceros a la izquierda en el ID ---
-                    station_id = f"L{linea}_{station['CVE_EST']}"
-                    coords = (station.geometry.x, station.geometry.y)
-                    afluencia_inicial = 2000  # valor por defecto
-                    if self.afluencia_data is not None:
-                        estacion_data = self.afluencia_data[
-                            (self.afluencia_data['linea'] == f'Línea {linea}') &
-                            (self.afluencia_data['estacion'] == station['NOMBRE'].strip())
-                        ]
-                        if not estacion_data.empty:
-                            afluencia_inicial = int(estacion_data['afluencia'].iloc[0])
+                    station_id = f"L{linea}_{cve_est}"
+                    afluencia_inicial = afluencias.get((linea, _normalize_name(nombre)))
+                    if afluencia_inicial is None:
+                        afluencia_inicial = AFLUENCIA_POR_DEFECTO
+                        sin_datos.append(f"{nombre} (L{linea})")
                     self.stations[station_id] = {
                         'capacity': max(5000, afluencia_inicial * 2),
                         'current_people': afluencia_inicial,
                         'base_afluencia': afluencia_inicial,
-                        'coords': coords,
+                        'coords': (x, y),
                         'linea': linea,
-                        'nombre': station['NOMBRE'].strip(),
-                        'cve_est': station['CVE_EST']
+                        'nombre': nombre,
+                        'cve_est': cve_est
                     }
                 except Exception as e:
-                    print(f"Error al procesar estación: {e}")
+                    logger.error("Error al procesar estación: %s", e)
                     continue
+            if self.afluencia_data is not None and sin_datos:
+                logger.warning(
+                    "%d de %d estaciones sin datos de afluencia (se usa %d): %s",
+                    len(sin_datos), len(self.stations), AFLUENCIA_POR_DEFECTO, ', '.join(sin_datos)
+                )
         else:
             # Método alternativo usando líneas
             for _, row in self.metro_network.iterrows():
@@ -87,72 +335,378 @@ class MetroAutomata:
                     station_id = f"L{linea}_E{i}"
                     self.stations[station_id] = {
                         'capacity': 5000,
-                        'current_people': np.random.randint(1000, 3000),
+                        'current_people': int(self.rng.integers(1000, 3000)),
                         'coords': coord,
                         'linea': linea,
                         'nombre': f'Estación {station_id}'
                     }
+        self._build_arrays()
+        self._build_geometry()
+
+    def _build_geometry(self):
+        """Calcular coordenadas de estaciones y trazos de líneas en UTM y EPSG:4326"""
+        if self.stations_network is not None:
+            self.station_coords_utm = self._points_xy(self.stations_network, UTM_EPSG)
+            self.station_coords_wgs84 = self._points_xy(self.stations_network, WGS84_EPSG)
+        else:
+            # Los puntos del método alternativo salen de las líneas (UTM)
+            import geopandas as gpd
+            from shapely.geometry import Point
+            coords = [self.stations[sid]['coords'][:2] for sid in self.station_ids]
+            puntos = gpd.GeoDataFrame(
+                geometry=[Point(c) for c in coords], crs=self.metro_network.crs
+            )
+            self.station_coords_utm = self._points_xy(puntos, UTM_EPSG)
+            self.station_coords_wgs84 = self._points_xy(puntos, WGS84_EPSG)
+
+        # Trazos de cada línea como coordenadas concatenadas + desplazamientos
+        nombres, offsets, utm, wgs84 = [], [0], [], []
+        lineas_utm = self._to_crs(self.metro_network, UTM_EPSG)
+        lineas_wgs84 = self._to_crs(self.metro_network, WGS84_EPSG)
+        for linea, geom_utm, geom_wgs84 in zip(
+            self.metro_network['LINEA'], lineas_utm.geometry, lineas_wgs84.geometry
+        ):
+            partes_utm = geom_utm.geoms if hasattr(geom_utm, 'geoms') else [geom_utm]
+            partes_wgs84 = geom_wgs84.geoms if hasattr(geom_wgs84, 'geoms') else [geom_wgs84]
+            for parte_utm, parte_wgs84 in zip(partes_utm, partes_wgs84):
+                nombres.append(_normalize_line(linea))
+                utm.append(np.asarray(parte_utm.coords)[:, :2])
+                wgs84.append(np.asarray(parte_wgs84.coords)[:, :2])
+                offsets.append(offsets[-1] + len(utm[-1]))
+        self.line_part_names = nombres
+        self.line_part_offsets = np.array(offsets, dtype=np.int64)
+        self.line_coords_utm = np.concatenate(utm) if utm else np.empty((0, 2))
+        self.line_coords_wgs84 = np.concatenate(wgs84) if wgs84 else np.empty((0, 2))
+
+    @staticmethod
+    def _to_crs(gdf, epsg: int):
+        if gdf.crs is None or gdf.crs.to_epsg() == epsg:
+            return gdf
+        return gdf.to_crs(epsg=epsg)
+
+    @classmethod
+    def _points_xy(cls, gdf, epsg: int) -> np.ndarray:
+        geometria = cls._to_crs(gdf, epsg).geometry
+        return np.column_stack([geometria.x.to_numpy(), geometria.y.to_numpy()])
+
+    def line_paths(self, crs: str = 'wgs84') -> List:
+        """Devolver [(linea, arreglo (k, 2) de coordenadas x/y)] por cada trazo de línea"""
+        coords = self.line_coords_wgs84 if crs == 'wgs84' else self.line_coords_utm
+        return [
+            (linea, coords[inicio:fin])
+            for linea, inicio, fin in zip(
+                self.line_part_names, self.line_part_offsets[:-1], self.line_part_offsets[1:]
+            )
+        ]
+
+    def _network_arrays(self) -> Dict[str, np.ndarray]:
+        """Tabla normalizada de la red lista para guardarse en la caché"""
+        return {
+            'station_ids': np.array(self.station_ids, dtype=str),
+            'linea': np.array([s['linea'] for s in self.stations.values()], dtype=str),
+            'nombre': np.array(self.station_names, dtype=str),
+            'cve_est': np.array([str(s.get('cve_est', '')) for s in self.stations.values()], dtype=str),
+            'capacity': self.capacity,
+            'base_afluencia': np.array(
+                [s.get('base_afluencia', 0) for s in self.stations.values()], dtype=np.int64
+            ),
+            'current_people': self.current_people,
+            'coords': np.array([s['coords'][:2] for s in self.stations.values()], dtype=np.float64),
+            'coords_utm': self.station_coords_utm,
+            'coords_wgs84': self.station_coords_wgs84,
+            'neighbor_indptr': self.neighbor_indptr,
+            'neighbor_indices': self.neighbor_indices,
+            'has_station_file': np.array(self.has_station_file),
+            'line_part_names': np.array(self.line_part_names, dtype=str),
+            'line_part_offsets': self.line_part_offsets,
+            'line_coords_utm': self.line_coords_utm,
+            'line_coords_wgs84': self.line_coords_wgs84,
+        }
+
+    def _load_cached_stations(self, data: Dict[str, np.ndarray]):
+        """Reconstruir estaciones, arreglos y adyacencia desde la caché"""
+        self.has_station_file = bool(data['has_station_file'])
+        coords = data['coords'].tolist()
+        for i, station_id in enumerate(data['station_ids'].tolist()):
+            self.stations[station_id] = {
+                'capacity': int(data['capacity'][i]),
+                'current_people': int(data['current_people'][i]),
+                'base_afluencia': int(data['base_afluencia'][i]),
+                'coords': tuple(coords[i]),
+                'linea': str(data['linea'][i]),
+                'nombre': str(data['nombre'][i]),
+                'cve_est': str(data['cve_est'][i])
+            }
+        self._build_arrays(adjacency=(data['neighbor_indptr'], data['neighbor_indices']))
+        self.station_coords_utm = data['coords_utm']
+        self.station_coords_wgs84 = data['coords_wgs84']
+        self.line_part_names = data['line_part_names'].tolist()
+        self.line_part_offsets = data['line_part_offsets']
+        self.line_coords_utm = data['line_coords_utm']
+        self.line_coords_wgs84 = data['line_coords_wgs84']
+
+    def _build_arrays(self, adjacency=None):
+        """Copiar el estado de las estaciones a arreglos contiguos de NumPy.
+
+        A partir de aquí los arreglos son la fuente de verdad de la afluencia;
+        el diccionario ``self.stations`` sólo guarda los datos estáticos.
+        """
+        self.station_ids = list(self.stations.keys())
+        self.station_index = {sid: i for i, sid in enumerate(self.station_ids)}
+        self.station_names = [s['nombre'] for s in self.stations.values()]
+        self.current_people = np.array(
+            [s.pop('current_people') for s in self.stations.values()], dtype=np.int64
+        )
+        self.capacity = np.array(
+            [s['capacity'] for s in self.stations.values()], dtype=np.int64
+        )
+        self.lines = sorted({s['linea'] for s in self.stations.values()})
+        line_pos = {linea: i for i, linea in enumerate(self.lines)}
+        self.line_index = np.array(
+            [line_pos[s['linea']] for s in self.stations.values()], dtype=np.int64
+        )
+
+        self._build_adjacency(adjacency)
+
+    def _build_adjacency(self, adjacency=None):
+        """Construir una sola vez el índice de vecinos (formato CSR) y los transbordos.
+
+        Las vecinas de una estación son la anterior y la siguiente dentro de su
+        línea, en el orden del archivo de estaciones. Los transbordos agrupan las
+        estaciones de distintas líneas que comparten nombre (sin distinguir
+        acentos, mayúsculas ni espacios, ver ``_normalize_name``).
+        """
+        n = len(self.station_ids)
+        if adjacency is not None:
+            self.neighbor_indptr, self.neighbor_indices = adjacency
+        else:
+            por_linea = {}
+            if self.has_station_file:
+                for i, station_id in enumerate(self.station_ids):
+                    por_linea.setdefault(station_id.split('_')[0], []).append(i)
+
+            vecinos = [[] for _ in range(n)]
+            for indices in por_linea.values():
+                for a, b in zip(indices, indices[1:]):
+                    vecinos[a].append(b)
+                    vecinos[b].append(a)
+            for lista in vecinos:
+                lista.sort()
+
+            self.neighbor_indptr = np.zeros(n + 1, dtype=np.int64)
+            self.neighbor_indptr[1:] = np.cumsum([len(lista) for lista in vecinos])
+            self.neighbor_indices = np.array(
+                [j for lista in vecinos for j in lista], dtype=np.int64
+            )
+        indptr = self.neighbor_indptr.tolist()
+        indices = self.neighbor_indices.tolist()
+        self.neighbors = {
+            station_id: tuple(self.station_ids[j] for j in indices[indptr[i]:indptr[i + 1]])
+            for i, station_id in enumerate(self.station_ids)
+        }
+
+        # Transbordos: mismo nombre de estación en varias líneas
+        por_nombre = {}
+        for station_id, nombre in zip(self.station_ids, self.station_names):
+            por_nombre.setdefault(_normalize_name(nombre), []).append(station_id)
+        self.interchanges = {
+            self.stations[ids[0]]['nombre']: tuple(ids)
+            for ids in por_nombre.values()
+            if len({self.stations[sid]['linea'] for sid in ids}) > 1
+        }
+        self._interchange_of = {
+            sid: ids for ids in self.interchanges.values() for sid in ids
+        }
+
+        # Lista de aristas dirigidas (estación -> vecina) para las transferencias
+        self._degree = np.diff(self.neighbor_indptr)
+        self._edge_src = np.repeat(np.arange(n, dtype=np.int64), self._degree)
+        self._edge_dst = self.neighbor_indices
+
+    def _ridership_index(self) -> Dict:
+        """Agregar la afluencia una sola vez por (línea, estación) normalizadas.
+
+        Conserva el primer registro de cada estación, igual que la búsqueda
+        original fila por fila.
+        """
+        if self.afluencia_data is None:
+            return {}
+        import pandas as pd
+
+        datos = self.afluencia_data
+        claves = pd.DataFrame({
+            'linea': datos['linea'].map(_normalize_line),
+            'estacion': datos['estacion'].map(_normalize_name),
+            'afluencia': pd.to_numeric(datos['afluencia'], errors='coerce'),
+        }).dropna(subset=['afluencia'])
+        primeros = claves.groupby(['linea', 'estacion'], sort=False)['afluencia'].first()
+        return {clave: int(valor) for clave, valor in primeros.items()}
 
     def step(self):
-        """Actualizar estado de cada estación"""
-        new_states = {}
-        
-        for station_id, station in self.stations.items():
-            current = int(station['current_people'])
-            capacity = int(station['capacity'])
-            # Rango de afluencia permitido para cada celda (estación):
-            # - Mínimo: 100 personas
-            # - Máximo: capacidad de la estación (por defecto 5000 o afluencia_inicial*2)
-            # La variación por paso es entre -1000 y +1000 (por la suma de transferencias y variación aleatoria)
-            variacion_base = np.random.randint(100, 1000)  # Mayor rango de variación
-            direccion = np.random.choice([-1, 1], p=[0.4, 0.6])  # Tendencia a aumentar
-            variacion = variacion_base * direccion
-            
-            # Aplicar límites y reglas
-            nuevo_valor = max(100, min(current + variacion, capacity))
-            
-            # Transferencias entre estaciones conectadas
-            neighbors = self.get_connected_stations(station_id)
-            if neighbors and np.random.random() < 0.3:  # 30% de probabilidad
-                for neighbor in neighbors:
-                    transfer = int(nuevo_valor * 0.2)  # Transferir hasta 20%
-                    if nuevo_valor > transfer:
-                        nuevo_valor -= transfer
-                        self.stations[neighbor]['current_people'] = min(
-                            self.stations[neighbor]['current_people'] + transfer,
-                            self.stations[neighbor]['capacity']
-                        )
-            
-            new_states[station_id] = int(nuevo_valor)
-            self.stations[station_id]['current_people'] = nuevo_valor
-            print(f"Estación {station['nombre']}: {current:,} -> {nuevo_valor:,}")
-        
-        return new_states
+        """Actualizar estado de todas las estaciones en una sola pasada vectorizada"""
+        anterior = self.current_people
+        nuevo = self.advance()
+        inicio = time.perf_counter()
+        # Detalle por estación sólo con DEBUG: fuera de la ruta caliente normal
+        if logger.isEnabledFor(logging.DEBUG):
+            for nombre, antes, despues in zip(self.station_names, anterior.tolist(), nuevo.tolist()):
+                logger.debug("Estación %s: %s -> %s", nombre, f"{antes:,}", f"{despues:,}")
+
+        state = dict(zip(self.station_ids, nuevo.tolist()))
+        self.phase_times['state'] = time.perf_counter() - inicio
+        inicio = time.perf_counter()
+        self.aggregates()
+        self.phase_times['aggregates'] = time.perf_counter() - inicio
+        return state
+
+    @property
+    def current_people(self) -> np.ndarray:
+        return self._current_people
+
+    @current_people.setter
+    def current_people(self, values: np.ndarray):
+        # Cualquier cambio de la afluencia invalida los agregados
+        self._current_people = values
+        self._aggregates = None
+
+    def aggregates(self) -> Dict:
+        """Agregados de la red y por línea para el estado actual.
+
+        ``step()`` los calcula una vez por paso con operaciones vectorizadas
+        (bincount y argpartition); hasta el siguiente cambio de la afluencia
+        cada consulta es O(1). Incluye total, mínimo y máximo, estaciones
+        por nivel (``UMBRALES_AFLUENCIA``), totales por línea y las
+        ``top_k`` estaciones con más afluencia.
+        """
+        if self._aggregates is not None:
+            return self._aggregates
+        personas = self._current_people
+        n, n_lineas = len(personas), len(self.lines)
+        nivel = np.searchsorted(UMBRALES_AFLUENCIA, personas, side='right')
+        totales = np.bincount(self.line_index, weights=personas, minlength=n_lineas)
+        por_nivel = np.bincount(
+            self.line_index * len(NIVELES_AFLUENCIA) + nivel,
+            minlength=n_lineas * len(NIVELES_AFLUENCIA)
+        ).reshape(n_lineas, len(NIVELES_AFLUENCIA))
+        maximos = np.zeros(n_lineas, dtype=np.int64)
+        np.maximum.at(maximos, self.line_index, personas)
+        k = min(self.top_k, n)
+        top = np.argpartition(-personas, k - 1)[:k] if k else np.zeros(0, dtype=np.int64)
+        top = top[np.argsort(-personas[top], kind='stable')]
+
+        red_por_nivel = por_nivel.sum(axis=0).tolist()
+        self._aggregates = {
+            'total': int(personas.sum()),
+            'min': int(personas.min()) if n else 0,
+            'max': int(personas.max()) if n else 0,
+            'stations': n,
+            'levels': dict(zip(NIVELES_AFLUENCIA, red_por_nivel)),
+            'lines': {
+                linea: {
+                    'total': int(totales[j]),
+                    'max': int(maximos[j]),
+                    'stations': int(por_nivel[j].sum()),
+                    'levels': dict(zip(NIVELES_AFLUENCIA, por_nivel[j].tolist())),
+                }
+                for j, linea in enumerate(self.lines)
+            },
+            'top': [
+                {
+                    'station_id': self.station_ids[i],
+                    'nombre': self.station_names[i],
+                    'linea': self.lines[self.line_index[i]],
+                    'afluencia': int(personas[i]),
+                }
+                for i in top.tolist()
+            ],
+        }
+        return self._aggregates
+
+    def advance(self) -> np.ndarray:
+        """Avanzar un paso sólo sobre los arreglos y devolver la afluencia nueva.
+
+        Es el núcleo de ``step()`` sin construir diccionarios ni imprimir;
+        lo usan las corridas por lotes.
+        """
+        n = len(self.station_ids)
+        reloj = time.perf_counter
+        t0 = reloj()
+        anterior = self.current_people
+        # Toda la aleatoriedad del paso en una sola extracción:
+        # fila 0 = magnitud, fila 1 = dirección, fila 2 = transferencia
+        azar = self.rng.random((3, n))
+        # Rango de afluencia permitido para cada celda (estación):
+        # - Mínimo: 100 personas
+        # - Máximo: capacidad de la estación (por defecto 5000 o afluencia_inicial*2)
+        # La variación por paso es entre -1000 y +1000 (por la suma de transferencias y variación aleatoria)
+        if self.demand is None:
+            variacion_base = 100 + (azar[0] * 900).astype(np.int64)  # Mayor rango de variación
+            direccion = np.where(azar[1] < 0.4, -1, 1)  # Tendencia a aumentar
+            nuevo = anterior + variacion_base * direccion
+        else:
+            # Con modelo de demanda: acercarse al objetivo de la franja actual
+            # (consulta a la tabla) más ruido proporcional al objetivo
+            objetivo = self.demand.target(self.sim_seconds)
+            relajacion = self.demand.relaxation(self.step_seconds)
+            ruido = (azar[0] - azar[1]) * self.demand.noise * objetivo
+            nuevo = (anterior + (objetivo - anterior) * relajacion + ruido).astype(np.int64)
+        t1 = reloj()
+        nuevo = np.clip(nuevo, 100, self.capacity)
+        t2 = reloj()
+        transferencias = limites = 0.0
+
+        if self.od is not None:
+            # Viajes origen–destino por las rutas precalculadas: el origen
+            # pierde a los viajeros, el destino los gana y las estaciones y
+            # tramos intermedios registran su paso
+            atraccion = objetivo if self.demand is not None else self.capacity.astype(np.float64)
+            viajes = self.od.sample_trips(self.rng, nuevo, atraccion)
+            salida, entrada = self.od.endpoints(viajes)
+            self.station_load, self.segment_load = self.od.loads(viajes)
+            self.edge_flow = self.segment_load[:self.od.n_line_segments]
+            # Viajeros fraccionarios: redondear el saldo en lugar de truncar
+            nuevo = nuevo + np.rint(entrada - salida).astype(np.int64)
+            t3 = reloj()
+            nuevo = np.clip(nuevo, 100, self.capacity)
+            t4 = reloj()
+            transferencias, limites = t3 - t2, t4 - t3
+        # Transferencias entre estaciones conectadas: cada estación que transfiere
+        # (30% de probabilidad) envía el 20% de su afluencia a cada vecina.
+        elif self._edge_src.size:
+            transfiere = (self._degree > 0) & (azar[2] < 0.3)
+            transfer = (nuevo * 0.2).astype(np.int64)
+            flujo = np.where(transfiere[self._edge_src], transfer[self._edge_src], 0)
+            self.edge_flow = flujo
+            salida = np.bincount(self._edge_src, weights=flujo, minlength=n)
+            entrada = np.bincount(self._edge_dst, weights=flujo, minlength=n)
+            nuevo = nuevo - salida.astype(np.int64) + entrada.astype(np.int64)
+            t3 = reloj()
+            nuevo = np.clip(nuevo, 100, self.capacity)
+            t4 = reloj()
+            transferencias, limites = t3 - t2, t4 - t3
+        else:
+            # Red sin tramos (no hay aristas)
+            self.edge_flow = np.zeros(0)
+        if self.segment_tracker is not None:
+            self.segment_tracker.push(self.edge_flow)
+
+        self.sim_seconds += self.step_seconds
+        self.steps += 1
+        self.phase_times = {
+            'variation': t1 - t0,
+            'transfers': transferencias,
+            'clamping': (t2 - t1) + limites,
+        }
+        self.current_people = nuevo
+        return nuevo
 
     def get_connected_stations(self, station_id: str) -> List[str]:
-        """Obtener estaciones conectadas"""
-        linea = station_id.split('_')[0][1:]  # Extraer número de línea
-        station_cve = station_id.split('_')[1]  # Obtener CVE_EST completo
-        
-        connected = []
-        if hasattr(self, 'stations_network') and self.stations_network is not None:
-            # Obtener estaciones de la misma línea
-            line_stations = [
-                s for s in self.stations.keys() 
-                if s.startswith(f"L{linea}_")
-            ]
-            
-            # Ordenar por CVE_EST usando el código completo
-            try:
-                current_idx = line_stations.index(station_id)
-                if current_idx > 0:
-                    connected.append(line_stations[current_idx - 1])
-                if current_idx < len(line_stations) - 1:
-                    connected.append(line_stations[current_idx + 1])
-            except ValueError:
-                pass
-        
-        return connected
+        """Obtener estaciones conectadas (anterior y siguiente en la misma línea)"""
+        return list(self.neighbors.get(station_id, ()))
+
+    def get_interchange_stations(self, station_id: str) -> List[str]:
+        """Obtener las estaciones de otras líneas con las que hay transbordo"""
+        return [s for s in self._interchange_of.get(station_id, ()) if s != station_id]
 
     def run_simulation(self, steps: int) -> List[Dict]:
         """Ejecutar la simulación por un número determinado de pasos"""
@@ -164,13 +718,16 @@ class MetroAutomata:
     
     def get_current_state(self) -> Dict:
         """Obtener el estado actual de todas las estaciones"""
-        return {s: int(self.stations[s]['current_people']) for s in self.stations}
+        return dict(zip(self.station_ids, self.current_people.tolist()))
 
 # PRINCIPAL FUNCIONAMIENTO DEL AUTOMATA CELULAR:
 # - Cada estación es una celda del autómata.
 # - Cada celda tiene un estado: la afluencia actual de personas.
-# - En cada paso (step):
-#     1. La afluencia de cada estación cambia aleatoriamente (sube o baja).
-#     2. Puede haber transferencia de personas entre estaciones conectadas (vecinas).
+# - En cada paso (step), calculado para toda la red a la vez con arreglos de NumPy:
+#     1. La afluencia de cada estación cambia aleatoriamente (sube o baja), o,
+#        con modelo de demanda (demand.py), se acerca a la afluencia esperada
+#        a esa hora del día.
+#     2. Puede haber transferencia de personas entre estaciones conectadas (vecinas),
+#        o, en modo origen–destino (od_flow.py), viajes por la ruta más corta.
 #     3. El estado de cada estación se mantiene dentro de un rango permitido (100 a capacidad).
 # - Así, el sistema evoluciona en el tiempo, mostrando cómo se distribuye y mueve la afluencia en toda la red.
\ No newline at end of file
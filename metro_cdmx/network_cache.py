@@ -0,0 +1,79 @@
+import hashlib
+import logging
+import os
+import tempfile
+import zipfile
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+# Subir este número cuando cambie el contenido guardado en la caché
+CACHE_VERSION = 1
+
+# Archivos auxiliares del shapefile que también afectan a la red
+SHAPEFILE_SIDECARS = ('.dbf', '.shx', '.prj')
+
+logger = logging.getLogger(__name__)
+
+
+def _file_fingerprint(path: str) -> bytes:
+    """Huella de un archivo: ruta, mtime, tamaño y hash del contenido"""
+    if not os.path.exists(path):
+        return f"{path}:missing".encode()
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1 << 20), b''):
+            digest.update(bloque)
+    return f"{path}:{stat.st_mtime_ns}:{stat.st_size}:{digest.hexdigest()}".encode()
+
+
+def cache_key(paths: Iterable[str]) -> str:
+    """Calcular la clave de la caché a partir de los archivos de entrada"""
+    digest = hashlib.sha256(f"v{CACHE_VERSION}".encode())
+    for path in paths:
+        archivos = [path]
+        if path.lower().endswith('.shp'):
+            base = os.path.splitext(path)[0]
+            archivos += [base + ext for ext in SHAPEFILE_SIDECARS]
+        for archivo in archivos:
+            digest.update(_file_fingerprint(archivo))
+    return digest.hexdigest()
+
+
+def cache_file(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, f"network_{key[:16]}.npz")
+
+
+def load_network(path: str) -> Optional[Dict[str, np.ndarray]]:
+    """Leer la red desde la caché; None si no existe o está corrupta"""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning("Caché de la red inválida, se reconstruye: %s", e)
+        return None
+
+
+def save_arrays(path: str, arrays: Dict[str, np.ndarray]):
+    """Guardar arreglos ``.npz`` de forma atómica (archivo temporal + rename)"""
+    cache_dir = os.path.dirname(path) or '.'
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        # Permisos normales en lugar del 0600 de mkstemp
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def save_network(path: str, arrays: Dict[str, np.ndarray]):
+    """Guardar la red en la caché"""
+    save_arrays(path, arrays)
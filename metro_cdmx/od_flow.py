@@ -0,0 +1,171 @@
+"""Flujos origen–destino por las rutas más cortas de la red.
+
+El grafo son los tramos de cada línea más los transbordos entre estaciones
+que comparten nombre. Las rutas no se precalculan para todos los pares
+(eso cuesta memoria n²): el árbol de predecesores de cada origen se calcula
+con Dijkstra (``scipy.sparse.csgraph``) la primera vez que ese origen sale
+en un paso y se guarda en una caché de tamaño acotado (``ROUTE_CACHE_BYTES``,
+con expulsión del origen usado hace más tiempo).
+
+En cada paso sólo se recorren las rutas de los pares muestreados, todas a
+la vez y hacia atrás desde el destino, un tramo por iteración; la carga de
+estaciones y tramos se acumula con ``np.bincount``.
+
+Los tramos se numeran igual que las aristas del autómata
+(``_edge_src``/``_edge_dst``) y después van los transbordos.
+"""
+import logging
+from collections import OrderedDict
+from typing import NamedTuple, Tuple
+
+import numpy as np
+
+# Costo de un transbordo, en tramos equivalentes
+TRANSFER_COST = 2.0
+# Fracción de la afluencia de cada estación que inicia un viaje en cada paso
+TRIP_RATE = 0.05
+# Viajes muestreados por paso (pares origen–destino, con repetición)
+PAIRS_PER_STEP = 2000
+# Memoria para árboles de predecesores (int32[n] por origen); siempre caben
+# al menos los orígenes de un paso
+ROUTE_CACHE_BYTES = 256 * 2 ** 20
+
+logger = logging.getLogger(__name__)
+
+
+class Trips(NamedTuple):
+    """Demanda de un paso: viajeros ``weight`` de ``origin`` a ``destination``"""
+    origin: np.ndarray
+    destination: np.ndarray
+    weight: np.ndarray
+
+
+def _transfer_edges(automata) -> Tuple[np.ndarray, np.ndarray]:
+    """Aristas dirigidas entre todas las estaciones de cada grupo de transbordo"""
+    origen, destino = [], []
+    for ids in automata.interchanges.values():
+        indices = [automata.station_index[sid] for sid in ids]
+        for a in indices:
+            for b in indices:
+                if a != b:
+                    origen.append(a)
+                    destino.append(b)
+    return np.array(origen, dtype=np.int64), np.array(destino, dtype=np.int64)
+
+
+class ODRouter:
+    """Rutas más cortas bajo demanda y propagación de la demanda origen–destino"""
+
+    def __init__(self, automata, transfer_cost: float = TRANSFER_COST, trip_rate: float = TRIP_RATE,
+                 pairs_per_step: int = PAIRS_PER_STEP, cache_bytes: int = ROUTE_CACHE_BYTES):
+        from scipy import sparse
+
+        n = len(automata.station_ids)
+        self.n = n
+        self.trip_rate = trip_rate
+        self.pairs_per_step = pairs_per_step
+
+        transbordo_src, transbordo_dst = _transfer_edges(automata)
+        self.n_line_segments = len(automata._edge_src)
+        self.segment_src = np.concatenate([automata._edge_src, transbordo_src])
+        self.segment_dst = np.concatenate([automata._edge_dst, transbordo_dst])
+        self.is_transfer = np.arange(len(self.segment_src)) >= self.n_line_segments
+        pesos = np.where(self.is_transfer, transfer_cost, 1.0)
+        self.graph = sparse.csr_matrix((pesos, (self.segment_src, self.segment_dst)), shape=(n, n))
+
+        # Índice de tramo a partir de la clave ``src * n + dst`` (búsqueda binaria)
+        claves = self.segment_src * n + self.segment_dst
+        self._segment_order = np.argsort(claves, kind='stable')
+        self._segment_keys = claves[self._segment_order]
+
+        # Caché de árboles: fila ``slot`` de ``_predecessors`` para cada origen
+        capacidad = min(n, max(pairs_per_step, cache_bytes // max(4 * n, 1)))
+        self._predecessors = np.empty((max(capacidad, 1), n), dtype=np.int32)
+        self._slots: 'OrderedDict[int, int]' = OrderedDict()
+        self._slot_of = np.full(n, -1, dtype=np.int64)
+        logger.info(
+            "Rutas origen–destino: %d estaciones, %d tramos, caché de %d orígenes",
+            n, len(self.segment_src), len(self._predecessors)
+        )
+
+    def _ensure_trees(self, origins: np.ndarray) -> np.ndarray:
+        """Slot de la caché de cada origen, calculando con Dijkstra los que faltan"""
+        from scipy.sparse.csgraph import shortest_path
+
+        unicos = np.unique(origins)
+        for o in unicos[self._slot_of[unicos] >= 0].tolist():
+            self._slots.move_to_end(o)
+        faltan = unicos[self._slot_of[unicos] < 0]
+        if len(faltan):
+            if len(unicos) > len(self._predecessors):
+                raise ValueError("Más orígenes en un paso que lugares en la caché de rutas")
+            _, predecesores = shortest_path(
+                self.graph, method='D', directed=True, indices=faltan, return_predecessors=True
+            )
+            for o, fila in zip(faltan.tolist(), predecesores):
+                if len(self._slots) < len(self._predecessors):
+                    slot = len(self._slots)
+                else:
+                    # Los orígenes de este paso están al final: el primero es de otro paso
+                    viejo, slot = self._slots.popitem(last=False)
+                    self._slot_of[viejo] = -1
+                self._predecessors[slot] = fila
+                self._slots[o] = slot
+                self._slot_of[o] = slot
+        return self._slot_of[origins]
+
+    def sample_trips(self, rng: np.random.Generator, people: np.ndarray,
+                     attraction: np.ndarray) -> Trips:
+        """Demanda del paso.
+
+        Cada estación genera ``trip_rate`` de su afluencia en viajes; se
+        muestrean ``pairs_per_step`` pares con origen proporcional a esos
+        viajes y destino proporcional a ``attraction``, y el total se
+        reparte entre los que tienen ruta.
+        """
+        n = self.n
+        vacio = Trips(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0))
+        viajes = people * self.trip_rate
+        total = viajes.sum()
+        if total <= 0 or attraction.sum() <= 0:
+            return vacio
+        origen = rng.choice(n, size=self.pairs_per_step, p=viajes / total)
+        destino = rng.choice(n, size=self.pairs_per_step, p=attraction / attraction.sum())
+        # Sin ruta (misma estación o red desconectada) no hay viaje
+        slots = self._ensure_trees(origen)
+        validos = (self._predecessors[slots, destino] >= 0) & (origen != destino)
+        if not validos.any():
+            return vacio
+        origen, destino = origen[validos], destino[validos]
+        # El total se reparte sólo entre los pares con ruta
+        return Trips(origen, destino, np.full(len(origen), total / len(origen)))
+
+    def loads(self, trips: Trips) -> Tuple[np.ndarray, np.ndarray]:
+        """(carga por estación, carga por tramo) de la demanda ``trips``"""
+        n = self.n
+        estaciones = np.zeros(n)
+        tramos = np.zeros(len(self.segment_src))
+        if not len(trips.origin):
+            return estaciones, tramos
+        # Pares repetidos se recorren una sola vez con su peso sumado
+        pares, inversa = np.unique(trips.origin * n + trips.destination, return_inverse=True)
+        peso = np.bincount(inversa, weights=trips.weight)
+        origen, actual = pares // n, pares % n
+        slots = self._ensure_trees(origen)
+        estaciones += np.bincount(actual, weights=peso, minlength=n)
+        activos = np.arange(len(pares))
+        while len(activos):
+            previo = self._predecessors[slots[activos], actual[activos]].astype(np.int64)
+            clave = previo * n + actual[activos]
+            tramo = self._segment_order[np.searchsorted(self._segment_keys, clave)]
+            tramos += np.bincount(tramo, weights=peso[activos], minlength=len(tramos))
+            estaciones += np.bincount(previo, weights=peso[activos], minlength=n)
+            actual[activos] = previo
+            activos = activos[previo != origen[activos]]
+        return estaciones, tramos
+
+    def endpoints(self, trips: Trips) -> Tuple[np.ndarray, np.ndarray]:
+        """(salidas por origen, llegadas por destino) de la demanda ``trips``"""
+        salida = np.bincount(trips.origin, weights=trips.weight, minlength=self.n)
+        llegada = np.bincount(trips.destination, weights=trips.weight, minlength=self.n)
+        return salida, llegada
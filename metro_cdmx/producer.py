@@ -0,0 +1,477 @@
+import json
+import logging
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+from config import (
+    SHAPEFILE_PATH, AFLUENCIA_PATH, SIMULATION_INTERVAL, SIMULATION_SEED, NETWORK_CACHE_DIR,
+    HISTORY_BACKEND, HISTORY_BUFFERED, HISTORY_FLUSH_INTERVAL, HISTORY_MAX_BUFFER_ROWS, HISTORY_FSYNC,
+    WEBSOCKET_PORT, WEBSOCKET_QUEUE_SIZE, STEP_SUMMARY_EVERY, METRICS_DUMP_EVERY,
+    DEMAND_MODEL, DEMAND_BIN_MINUTES, SIMULATION_STEP_SECONDS, SIMULATION_START, SIMULATION_SPEED,
+    SIMULATION_MAX_BATCH, CHECKPOINT_PATH, CHECKPOINT_EVERY, WARM_START, FLOW_MODEL, OD_PAIRS_PER_STEP,
+    OD_TRIP_RATE, OD_TRANSFER_COST, SEGMENT_WINDOWS, PROFILE_MAX_SECONDS, configure_logging
+)
+import metrics
+from history import HistoryLogger, ColumnarHistoryStore, HISTORIAL_PATH, HISTORIAL_COLUMNAR_PATH, migrate_csv
+from metro_simulation import MetroAutomata
+from shared_state import SharedStatePublisher
+import sim_clock
+from websocket_server import StateBroadcaster
+
+# Variable de entorno con el nombre del segmento de memoria compartida.
+# Si está definida, los workers web leen el estado de ahí en lugar de simular.
+SHARED_STATE_ENV = 'METRO_SHARED_STATE'
+# Archivo donde el productor vuelca sus métricas para que los workers las sirvan
+PRODUCER_METRICS_ENV = 'METRO_PRODUCER_METRICS'
+# FIFO por el que los workers envían órdenes del reloj y pedidos de perfil al productor
+PRODUCER_CONTROL_ENV = 'METRO_PRODUCER_CONTROL'
+# Los perfiles pedidos por el FIFO se escriben en "<FIFO><sufijo><id>"
+PROFILE_SUFFIX = '.profile.'
+
+logger = logging.getLogger(__name__)
+
+
+def build_history_logger(readonly: bool = False):
+    """Crear el historial configurado; ``readonly`` para procesos que sólo consultan"""
+    if HISTORY_BACKEND == 'csv':
+        return HistoryLogger(
+            buffered=HISTORY_BUFFERED and not readonly,
+            flush_interval=HISTORY_FLUSH_INTERVAL,
+            max_buffer_rows=HISTORY_MAX_BUFFER_ROWS,
+            fsync=HISTORY_FSYNC
+        )
+    if (not readonly and os.path.exists(HISTORIAL_PATH)
+            and not os.path.exists(HISTORIAL_COLUMNAR_PATH + '.bin')):
+        # Primera apertura tras cambiar de backend: conservar el historial CSV
+        filas = migrate_csv(HISTORIAL_PATH, HISTORIAL_COLUMNAR_PATH)
+        logger.info("Historial CSV migrado al almacén columnar (%d registros)", filas)
+    return ColumnarHistoryStore(HISTORIAL_COLUMNAR_PATH, readonly=readonly)
+
+
+def build_automata() -> MetroAutomata:
+    return MetroAutomata(
+        SHAPEFILE_PATH, AFLUENCIA_PATH, cache_dir=NETWORK_CACHE_DIR, seed=SIMULATION_SEED
+    )
+
+
+
+def start_seconds(start: str = SIMULATION_START) -> float:
+    """Segundos desde la medianoche de ``start`` ("HH:MM") o de la hora local actual"""
+    if start:
+        horas, _, minutos = start.partition(':')
+        return int(horas) * 3600 + int(minutos or 0) * 60
+    ahora = time.localtime()
+    return ahora.tm_hour * 3600 + ahora.tm_min * 60 + ahora.tm_sec
+
+
+def configure_worker(automata):
+    """Configuración que un worker de gunicorn comparte con el productor.
+
+    Paso del reloj y ventanas de carga por tramo; la afluencia, la hora
+    simulada y la carga por tramo llegan después por memoria compartida.
+    """
+    automata.step_seconds = SIMULATION_STEP_SECONDS
+    automata.track_segments(SEGMENT_WINDOWS)
+
+
+def configure_simulation(automata, history=None):
+    """Hora de inicio del reloj simulado (o el último punto de control, con
+    ``WARM_START``), ventanas de carga por tramo, rutas origen–destino si
+    ``FLOW_MODEL`` es 'od' y, si ``DEMAND_MODEL`` es 'profile', modelo de
+    demanda por hora"""
+    configure_worker(automata)
+    automata.sim_seconds = start_seconds()
+    if WARM_START and CHECKPOINT_PATH and os.path.exists(CHECKPOINT_PATH):
+        try:
+            automata.restore(CHECKPOINT_PATH)
+            logger.info("Estado restaurado desde %s (paso %d)", CHECKPOINT_PATH, automata.steps)
+            if automata.step_seconds != SIMULATION_STEP_SECONDS:
+                logger.warning(
+                    "El punto de control usa %g s por paso; se aplica SIMULATION_STEP_SECONDS=%g",
+                    automata.step_seconds, SIMULATION_STEP_SECONDS
+                )
+                automata.step_seconds = SIMULATION_STEP_SECONDS
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No se pudo restaurar el punto de control, arranque en frío: %s", e)
+    if FLOW_MODEL == 'od':
+        import od_flow
+
+        try:
+            automata.set_flow(od_flow.ODRouter(
+                automata, transfer_cost=OD_TRANSFER_COST, trip_rate=OD_TRIP_RATE,
+                pairs_per_step=OD_PAIRS_PER_STEP
+            ))
+        except ValueError as e:
+            logger.error("Modo origen–destino desactivado: %s", e)
+    if DEMAND_MODEL != 'profile':
+        return
+    import demand
+
+    profile = demand.build_profile(automata, history=history, bin_minutes=DEMAND_BIN_MINUTES)
+    automata.set_demand(profile, SIMULATION_STEP_SECONDS, automata.sim_seconds)
+    logger.info(
+        "Modelo de demanda por hora: %d franjas, %.0f s por paso",
+        profile.bins, SIMULATION_STEP_SECONDS
+    )
+
+
+def send_control(control_path: str, orden: dict):
+    """Enviar una orden al productor por su FIFO de control.
+
+    Cada orden es una línea JSON de menos de ``PIPE_BUF`` bytes, así que
+    las escrituras de varios workers no se mezclan.
+    """
+    linea = json.dumps(orden).encode() + b'\n'
+    fd = os.open(control_path, os.O_WRONLY | os.O_NONBLOCK)
+    try:
+        os.write(fd, linea)
+    finally:
+        os.close(fd)
+
+
+def send_clock_command(control_path: str, action: str, value=None):
+    """Enviar una orden del reloj (ver ``sim_clock.CLOCK_ACTIONS``) al productor"""
+    send_control(control_path, {'action': action, 'value': value})
+
+
+def request_profile(control_path: str, seconds: float, timeout: float = 5.0) -> Optional[str]:
+    """Pedir al productor un perfil de ``seconds`` segundos de su bucle.
+
+    El productor lo escribe en un archivo temporal junto al FIFO (como el
+    volcado de métricas); devuelve su contenido o ``None`` si no llega a
+    tiempo.
+    """
+    path = f"{control_path}{PROFILE_SUFFIX}{uuid.uuid4().hex}"
+    send_control(control_path, {'action': 'profile', 'value': seconds, 'path': path})
+    limite = time.monotonic() + seconds + timeout
+    try:
+        while time.monotonic() < limite:
+            try:
+                with open(path) as f:
+                    return f.read()
+            except FileNotFoundError:
+                time.sleep(0.1)
+        return None
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SimulationProducer:
+    """Bucle de simulación a ritmo fijo y difusión del estado.
+
+    ``SimulationClock`` decide cuántos pasos tocan en cada tic: con
+    ``speed`` segundos simulados por segundo real (por omisión, un paso
+    cada ``interval`` segundos). Si el bucle va atrasado o la velocidad
+    pide más de un paso por tic, los pasos intermedios se calculan con
+    ``automata.advance()``, se escriben en el historial y sólo el último
+    se publica.
+
+    Cada paso se entrega a los destinos configurados: caché de instantáneas
+    para /events, servidor WebSocket, memoria compartida para los workers
+    de gunicorn e historial (el único sitio donde se escribe), fechado con
+    la hora simulada de ese paso (ver ``sim_timestamp``).
+
+    Con ``metrics_path`` las métricas del proceso se vuelcan a ese archivo
+    cada ``METRICS_DUMP_EVERY`` pasos, y con ``checkpoint_path`` el estado
+    se guarda cada ``checkpoint_every`` pasos del autómata y al terminar.
+    """
+
+    def __init__(self, automata, history_logger, snapshot_cache=None, broadcaster=None,
+                 publisher=None, interval=SIMULATION_INTERVAL, summary_every=STEP_SUMMARY_EVERY,
+                 metrics_path=None, speed=SIMULATION_SPEED, max_batch=SIMULATION_MAX_BATCH,
+                 checkpoint_path=None, checkpoint_every=CHECKPOINT_EVERY):
+        self.automata = automata
+        self.history_logger = history_logger
+        self.snapshot_cache = snapshot_cache
+        self.broadcaster = broadcaster
+        self.publisher = publisher
+        self.interval = interval
+        self.summary_every = summary_every
+        self.metrics_path = metrics_path
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_every = checkpoint_every
+        self._checkpoint_step = automata.steps
+        self.steps = 0
+        self._stop = threading.Event()
+        # Despierta el bucle cuando llega una orden del reloj
+        self._wake = threading.Event()
+        self._commands = queue.SimpleQueue()
+        # Hilo del bucle (para muestrearlo con /debug/profile)
+        self._thread_id = None
+        # El historial se fecha con la hora simulada: medianoche local de hoy
+        # más ``sim_seconds``, desplazada días enteros si hace falta para que
+        # los timestamps nunca retrocedan (historial previo, seek)
+        self._epoch_origin = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+        self._last_timestamp = history_logger.last_timestamp() if history_logger is not None else None
+        self._align_epoch()
+        self.clock = sim_clock.SimulationClock(
+            automata.step_seconds, speed or automata.step_seconds / (interval or 1),
+            max_batch=max_batch
+        )
+
+    def publish(self, state, log_history: bool = True):
+        if self.snapshot_cache is not None:
+            self.snapshot_cache.update(state)
+        if self.publisher is not None:
+            tracker = self.automata.segment_tracker
+            self.publisher.publish(
+                self.automata.current_people, None if tracker is None else tracker.means()
+            )
+        if self.broadcaster is not None:
+            self.broadcaster.publish(state)
+        self.publish_clock()
+        if log_history and self.history_logger is not None:
+            with metrics.HISTORY_WRITE_SECONDS.time():
+                self.history_logger.log(state, self.sim_timestamp())
+
+    def _align_epoch(self):
+        """Adelantar el origen días enteros si la hora simulada cae antes del último registro"""
+        if self._last_timestamp is None:
+            return
+        atraso = self._last_timestamp - (self._epoch_origin + self.automata.sim_seconds)
+        if atraso >= 0:
+            self._epoch_origin += (atraso // sim_clock.SECONDS_PER_DAY + 1) * sim_clock.SECONDS_PER_DAY
+
+    def sim_timestamp(self) -> int:
+        """Epoch de la hora simulada actual, siempre mayor que el último registrado.
+
+        Con pasos de menos de un segundo varios pasos caen en el mismo
+        segundo; entonces se toma el siguiente libre.
+        """
+        ts = int(self._epoch_origin + self.automata.sim_seconds)
+        if self._last_timestamp is not None and ts <= self._last_timestamp:
+            ts = self._last_timestamp + 1
+        self._last_timestamp = ts
+        return ts
+
+    def publish_clock(self):
+        if self.publisher is not None:
+            self.publisher.publish_clock(self.automata.sim_seconds, self.clock.speed, self.clock.paused)
+
+    def advance(self, steps: int = 1):
+        """Ejecutar ``steps`` pasos seguidos y publicar sólo el estado final.
+
+        Los pasos intermedios no se difunden, pero sí quedan en el historial
+        (en un solo bloque, antes del último).
+        """
+        intermedios = np.empty((steps - 1, len(self.automata.station_ids)), dtype=np.uint32)
+        momentos = np.empty(steps - 1, dtype=np.int64)
+        for i in range(steps - 1):
+            with metrics.CATCHUP_STEP_SECONDS.time():
+                intermedios[i] = self.automata.advance()
+            metrics.observe_phases(self.automata.phase_times)
+            momentos[i] = self.sim_timestamp()
+        if len(intermedios) and self.history_logger is not None:
+            with metrics.HISTORY_WRITE_SECONDS.time():
+                self.history_logger.log_batch(self.automata.station_ids, intermedios, momentos)
+        self.clock.done(steps)
+        return self.step()
+
+    def step(self):
+        with metrics.STEP_SECONDS.time():
+            state = self.automata.step()
+        metrics.observe_phases(self.automata.phase_times)
+        self.publish(state)
+        self.steps += 1
+        if self.summary_every and self.steps % self.summary_every == 0:
+            self.log_summary()
+        if self.metrics_path and self.steps % METRICS_DUMP_EVERY == 0:
+            try:
+                metrics.dump(self.metrics_path)
+            except OSError as e:
+                logger.warning("No se pudieron volcar las métricas: %s", e)
+        if (self.checkpoint_path and self.checkpoint_every
+                and self.automata.steps - self._checkpoint_step >= self.checkpoint_every):
+            self.checkpoint()
+        return state
+
+    def checkpoint(self):
+        """Guardar el estado actual en ``checkpoint_path``"""
+        if not self.checkpoint_path:
+            return
+        try:
+            self.automata.snapshot(self.checkpoint_path)
+            self._checkpoint_step = self.automata.steps
+        except OSError as e:
+            logger.warning("No se pudo guardar el punto de control: %s", e)
+
+    def log_summary(self):
+        """Una línea de resumen de la red en lugar del detalle por estación"""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        personas = self.automata.current_people
+        saturadas = int(np.count_nonzero(personas >= self.automata.capacity))
+        logger.info(
+            "Paso %d: total=%d saturadas=%d min=%d max=%d",
+            self.steps, int(personas.sum()), saturadas, int(personas.min()), int(personas.max())
+        )
+
+    def clock_status(self) -> dict:
+        estado = sim_clock.status(self.automata.sim_seconds, self.clock.speed, self.clock.paused)
+        estado.update(steps=self.clock.steps, lag=self.clock.lag(), dropped=self.clock.dropped)
+        return estado
+
+    def control(self, action: str, value=None):
+        """Encolar una orden del reloj (ver ``sim_clock.CLOCK_ACTIONS``).
+
+        La aplica el propio bucle antes del siguiente tic, así que nunca
+        coincide con un paso en curso.
+        """
+        self._commands.put(sim_clock.parse_command(action, value))
+        self._wake.set()
+
+    def _apply_commands(self):
+        while True:
+            try:
+                action, value = self._commands.get_nowait()
+            except queue.Empty:
+                return
+            if action == 'pause':
+                self.clock.pause()
+            elif action == 'resume':
+                self.clock.resume()
+            elif action == 'speed':
+                self.clock.set_speed(value)
+            elif action == 'seek':
+                # Saltar a otra hora sin simular lo intermedio
+                self.automata.sim_seconds = value
+                self._align_epoch()
+                self.clock.reset()
+            logger.info("Reloj: %s %s", action, '' if value is None else value)
+            self.publish_clock()
+
+    def listen(self, control_path: str):
+        """Atender en otro hilo las órdenes que llegan por el FIFO ``control_path``
+        (del reloj y pedidos de ``/debug/profile``)"""
+        def leer():
+            # Abierto también para escritura: nunca llega fin de archivo
+            # aunque ningún worker lo tenga abierto
+            with open(os.open(control_path, os.O_RDWR), 'rb', buffering=0) as fifo:
+                for linea in iter(fifo.readline, b''):
+                    try:
+                        orden = json.loads(linea)
+                        if orden['action'] == 'profile':
+                            self._profile_to(control_path, float(orden['value']), orden['path'])
+                        else:
+                            self.control(orden['action'], orden.get('value'))
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning("Orden del reloj inválida %r: %s", linea, e)
+
+        threading.Thread(target=leer, name='clock-control', daemon=True).start()
+
+    def _profile_to(self, control_path: str, seconds: float, path: str):
+        """Muestrear el bucle en otro hilo y dejar el perfil en ``path``"""
+        if not path.startswith(control_path + PROFILE_SUFFIX) or os.sep in path[len(control_path):]:
+            raise ValueError(f"Ruta de perfil no permitida: {path}")
+        if self._thread_id is None or not 0 < seconds <= PROFILE_MAX_SECONDS:
+            raise ValueError(f"Perfil no disponible ({seconds} s)")
+
+        def muestrear():
+            perfil = metrics.format_profile(metrics.sample_thread(self._thread_id, seconds))
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(perfil)
+            os.replace(tmp_path, path)
+
+        threading.Thread(target=muestrear, name='profile', daemon=True).start()
+
+    def run(self):
+        self._thread_id = threading.get_ident()
+        while not self._stop.is_set():
+            self._wake.clear()
+            self._apply_commands()
+            pasos = self.clock.due()
+            if pasos:
+                self.advance(pasos)
+            self._wake.wait(self.clock.wait_time())
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def run_producer_process(shm_name: str, metrics_path: str = None, control_path: str = None):
+    """Proceso productor único: simula y publica en memoria compartida.
+
+    Lo lanza ``gunicorn.conf.py`` antes de crear los workers, que esperan
+    a que exista el segmento ``shm_name``. Sus métricas se vuelcan en
+    ``metrics_path`` para que los workers las añadan a ``/metrics`` y
+    las órdenes del reloj llegan por el FIFO ``control_path``.
+    """
+    # Con SIGTERM durante el arranque, salir limpiamente (aún no hay estado que guardar)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    automata = build_automata()
+    history_logger = build_history_logger()
+    configure_simulation(automata, history_logger)
+    tracker = automata.segment_tracker
+    publisher = SharedStatePublisher(
+        automata.station_ids, name=shm_name, segment_windows=tracker.windows, n_segments=tracker.n_segments
+    )
+    broadcaster = StateBroadcaster(port=WEBSOCKET_PORT, queue_size=WEBSOCKET_QUEUE_SIZE)
+    broadcaster.start()
+    producer = SimulationProducer(
+        automata, history_logger, broadcaster=broadcaster, publisher=publisher,
+        metrics_path=metrics_path, checkpoint_path=CHECKPOINT_PATH
+    )
+    producer.publish(automata.get_current_state(), log_history=False)
+    if control_path:
+        producer.listen(control_path)
+    # Ya en marcha, SIGTERM sólo pide parar: el paso en curso termina y el
+    # punto de control se guarda fuera del bucle, nunca a mitad de un paso
+    signal.signal(signal.SIGTERM, lambda *_: producer.stop())
+    logger.info("Productor de simulación activo (pid %s, memoria compartida %s)", os.getpid(), shm_name)
+    try:
+        producer.run()
+        producer.checkpoint()
+    finally:
+        publisher.close()
+
+
+class SharedStateSync:
+    """Lado del worker: refleja en su ``MetroAutomata`` el estado publicado"""
+
+    def __init__(self, automata, reader, snapshot_cache):
+        if list(reader.station_ids) != list(automata.station_ids):
+            raise ValueError("La red del worker no coincide con la del productor")
+        self.automata = automata
+        self.reader = reader
+        self.snapshot_cache = snapshot_cache
+        self._seq = -1
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Copiar el estado sólo si el productor publicó un paso nuevo"""
+        if self.reader.seq == self._seq:
+            return
+        with self._lock:
+            if self.reader.seq == self._seq:
+                return
+            seq, values = self.reader.read()
+            self.automata.current_people = values.astype('int64')
+            self.automata.sim_seconds = self.reader.clock()[0]
+            # El seqlock avanza 2 por publicación: seq // 2 es el paso del productor,
+            # igual en todos los workers (los deltas de /state dependen de ello)
+            self.snapshot_cache.update(self.automata.get_current_state(), seq=seq // 2)
+            self._seq = seq
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Productor de simulación en memoria compartida')
+    parser.add_argument('--shm-name', required=True, help='Nombre del segmento de memoria compartida')
+    parser.add_argument('--metrics-path', help='Archivo donde volcar las métricas del productor')
+    parser.add_argument('--control-path', help='FIFO por el que llegan las órdenes del reloj')
+    args = parser.parse_args()
+    configure_logging()
+    run_producer_process(args.shm_name, args.metrics_path, args.control_path)
@@ -0,0 +1,83 @@
+"""Carga por tramo dirigido en ventanas móviles.
+
+Los tramos son las aristas dirigidas del autómata (``_edge_src`` →
+``_edge_dst``, anterior y siguiente estación de la misma línea) y el
+flujo de cada paso llega en ``MetroAutomata.edge_flow``. Sólo se guardan
+los últimos ``max(windows)`` pasos en un búfer circular; la suma de cada
+ventana se actualiza al entrar un paso (suma el nuevo, resta el que sale),
+así que consultar la carga media no recorre el historial.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+DEFAULT_WINDOWS = (10, 60)
+
+
+class SegmentLoadTracker:
+    """Búfer circular ``[pasos, tramos]`` y sumas móviles por ventana"""
+
+    def __init__(self, n_segments: int, windows: Sequence[int] = DEFAULT_WINDOWS):
+        self.windows = tuple(sorted({int(w) for w in windows if int(w) > 0}))
+        if not self.windows:
+            raise ValueError("Se necesita al menos una ventana positiva")
+        self.n_segments = n_segments
+        self.size = self.windows[-1]
+        self.buffer = np.zeros((self.size, n_segments), dtype=np.float64)
+        self.sums = np.zeros((len(self.windows), n_segments), dtype=np.float64)
+        self._head = 0
+        self.count = 0
+
+    def push(self, flow: np.ndarray):
+        """Registrar el flujo de un paso (un valor por tramo)"""
+        for j, w in enumerate(self.windows):
+            if self.count >= w:
+                self.sums[j] -= self.buffer[(self._head - w) % self.size]
+        self.sums += flow
+        self.buffer[self._head] = flow
+        self._head = (self._head + 1) % self.size
+        self.count += 1
+        if self._head == 0:
+            # Una vez por vuelta, recalcular las sumas para no acumular redondeo
+            for j, w in enumerate(self.windows):
+                self.sums[j] = self.buffer[self.size - w:].sum(axis=0)
+
+    def means(self) -> np.ndarray:
+        """Carga media por paso de cada tramo en cada ventana: ``[ventanas, tramos]``"""
+        pasos = np.minimum(self.count, self.windows)
+        return self.sums / np.maximum(pasos, 1)[:, None]
+
+
+def window_index(windows: Sequence[int], window=None) -> int:
+    """Posición de ``window`` en ``windows`` (por omisión, la más larga)"""
+    if window is None:
+        return len(windows) - 1
+    if window not in windows:
+        raise ValueError(f"Ventana no disponible: {window} (hay {', '.join(map(str, windows))})")
+    return list(windows).index(window)
+
+
+def top_k(loads: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los ``k`` tramos con más carga, de mayor a menor (ordenación parcial)"""
+    k = min(k, len(loads))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    indices = np.argpartition(-loads, k - 1)[:k]
+    return indices[np.argsort(-loads[indices], kind='stable')]
+
+
+def describe(automata, indices: np.ndarray, loads: np.ndarray) -> List[Dict]:
+    """Estaciones, línea y carga de los tramos ``indices``"""
+    salida = []
+    for i in indices.tolist():
+        a, b = int(automata._edge_src[i]), int(automata._edge_dst[i])
+        salida.append({
+            'segment': i,
+            'from': automata.station_ids[a],
+            'to': automata.station_ids[b],
+            'from_name': automata.station_names[a],
+            'to_name': automata.station_names[b],
+            'linea': automata.lines[automata.line_index[a]],
+            'load': round(float(loads[i]), 1),
+        })
+    return salida
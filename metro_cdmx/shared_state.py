@@ -0,0 +1,132 @@
+import json
+import struct
+import time
+from multiprocessing import shared_memory
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Cabecera del segmento (48 bytes):
+#   magic(4s) versión(u32) seq(u64) n_estaciones(u32) largo_esquema(u32)
+#   segundos_simulados(f64) velocidad(f64) en_pausa(u8) relleno(1)
+#   n_ventanas(u16) n_tramos(u32)
+# Después: valores uint32[n], la carga media por tramo float32[ventanas, tramos]
+# y el esquema JSON con el orden de las estaciones y las ventanas de tramos.
+# El reloj va fuera del seqlock: cada campo se escribe de una vez y pausar
+# o saltar de hora no cuenta como un paso nuevo.
+MAGIC = b'MSTS'
+VERSION = 3
+HEADER = struct.Struct('<4sIQIIddBxHI')
+SEQ_OFFSET = 8
+CLOCK_OFFSET = 24
+PAUSED_OFFSET = 40
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """Abrir un segmento existente sin que el resource_tracker lo borre al salir"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: desregistrar a mano para que el lector no lo elimine
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+class SharedStatePublisher:
+    """Escritor único del estado en memoria compartida (seqlock).
+
+    ``seq`` es impar mientras se escribe y par cuando el estado es
+    consistente; los lectores reintentan si lo ven impar o si cambió
+    durante su copia.
+    """
+
+    def __init__(self, station_ids: List[str], name: Optional[str] = None,
+                 segment_windows: Sequence[int] = (), n_segments: int = 0):
+        self.station_ids = list(station_ids)
+        self.segment_windows = list(segment_windows)
+        schema = json.dumps({'station_ids': self.station_ids, 'segment_windows': self.segment_windows}).encode()
+        n = len(self.station_ids)
+        forma = (len(self.segment_windows), n_segments if self.segment_windows else 0)
+        inicio_esquema = HEADER.size + 4 * n + 4 * forma[0] * forma[1]
+        size = inicio_esquema + len(schema)
+        self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, 0, n, len(schema), 0.0, 0.0, 0, *forma)
+        self.shm.buf[inicio_esquema:size] = schema
+        self._seq = np.ndarray((1,), dtype='<u8', buffer=self.shm.buf, offset=SEQ_OFFSET)
+        self._values = np.ndarray((n,), dtype='<u4', buffer=self.shm.buf, offset=HEADER.size)
+        self._segments = np.ndarray(forma, dtype='<f4', buffer=self.shm.buf, offset=HEADER.size + 4 * n)
+        self._clock = np.ndarray((2,), dtype='<f8', buffer=self.shm.buf, offset=CLOCK_OFFSET)
+        self._paused = np.ndarray((1,), dtype='u1', buffer=self.shm.buf, offset=PAUSED_OFFSET)
+
+    def publish(self, values: np.ndarray, segments: Optional[np.ndarray] = None):
+        self._seq[0] += 1
+        self._values[:] = values
+        if segments is not None and self._segments.size:
+            self._segments[:] = segments
+        self._seq[0] += 1
+
+    def publish_clock(self, sim_seconds: float, speed: float, paused: bool):
+        self._clock[0] = sim_seconds
+        self._clock[1] = speed
+        self._paused[0] = paused
+
+    def close(self):
+        del self._seq, self._values, self._segments, self._clock, self._paused
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedStateReader:
+    """Lector del estado publicado por ``SharedStatePublisher``"""
+
+    def __init__(self, name: str):
+        self.shm = _attach(name)
+        magic, version, _, n, schema_len, _, _, _, n_ventanas, n_tramos = HEADER.unpack_from(self.shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Segmento de memoria compartida inválido: {name}")
+        inicio = HEADER.size + 4 * n + 4 * n_ventanas * n_tramos
+        schema = json.loads(bytes(self.shm.buf[inicio:inicio + schema_len]))
+        self.station_ids = schema['station_ids']
+        self.segment_windows = schema['segment_windows']
+        forma = (n_ventanas, n_tramos)
+        self._seq = np.ndarray((1,), dtype='<u8', buffer=self.shm.buf, offset=SEQ_OFFSET)
+        # Vista directa (sin copia) de los valores; puede cambiar mientras se lee
+        self.values = np.ndarray((n,), dtype='<u4', buffer=self.shm.buf, offset=HEADER.size)
+        self.segments = np.ndarray(forma, dtype='<f4', buffer=self.shm.buf, offset=HEADER.size + 4 * n)
+        self._clock = np.ndarray((2,), dtype='<f8', buffer=self.shm.buf, offset=CLOCK_OFFSET)
+        self._paused = np.ndarray((1,), dtype='u1', buffer=self.shm.buf, offset=PAUSED_OFFSET)
+
+    @property
+    def seq(self) -> int:
+        return int(self._seq[0])
+
+    def read(self) -> Tuple[int, np.ndarray]:
+        """Copia consistente de los valores: (seq, valores)"""
+        while True:
+            antes = int(self._seq[0])
+            if antes % 2 == 0:
+                copia = self.values.copy()
+                if int(self._seq[0]) == antes:
+                    return antes, copia
+            time.sleep(0)
+
+    def read_segments(self) -> np.ndarray:
+        """Copia consistente de la carga media por tramo: ``[ventanas, tramos]``"""
+        while True:
+            antes = int(self._seq[0])
+            if antes % 2 == 0:
+                copia = self.segments.copy()
+                if int(self._seq[0]) == antes:
+                    return copia
+            time.sleep(0)
+
+    def clock(self) -> Tuple[float, float, bool]:
+        """Reloj del productor: (segundos simulados, velocidad, en pausa)"""
+        return float(self._clock[0]), float(self._clock[1]), bool(self._paused[0])
+
+    def close(self):
+        del self._seq, self.values, self.segments, self._clock, self._paused
+        self.shm.close()
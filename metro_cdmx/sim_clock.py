@@ -0,0 +1,154 @@
+"""Reloj de la simulación: cuántos pasos tocan según el reloj de pared.
+
+El ritmo es fijo: con velocidad ``speed`` (segundos simulados por segundo
+real) y ``step_seconds`` segundos simulados por paso, el paso ``k`` vence
+``k * step_seconds / speed`` segundos después del origen. Como los
+vencimientos no dependen de cuánto tardó cada paso, la duración del paso
+y de la escritura del historial no se acumulan como deriva; si el bucle
+se atrasa, ``due()`` devuelve varios pasos a la vez.
+"""
+import math
+import threading
+import time
+
+from config import SIMULATION_MAX_BATCH
+
+# Intervalo mínimo entre tics (a velocidades altas se agrupan pasos)
+MIN_TICK_SECONDS = 0.1
+CLOCK_ACTIONS = ('pause', 'resume', 'seek', 'speed')
+SECONDS_PER_DAY = 86400
+
+
+def parse_time_of_day(valor) -> float:
+    """Segundos desde la medianoche de "HH:MM[:SS]" o de un número de segundos"""
+    texto = str(valor).strip()
+    if ':' not in texto:
+        return float(texto)
+    partes = [float(p) for p in texto.split(':')]
+    if len(partes) > 3:
+        raise ValueError(f"Hora inválida: {valor}")
+    return sum(p * f for p, f in zip(partes, (3600, 60, 1)))
+
+
+def format_time_of_day(seconds: float) -> str:
+    """"HH:MM:SS" de la hora del día (el día se ignora)"""
+    total = int(seconds) % SECONDS_PER_DAY
+    return f"{total // 3600:02d}:{total % 3600 // 60:02d}:{total % 60:02d}"
+
+
+def parse_command(action: str, value=None):
+    """Validar una orden del reloj: (acción, valor normalizado)"""
+    if action not in CLOCK_ACTIONS:
+        raise ValueError(f"Orden desconocida: {action} (use {', '.join(CLOCK_ACTIONS)})")
+    if action in ('pause', 'resume'):
+        return action, None
+    if value is None or value == '':
+        raise ValueError(f"La orden '{action}' necesita un valor")
+    if action == 'seek':
+        return action, parse_time_of_day(value)
+    speed = float(value)
+    if speed <= 0:
+        raise ValueError("La velocidad debe ser positiva")
+    return action, speed
+
+
+def status(sim_seconds: float, speed: float, paused: bool) -> dict:
+    """Estado del reloj tal como lo devuelve ``/clock``"""
+    return {
+        'sim_seconds': sim_seconds,
+        'day': int(sim_seconds // SECONDS_PER_DAY),
+        'time': format_time_of_day(sim_seconds),
+        'speed': speed,
+        'paused': paused,
+    }
+
+
+class SimulationClock:
+    """Calendario de pasos a ritmo fijo, con pausa y cambio de velocidad.
+
+    ``max_batch`` son los pasos máximos por tic: más atraso se descarta en
+    lugar de perseguirlo.
+    """
+
+    def __init__(self, step_seconds: float, speed: float, max_batch: int = SIMULATION_MAX_BATCH,
+                 min_tick: float = MIN_TICK_SECONDS, now=time.monotonic):
+        if step_seconds <= 0 or speed <= 0:
+            raise ValueError("step_seconds y speed deben ser positivos")
+        self.step_seconds = float(step_seconds)
+        self.max_batch = max_batch
+        self.min_tick = min_tick
+        self._now = now
+        self._lock = threading.Lock()
+        self.speed = float(speed)
+        self.paused = False
+        self.steps = 0
+        # Pasos descartados por atraso (más de max_batch en un tic)
+        self.dropped = 0
+        self._rebase()
+
+    @property
+    def step_wall(self) -> float:
+        """Segundos reales entre pasos"""
+        return self.step_seconds / self.speed
+
+    def _rebase(self):
+        # Nuevo origen: los vencimientos se cuentan desde ahora
+        self._origin = self._now()
+        self._origin_steps = self.steps
+
+    def _owed(self) -> int:
+        transcurrido = self._now() - self._origin
+        return self._origin_steps + int(math.floor(transcurrido / self.step_wall + 1e-9)) - self.steps
+
+    def due(self) -> int:
+        """Pasos vencidos ahora (como mucho ``max_batch``); el resto se descarta"""
+        with self._lock:
+            if self.paused:
+                return 0
+            pendientes = self._owed()
+            if pendientes > self.max_batch:
+                self.dropped += pendientes - self.max_batch
+                # Seguir desde aquí en lugar de perseguir un atraso imposible
+                self._origin_steps -= pendientes - self.max_batch
+                pendientes = self.max_batch
+            return max(pendientes, 0)
+
+    def done(self, n: int):
+        """Registrar que se ejecutaron ``n`` pasos"""
+        with self._lock:
+            self.steps += n
+
+    def wait_time(self) -> float:
+        """Segundos hasta el siguiente tic"""
+        with self._lock:
+            if self.paused:
+                return self.min_tick * 10
+            siguiente = self._origin + (self.steps - self._origin_steps + 1) * self.step_wall
+            return max(siguiente - self._now(), self.min_tick if self.step_wall < self.min_tick else 0.0)
+
+    def lag(self) -> int:
+        """Pasos vencidos aún sin ejecutar"""
+        with self._lock:
+            return 0 if self.paused else max(self._owed(), 0)
+
+    def pause(self):
+        with self._lock:
+            self.paused = True
+
+    def resume(self):
+        with self._lock:
+            if self.paused:
+                self.paused = False
+                self._rebase()
+
+    def set_speed(self, speed: float):
+        if speed <= 0:
+            raise ValueError("La velocidad debe ser positiva")
+        with self._lock:
+            self.speed = float(speed)
+            self._rebase()
+
+    def reset(self):
+        """Olvidar el atraso acumulado (p. ej. después de saltar a otra hora)"""
+        with self._lock:
+            self._rebase()
@@ -0,0 +1,75 @@
+import gzip
+import hashlib
+import json
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import wire_format
+
+# Codificadores de /state por formato
+ENCODERS = {'bin': wire_format.encode_binary, 'json': wire_format.encode_json}
+
+
+class StateSnapshot:
+    """Estado de un paso ya serializado, compartido por todas las peticiones.
+
+    Las codificaciones compactas de ``/state`` se calculan la primera vez
+    que se piden y se reutilizan hasta el siguiente paso. ``previous`` es
+    ``(seq, valores)`` del paso anterior, base de los deltas.
+    """
+
+    __slots__ = ('seq', 'state', 'body', 'etag', 'values', 'previous', '_encoded')
+
+    def __init__(self, seq: int, state: Dict[str, int],
+                 previous: Optional[Tuple[int, np.ndarray]] = None):
+        self.seq = seq
+        self.state = state
+        self.body = json.dumps(state, separators=(',', ':')).encode()
+        # ETag por contenido: estados iguales dan la misma etiqueta
+        self.etag = hashlib.blake2b(self.body, digest_size=8).hexdigest()
+        self.values = np.fromiter(state.values(), dtype=np.int64, count=len(state))
+        self.previous = previous
+        self._encoded = {}
+
+    def encode(self, fmt: str, schema: int, since: Optional[int] = None,
+               compress: bool = False) -> Tuple[bytes, bool]:
+        """Cuerpo de ``/state``: (bytes, es_delta).
+
+        Sólo se envía un delta si ``since`` es el paso anterior a este;
+        en cualquier otro caso se envían los valores completos.
+        """
+        delta = since is not None and self.previous is not None and since == self.previous[0]
+        clave = (fmt, schema, delta, compress)
+        body = self._encoded.get(clave)
+        if body is None:
+            body = ENCODERS[fmt](self.values, self.seq, schema, self.previous if delta else None)
+            if compress:
+                body = gzip.compress(body, compresslevel=6, mtime=0)
+            self._encoded[clave] = body
+        return body, delta
+
+
+class SnapshotCache:
+    """Última instantánea del estado, producida una vez por ``step()``"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot: Optional[StateSnapshot] = None
+        self._seq = 0
+
+    def update(self, state: Dict[str, int], seq: Optional[int] = None) -> StateSnapshot:
+        """Publicar un estado; ``seq`` permite usar la numeración de otro proceso"""
+        with self._lock:
+            self._seq = self._seq + 1 if seq is None else seq
+            anterior = self._snapshot
+            previous = None
+            if anterior is not None and len(anterior.values) == len(state):
+                previous = (anterior.seq, anterior.values)
+            snapshot = StateSnapshot(self._seq, dict(state), previous)
+            self._snapshot = snapshot
+        return snapshot
+
+    def current(self) -> Optional[StateSnapshot]:
+        return self._snapshot
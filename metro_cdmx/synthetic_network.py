@@ -0,0 +1,170 @@
+"""Redes sintéticas con el mismo esquema que los shapefiles del STC Metro.
+
+Genera líneas (``LINEA``, ``RUTA``, LineString en UTM 14N), estaciones
+(``LINEA``, ``EST``, ``CVE_EST``, ``NOMBRE``, ``TIPO``, Point en EPSG:4326)
+y un CSV de afluencia (``linea``, ``estacion``, ``afluencia``), para probar
+la simulación, el servidor y los mapas con redes más grandes que la real.
+
+Cada línea es una caminata que cruza la zona con estaciones cada
+``spacing`` metros. ``interchange_density`` es la fracción de estaciones
+de cada línea que se fusionan con la estación más cercana de otra línea:
+toman su nombre y su posición, así que ``MetroAutomata`` las reconoce como
+transbordos igual que en la red real.
+"""
+import os
+from typing import Tuple
+
+import numpy as np
+
+import network_cache
+from metro_simulation import MetroAutomata, STATION_FILENAME, UTM_EPSG, WGS84_EPSG
+
+LINES_FILENAME = "STC_Metro_lineas_utm14n.shp"
+AFLUENCIA_FILENAME = "afluencia.csv"
+SISTEMA = "Sintético"
+# Centro de la CDMX en UTM 14N
+CENTER_UTM = (485000.0, 2148000.0)
+
+
+def _line_name(i: int) -> str:
+    return str(i + 1)
+
+
+def _walk(rng: np.random.Generator, n: int, radius: float, spacing: float) -> np.ndarray:
+    """Trazo de ``n`` estaciones que entra por el borde y cruza hacia el centro"""
+    angulo = rng.uniform(0, 2 * np.pi)
+    inicio = np.array(CENTER_UTM) + radius * np.array([np.cos(angulo), np.sin(angulo)])
+    rumbo = angulo + np.pi + rng.normal(0, 0.35)
+    giros = np.cumsum(rng.normal(0, 0.12, n - 1))
+    pasos = spacing * rng.uniform(0.7, 1.3, n - 1)
+    desplazamientos = np.column_stack([np.cos(rumbo + giros), np.sin(rumbo + giros)]) * pasos[:, None]
+    return np.vstack([inicio, inicio + np.cumsum(desplazamientos, axis=0)])
+
+
+def _merge_interchanges(rng, coords, line_of, names, density: float):
+    """Fusionar una fracción de estaciones de cada línea con la más cercana de otra"""
+    lineas = np.unique(line_of)
+    if density <= 0 or len(lineas) < 2:
+        return
+    for linea in lineas[1:]:
+        propias = np.flatnonzero(line_of == linea)
+        ajenas = np.flatnonzero(line_of < linea)
+        k = min(len(propias), int(round(density * len(propias))))
+        for i in rng.choice(propias, size=k, replace=False):
+            if len(ajenas) == 0:
+                break
+            distancias = np.hypot(*(coords[ajenas] - coords[i]).T)
+            posicion = np.argmin(distancias)
+            j = ajenas[posicion]
+            names[i] = names[j]
+            coords[i] = coords[j]
+            # Cada estación ajena se fusiona con una sola de esta línea
+            ajenas = np.delete(ajenas, posicion)
+
+
+def generate_network(n_lines: int = 12, stations_per_line: int = 16,
+                     interchange_density: float = 0.1, spacing: float = 1100.0,
+                     seed=None) -> Tuple:
+    """Generar ``(lineas, estaciones, afluencia)`` como GeoDataFrames y DataFrame.
+
+    ``stations_per_line`` puede ser un entero o una secuencia con el número
+    de estaciones de cada línea.
+    """
+    import geopandas as gpd
+    import pandas as pd
+    from shapely.geometry import LineString, Point
+
+    rng = np.random.default_rng(seed)
+    if np.isscalar(stations_per_line):
+        stations_per_line = [int(stations_per_line)] * n_lines
+    if len(stations_per_line) != n_lines or min(stations_per_line) < 2:
+        raise ValueError("Se necesitan al menos 2 estaciones en cada una de las n_lines líneas")
+
+    # Radio de la zona: crece con la red para mantener una densidad parecida
+    radius = spacing * max(stations_per_line) / 2
+    trazos = [_walk(rng, n, radius, spacing) for n in stations_per_line]
+    coords = np.vstack(trazos)
+    line_of = np.repeat(np.arange(n_lines), stations_per_line)
+    est = np.concatenate([np.arange(1, n + 1) for n in stations_per_line])
+    names = [f"Estación {_line_name(l)}-{e}" for l, e in zip(line_of, est)]
+    _merge_interchanges(rng, coords, line_of, names, interchange_density)
+
+    nombres_linea = [_line_name(l) for l in line_of]
+    repetidos = pd.Series(names).map(pd.Series(names).value_counts()) > 1
+    terminal = np.concatenate([[True] + [False] * (n - 2) + [True] for n in stations_per_line])
+    tipo = np.where(repetidos, 'Transbordo', np.where(terminal, 'Terminal', 'Intermedia'))
+    estaciones = gpd.GeoDataFrame({
+        'SISTEMA': SISTEMA,
+        'NOMBRE': names,
+        'LINEA': [n.zfill(2) for n in nombres_linea],
+        'EST': [f"{e:02d}" for e in est],
+        'CVE_EST': [f"SIN{int(n):03d}{e:03d}" for n, e in zip(nombres_linea, est)],
+        'TIPO': tipo,
+    }, geometry=[Point(x, y) for x, y in coords], crs=UTM_EPSG).to_crs(epsg=WGS84_EPSG)
+
+    inicios = np.concatenate([[0], np.cumsum(stations_per_line)[:-1]])
+    lineas = gpd.GeoDataFrame({
+        'SISTEMA': SISTEMA,
+        'LINEA': [_line_name(i) for i in range(n_lines)],
+        'RUTA': [f"{names[a]} - {names[a + n - 1]}" for a, n in zip(inicios, stations_per_line)],
+    }, geometry=[LineString(coords[a:a + n]) for a, n in zip(inicios, stations_per_line)], crs=UTM_EPSG)
+
+    afluencia = pd.DataFrame({
+        'linea': nombres_linea,
+        'estacion': names,
+        'afluencia': rng.lognormal(np.log(2000), 0.5, len(names)).astype(np.int64),
+    })
+    return lineas, estaciones, afluencia
+
+
+def write_network(out_dir: str, **kwargs) -> Tuple[str, str]:
+    """Escribir una red sintética en ``out_dir``; devuelve (shp_lineas, csv_afluencia).
+
+    Los nombres de archivo son los que espera ``MetroAutomata``, así que
+    basta con ``MetroAutomata(shp_path, afluencia_path)`` o con apuntar
+    ``SHAPEFILE_PATH`` y ``AFLUENCIA_PATH`` a ellos.
+    """
+    lineas, estaciones, afluencia = generate_network(**kwargs)
+    os.makedirs(out_dir, exist_ok=True)
+    shp_path = os.path.join(out_dir, LINES_FILENAME)
+    afluencia_path = os.path.join(out_dir, AFLUENCIA_FILENAME)
+    lineas.to_file(shp_path)
+    estaciones.to_file(os.path.join(out_dir, STATION_FILENAME))
+    afluencia.to_csv(afluencia_path, index=False)
+    return shp_path, afluencia_path
+
+
+def write_cache(cache_path: str, **kwargs) -> str:
+    """Guardar una red sintética directamente como caché ``.npz``.
+
+    Se carga con ``MetroAutomata.from_cache(cache_path)`` sin pasar por
+    shapefiles.
+    """
+    automata = MetroAutomata.from_frames(*generate_network(**kwargs))
+    network_cache.save_network(cache_path, automata._network_arrays())
+    return cache_path
+
+
+if __name__ == '__main__':
+    import argparse
+    from config import configure_logging
+
+    parser = argparse.ArgumentParser(description='Generar una red de metro sintética')
+    parser.add_argument('out', help='Directorio de salida (o archivo .npz con --cache)')
+    parser.add_argument('--lines', type=int, default=12)
+    parser.add_argument('--stations-per-line', type=int, default=16)
+    parser.add_argument('--interchange-density', type=float, default=0.1)
+    parser.add_argument('--spacing', type=float, default=1100.0, help='Metros entre estaciones')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--cache', action='store_true', help='Escribir una caché .npz en lugar de shapefiles')
+    args = parser.parse_args()
+    configure_logging()
+    opciones = dict(
+        n_lines=args.lines, stations_per_line=args.stations_per_line,
+        interchange_density=args.interchange_density, spacing=args.spacing, seed=args.seed
+    )
+    if args.cache:
+        print(f"Caché escrita en {write_cache(args.out, **opciones)}")
+    else:
+        shp_path, afluencia_path = write_network(args.out, **opciones)
+        print(f"Red escrita en {shp_path} (afluencia: {afluencia_path})")
@@ -1,8 +1,25 @@
+import base64
 import plotly.graph_objects as go
+import plotly.io as pio
 import geopandas as gpd
-import pandas as pd
+import numpy as np
 import webbrowser
 import os
+import logging
+
+from metro_simulation import MetroAutomata, UTM_EPSG, _normalize_line
+
+logger = logging.getLogger(__name__)
+
+
+def _typed_array(valores: np.ndarray) -> dict:
+    """Arreglo en el formato binario de plotly.js (base64 little-endian)"""
+    valores = np.ascontiguousarray(valores, dtype=valores.dtype.newbyteorder('<'))
+    return {
+        'dtype': f"{valores.dtype.kind}{valores.dtype.itemsize}",
+        'bdata': base64.b64encode(valores.tobytes()).decode('ascii'),
+    }
+
 
 class MetroVisualizer:
     def __init__(self, shp_path: str):
@@ -10,100 +27,118 @@ class MetroVisualizer:
         # Intentar cargar archivo de estaciones
         shp_dir = os.path.dirname(shp_path)
         station_files = [f for f in os.listdir(shp_dir) if 'estacion' in f.lower() and f.endswith('.shp')]
+        self.stations_network = None
         if station_files:
             self.stations_network = gpd.read_file(os.path.join(shp_dir, station_files[0]))
-        
+        self._index = None
+
         self.colores = {
             '1': 'pink', '2': 'blue', '3': 'olive',
             '4': 'cyan', '5': 'yellow', '6': 'red',
             '7': 'orange', '8': 'green', '9': 'brown',
-            'A': 'purple', 'B': 'gray'
+            '12': 'gold', 'A': 'purple', 'B': 'gray'
         }
 
+    def _station_index(self):
+        """Índice station_id -> (x, y, nombre, línea) en UTM, calculado una sola vez.
+
+        Usa los mismos IDs que ``MetroAutomata`` (``L<línea>_<CVE_EST>``).
+        """
+        if self._index is None:
+            index = {}
+            if self.stations_network is not None:
+                estaciones = MetroAutomata._to_crs(self.stations_network, UTM_EPSG)
+                for linea, cve_est, nombre, x, y in zip(
+                    estaciones['LINEA'], estaciones['CVE_EST'], estaciones['NOMBRE'],
+                    estaciones.geometry.x.tolist(), estaciones.geometry.y.tolist()
+                ):
+                    linea = _normalize_line(linea)
+                    index[f"L{linea}_{cve_est}"] = (x, y, str(nombre).strip(), linea)
+            self._index = index
+        return self._index
+
+    def _line_traces(self):
+        """Un trazo por línea con todas sus partes separadas por huecos (None)"""
+        lineas = MetroAutomata._to_crs(self.metro_network, UTM_EPSG)
+        partes = {}
+        for linea, geom in zip(lineas['LINEA'], lineas.geometry):
+            xs, ys = partes.setdefault(_normalize_line(linea), ([], []))
+            for parte in (geom.geoms if hasattr(geom, 'geoms') else [geom]):
+                x, y = parte.xy
+                xs.extend(x)
+                xs.append(None)
+                ys.extend(y)
+                ys.append(None)
+        return [
+            go.Scatter(
+                x=xs, y=ys, mode='lines',
+                line=dict(color=self.colores.get(linea, 'black'), width=3),
+                name=f'Línea {linea}', hoverinfo='skip'
+            )
+            for linea, (xs, ys) in partes.items()
+        ]
+
     def create_animation(self, states, output_path):
-        # Crear figura base
-        fig = go.Figure()
-        
-        # Crear frames para la animación
-        frames = []
-        for i, state in enumerate(states):
-            frame_data = []
-            
-            # Agregar líneas del metro (solo en el primer frame)
-            if i == 0:
-                for linea in self.metro_network['LINEA'].unique():
-                    linea_data = self.metro_network[self.metro_network['LINEA'] == linea]
-                    for _, row in linea_data.iterrows():
-                        x, y = row.geometry.xy
-                        fig.add_trace(
-                            go.Scatter(
-                                x=list(x), y=list(y),
-                                mode='lines',
-                                line=dict(color=self.colores.get(str(linea), 'black'), width=3),
-                                name=f'Línea {linea}'
-                            )
-                        )
-            
-            # Agregar estaciones con pasajeros y líneas de flujo
-            for station_id, people in state.items():
-                linea = station_id.split('_')[0][1:]
-                station_info = next(
-                    (s for s in self.stations_network.iterrows() 
-                     if f"L{s[1]['LINEA']}_{s[1]['CVE_EST']}" == station_id),
-                    None
-                )
-                
-                if station_info:
-                    _, station_data = station_info
-                    point = station_data.geometry
-                    nombre = station_data['NOMBRE'].strip()
-                    
-                    frame_data.append(
-                        go.Scatter(
-                            x=[point.x],
-                            y=[point.y],
-                            mode='markers+text',
-                            marker=dict(
-                                size=min(people/50, 40),
-                                color=self.colores.get(str(linea), 'red'),
-                                opacity=0.7
-                            ),
-                            text=f"{nombre}<br>{people} personas",
-                            hoverinfo='text',
-                            name=f'Estación {nombre}',
-                            showlegend=False
-                        )
-                    )
+        """Animación de la afluencia por estación a partir de los estados de ``run_simulation``.
+
+        Hay un trazo de marcadores por línea; cada frame sólo reemplaza los
+        tamaños y la afluencia (``customdata``) de esos trazos, escritos como
+        arreglos binarios de plotly.js (base64) dentro del HTML.
+        """
+        if not states:
+            raise ValueError("No hay estados para animar")
+        index = self._station_index()
+        station_ids = [sid for sid in states[0] if sid in index]
+        por_linea = {}
+        for posicion, sid in enumerate(station_ids):
+            por_linea.setdefault(index[sid][3], []).append(posicion)
+        lineas = list(por_linea)
+        posiciones = [np.array(por_linea[linea], dtype=np.int64) for linea in lineas]
 
-                    # Agregar líneas de flujo entre estaciones conectadas
-                    if hasattr(self, 'stations_network'):
-                        connected = self.get_connected_stations(station_id)
-                        for conn_id in connected:
-                            if conn_id in self.stations:
-                                start_point = point
-                                end_point = self.stations[conn_id]['geometry']
-                                
-                                frame_data.append(
-                                    go.Scatter(
-                                        x=[start_point.x, end_point.x],
-                                        y=[start_point.y, end_point.y],
-                                        mode='lines',
-                                        line=dict(
-                                            color='rgba(255,255,255,0.5)',
-                                            width=2,
-                                            dash='dot'
-                                        ),
-                                        showlegend=False
-                                    )
-                                )
+        # Afluencia de todos los pasos como una matriz [frames, estaciones]
+        afluencia = np.array(
+            [[state[sid] for sid in station_ids] for state in states], dtype=np.int64
+        )
+        tamanos = np.minimum(afluencia / 50, 40).astype(np.float32)
+        afluencia = afluencia.astype(np.int32)
 
-            frames.append(go.Frame(
-                data=frame_data,
-                name=str(i)
+        fig = go.Figure(data=self._line_traces())
+        primero = len(fig.data)
+        for linea, pos in zip(lineas, posiciones):
+            fig.add_trace(go.Scatter(
+                x=np.array([index[station_ids[p]][0] for p in pos]),
+                y=np.array([index[station_ids[p]][1] for p in pos]),
+                mode='markers',
+                marker=dict(
+                    size=tamanos[0, pos],
+                    color=self.colores.get(linea, 'red'),
+                    opacity=0.7
+                ),
+                text=[index[station_ids[p]][2] for p in pos],
+                customdata=afluencia[0, pos],
+                hovertemplate='%{text}<br>%{customdata:,} personas<extra></extra>',
+                name=f'Estaciones {linea}',
+                showlegend=False
             ))
-        
-        # Añadir frames a la figura
-        fig.frames = frames
+        trazos = list(range(primero, primero + len(lineas)))
+
+        # Frames como diccionarios con arreglos tipados: sin la validación de
+        # plotly por cada trazo, que domina el tiempo con cientos de pasos
+        frames = [
+            {
+                'name': str(i),
+                'traces': trazos,
+                'data': [
+                    {
+                        'type': 'scatter',
+                        'marker': {'size': _typed_array(tamanos[i, pos])},
+                        'customdata': _typed_array(afluencia[i, pos]),
+                    }
+                    for pos in posiciones
+                ],
+            }
+            for i in range(len(states))
+        ]
         
         # Configurar el layout
         fig.update_layout(
@@ -116,7 +151,7 @@ class MetroVisualizer:
                     'label': 'Play',
                     'method': 'animate',
                     'args': [None, {
-                        'frame': {'duration': 1000, 'redraw': True},
+                        'frame': {'duration': 1000, 'redraw': False},
                         'fromcurrent': True,
                         'transition': {'duration': 500}
                     }]
@@ -139,12 +174,16 @@ class MetroVisualizer:
         fig.update_yaxes(showgrid=True)
         
         # Guardar como HTML y mostrar mensaje
-        fig.write_html(output_path)
-        print(f"\nVisualización guardada en: {os.path.abspath(output_path)}")
-        print("\nPuedes abrir el archivo de las siguientes formas:")
-        print("1. Doble clic en el archivo en tu explorador")
-        print("2. Arrastrarlo a tu navegador web")
-        print("3. Usar el comando: python -m http.server")
+        figura = fig.to_dict()
+        figura['frames'] = frames
+        pio.write_html(figura, output_path, validate=False)
+        logger.info("Visualización guardada en: %s", os.path.abspath(output_path))
+        logger.info(
+            "Puedes abrir el archivo de las siguientes formas: "
+            "1. Doble clic en el archivo en tu explorador; "
+            "2. Arrastrarlo a tu navegador web; "
+            "3. Usar el comando: python -m http.server"
+        )
         
         # Intentar abrir automáticamente en el navegador
         try:
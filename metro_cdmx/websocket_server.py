@@ -0,0 +1,203 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import struct
+import threading
+from typing import Dict, Optional
+
+# GUID fijo del protocolo WebSocket (RFC 6455, sección 1.3)
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+MAX_CLIENT_FRAME = 64 * 1024
+_RESYNC = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_frame(payload: bytes, opcode: int = 0x1) -> bytes:
+    """Trama del servidor al cliente (sin máscara, FIN=1)"""
+    header = bytes([0x80 | opcode])
+    length = len(payload)
+    if length < 126:
+        header += bytes([length])
+    elif length < (1 << 16):
+        header += bytes([126]) + struct.pack('!H', length)
+    else:
+        header += bytes([127]) + struct.pack('!Q', length)
+    return header + payload
+
+
+async def _read_frame(reader: asyncio.StreamReader):
+    """Leer una trama del cliente; devuelve (opcode, payload)"""
+    b1, b2 = await reader.readexactly(2)
+    opcode = b1 & 0x0F
+    length = b2 & 0x7F
+    if length == 126:
+        (length,) = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        (length,) = struct.unpack('!Q', await reader.readexactly(8))
+    if length > MAX_CLIENT_FRAME:
+        raise ValueError('Trama demasiado grande')
+    mask = await reader.readexactly(4) if b2 & 0x80 else b'\x00\x00\x00\x00'
+    data = await reader.readexactly(length)
+    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(data))
+    return opcode, payload
+
+
+class _Client:
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int):
+        self.writer = writer
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.seq = 0
+
+    def offer(self, message):
+        """Encolar sin bloquear; si el cliente va atrasado se descartan sus
+        deltas pendientes y recibirá una instantánea completa"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+
+
+class StateBroadcaster:
+    """Servidor WebSocket (asyncio) que difunde cada paso de la simulación.
+
+    Al conectarse, el cliente recibe ``{"type": "snapshot", "seq", "state"}``;
+    después, por cada paso, ``{"type": "delta", "seq", "changes"}`` sólo con
+    las estaciones cuyo valor cambió. Cada cliente tiene una cola acotada:
+    si se llena, sus deltas se descartan y se le reenvía una instantánea.
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = 8765, queue_size: int = 8):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._clients = set()
+        self._state: Dict[str, int] = {}
+        self._seq = 0
+        self._ready = threading.Event()
+
+    def start(self):
+        """Arrancar el servidor en un hilo propio con su event loop"""
+        thread = threading.Thread(target=self._run, daemon=True)
+        thread.start()
+        self._ready.wait(timeout=5)
+        return thread
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port)
+        )
+        logger.info("Servidor WebSocket en ws://%s:%s", self.host, self.port)
+        self._ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+
+    def publish(self, state: Dict[str, int]):
+        """Publicar un nuevo estado; se puede llamar desde cualquier hilo"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._broadcast, dict(state))
+
+    @property
+    def client_count(self) -> int:
+        return len(self._clients)
+
+    def _snapshot_message(self) -> bytes:
+        return json.dumps(
+            {'type': 'snapshot', 'seq': self._seq, 'state': self._state},
+            separators=(',', ':')
+        ).encode()
+
+    def _broadcast(self, state: Dict[str, int]):
+        previo = self._state
+        changes = {k: v for k, v in state.items() if previo.get(k) != v}
+        self._state = state
+        self._seq += 1
+        if not changes or not self._clients:
+            return
+        message = json.dumps(
+            {'type': 'delta', 'seq': self._seq, 'changes': changes},
+            separators=(',', ':')
+        ).encode()
+        for client in self._clients:
+            client.offer((self._seq, message))
+
+    async def _handshake(self, reader, writer) -> bool:
+        request = await reader.readuntil(b'\r\n\r\n')
+        headers = {}
+        for line in request.decode('latin-1').split('\r\n')[1:]:
+            if ':' in line:
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+        key = headers.get('sec-websocket-key')
+        if headers.get('upgrade', '').lower() != 'websocket' or not key:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            await writer.drain()
+            return False
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+        writer.write((
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\n'
+            'Connection: Upgrade\r\n'
+            f'Sec-WebSocket-Accept: {accept}\r\n\r\n'
+        ).encode())
+        await writer.drain()
+        return True
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = None
+        try:
+            if not await self._handshake(reader, writer):
+                return
+            client = _Client(writer, self.queue_size)
+            client.offer(_RESYNC)
+            self._clients.add(client)
+            sender = asyncio.ensure_future(self._send_loop(client))
+            try:
+                await self._receive_loop(reader, writer)
+            finally:
+                sender.cancel()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            if client is not None:
+                self._clients.discard(client)
+            writer.close()
+
+    async def _send_loop(self, client: _Client):
+        try:
+            while True:
+                item = await client.queue.get()
+                if item is _RESYNC:
+                    seq, message = self._seq, self._snapshot_message()
+                else:
+                    seq, message = item
+                    if seq <= client.seq:
+                        continue  # ya incluido en la última instantánea
+                client.seq = seq
+                client.writer.write(_encode_frame(message))
+                await client.writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def _receive_loop(self, reader, writer):
+        """Atender control del cliente: ping -> pong, close -> cerrar"""
+        while True:
+            opcode, payload = await _read_frame(reader)
+            if opcode == 0x8:
+                writer.write(_encode_frame(payload[:2], opcode=0x8))
+                await writer.drain()
+                return
+            if opcode == 0x9:
+                writer.write(_encode_frame(payload, opcode=0xA))
+                await writer.drain()
@@ -0,0 +1,96 @@
+"""Formato compacto del estado para clientes que sondean.
+
+El esquema (orden de las estaciones, líneas y coordenadas) no cambia
+después de ``initialize_stations()``: se envía una vez en ``/schema`` y
+``/state`` manda sólo los valores en ese orden.
+
+Formato binario: cabecera ``HEADER`` (36 bytes, little-endian)
+
+    magic(4s) versión(u8) flags(u8) tipo(u8) relleno(1)
+    esquema(u64) seq(u64) base(u64) n(u32)
+
+seguida de ``n`` valores del tipo indicado. Con ``FLAG_DELTA`` los valores
+son diferencias respecto al paso ``base`` (que el cliente ya tiene); sin
+él son la afluencia completa y ``base`` vale 0.
+"""
+import hashlib
+import json
+import struct
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+WIRE_VERSION = 1
+MAGIC = b'MSTB'
+HEADER = struct.Struct('<4sBBBxQQQI')
+FLAG_DELTA = 0x1
+# Código de tipo -> dtype de NumPy (siempre little-endian)
+DTYPES = {0: np.dtype('<u2'), 1: np.dtype('<u4'), 2: np.dtype('<i2'), 3: np.dtype('<i4')}
+
+
+def schema_id(station_ids: List[str]) -> int:
+    """Identificador de 64 bits del orden de estaciones"""
+    digest = hashlib.blake2b('\n'.join(station_ids).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def build_schema(automata) -> Dict:
+    """Esquema de la red en el orden en que ``/state`` envía los valores"""
+    return {
+        'version': WIRE_VERSION,
+        'id': format(schema_id(automata.station_ids), '016x'),
+        'station_ids': list(automata.station_ids),
+        'names': list(automata.station_names),
+        'lines': list(automata.lines),
+        'line_index': automata.line_index.tolist(),
+        'capacity': automata.capacity.tolist(),
+        'coords': np.round(automata.station_coords_wgs84, 6).tolist(),
+    }
+
+
+def _dtype_code(values: np.ndarray, signed: bool) -> int:
+    if len(values) == 0:
+        return 2 if signed else 0
+    if signed:
+        return 2 if values.min() >= -(1 << 15) and values.max() < (1 << 15) else 3
+    return 0 if values.max() < (1 << 16) else 1
+
+
+def encode_binary(values: np.ndarray, seq: int, schema: int,
+                  base: Optional[Tuple[int, np.ndarray]] = None) -> bytes:
+    """Empaquetar los valores; con ``base=(seq_base, valores_base)`` como deltas"""
+    values = np.asarray(values, dtype=np.int64)
+    flags, base_seq = 0, 0
+    if base is not None:
+        base_seq, base_values = base
+        values = values - np.asarray(base_values, dtype=np.int64)
+        flags |= FLAG_DELTA
+    codigo = _dtype_code(values, signed=bool(flags & FLAG_DELTA))
+    header = HEADER.pack(MAGIC, WIRE_VERSION, flags, codigo, schema, seq, base_seq, len(values))
+    return header + values.astype(DTYPES[codigo]).tobytes()
+
+
+def decode_binary(data: bytes, base_values: Optional[np.ndarray] = None) -> Tuple[int, np.ndarray]:
+    """Inverso de ``encode_binary``: (seq, afluencia); los deltas necesitan ``base_values``"""
+    magic, version, flags, codigo, _, seq, _, n = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != WIRE_VERSION:
+        raise ValueError("Estado binario inválido")
+    values = np.frombuffer(data, dtype=DTYPES[codigo], count=n, offset=HEADER.size).astype(np.int64)
+    if flags & FLAG_DELTA:
+        if base_values is None:
+            raise ValueError("El estado es un delta y falta el estado base")
+        values = values + base_values
+    return seq, values
+
+
+def encode_json(values: np.ndarray, seq: int, schema: int,
+                base: Optional[Tuple[int, np.ndarray]] = None) -> bytes:
+    """Arreglo JSON en el orden del esquema: ``values`` completos o ``delta`` respecto a ``base``"""
+    cuerpo = {'seq': seq, 'schema': format(schema, '016x')}
+    values = np.asarray(values, dtype=np.int64)
+    if base is None:
+        cuerpo['values'] = values.tolist()
+    else:
+        cuerpo['base'] = base[0]
+        cuerpo['delta'] = (values - np.asarray(base[1], dtype=np.int64)).tolist()
+    return json.dumps(cuerpo, separators=(',', ':')).encode()